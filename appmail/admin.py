@@ -1,13 +1,28 @@
 from django.contrib import admin
 from django.contrib import messages
 from django.contrib.postgres.fields import JSONField
-from django.core.exceptions import ValidationError
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.db.models import ExpressionWrapper, F, FloatField, Max, Sum
+from django.db.models.functions import Cast
 from django.http import HttpResponseRedirect
+from django.template import TemplateSyntaxError
 from django.urls import reverse
+from django.utils.html import format_html, format_html_join
 from django.utils.translation import ugettext_lazy as _
 
-from .forms import JSONWidget
-from .models import EmailTemplate
+from .forms import EmailTemplateForm, JSONWidget
+from .models import EmailTemplate, RenderStats, SentMessage, SuppressedAddress
+
+
+RENDER_STATS_PARTS = [part for part, _label in RenderStats.PART_CHOICES]
+
+
+def _format_ms(seconds):
+    return '-' if seconds is None else '{:.2f}ms'.format(seconds * 1000)
+
+
+def _format_size(size):
+    return '-' if size is None else '{:,.0f}'.format(size)
 
 
 class ValidTemplateListFilter(admin.SimpleListFilter):
@@ -36,6 +51,10 @@ class ValidTemplateListFilter(admin.SimpleListFilter):
         provided in the query string and retrievable via
         `self.value()`.
         """
+        if self.value() not in ('0', '1'):
+            # validating means rendering every template - don't do it
+            # unless the filter is actually being applied.
+            return queryset
         valid_ids = []
         invalid_ids = []
         for obj in queryset:
@@ -53,6 +72,8 @@ class ValidTemplateListFilter(admin.SimpleListFilter):
 
 class EmailTemplateAdmin(admin.ModelAdmin):
 
+    form = EmailTemplateForm
+
     formfield_overrides = {
         JSONField: {'widget': JSONWidget},
     }
@@ -65,7 +86,12 @@ class EmailTemplateAdmin(admin.ModelAdmin):
         'has_text',
         'has_html',
         'is_valid',
-        'is_active'
+        'is_active',
+        'cost_score',
+        'render_count',
+        'mean_render_time',
+        'p95_render_time',
+        'mean_output_size',
     )
 
     list_filter = (
@@ -79,15 +105,22 @@ class EmailTemplateAdmin(admin.ModelAdmin):
         'render_subject',
         'render_text',
         'render_html',
+        'cost_score',
+        'complexity',
+        'render_statistics',
+        'profile_render',
     )
 
     search_fields = (
         'name',
-        'subject'
+        'subject',
+        'body_text_blob__content',
+        'body_html_blob__content',
     )
     actions = (
         'activate_templates',
         'deactivate_templates',
+        'promote_templates',
         'clone_templates',
         'send_test_emails',
     )
@@ -100,6 +133,7 @@ class EmailTemplateAdmin(admin.ModelAdmin):
                     'description',
                     'language',
                     'version',
+                    'engine',
                     'is_active',
                 )
             }
@@ -133,9 +167,43 @@ class EmailTemplateAdmin(admin.ModelAdmin):
                     'render_html',
                 )
             }
+        ),
+        (
+            'Render Statistics',
+            {
+                'fields': (
+                    'cost_score',
+                    'complexity',
+                    'render_statistics',
+                    'profile_render',
+                )
+            }
         )
     )
 
+    def get_queryset(self, request):
+        """Annotate the render stats (see appmail.stats), so that they are sortable."""
+        # the per-part means are summed to give the figure for a whole message,
+        # and the bodies are fetched as the changelist validates every row
+        return super(EmailTemplateAdmin, self).get_queryset(request).with_bodies().annotate(
+            stats_count=Max('render_stats__count'),
+            stats_mean_time=Sum(ExpressionWrapper(
+                F('render_stats__total_time') / F('render_stats__count'),
+                output_field=FloatField()
+            )),
+            stats_p95_time=Max('render_stats__p95_time'),
+            stats_mean_size=Sum(ExpressionWrapper(
+                Cast('render_stats__total_size', FloatField()) / F('render_stats__count'),
+                output_field=FloatField()
+            )),
+        )
+
+    def get_search_results(self, request, queryset, search_term):
+        """Use the (indexed) EmailTemplateQuerySet.search."""
+        if not search_term:
+            return queryset, False
+        return queryset.search(search_term), False
+
     def _iframe(self, url):
         return (
             "<iframe class='appmail' src='{}' onload='resizeIframe(this)'></iframe><br/>"
@@ -146,11 +214,11 @@ class EmailTemplateAdmin(admin.ModelAdmin):
     # these functions are here rather than on the model so that we can get the
     # boolean icon.
     def has_text(self, obj):
-        return len(obj.body_text or '') > 0
+        return obj.has_body_text
     has_text.boolean = True
 
     def has_html(self, obj):
-        return len(obj.body_html or '') > 0
+        return obj.has_body_html
     has_html.boolean = True
 
     def is_valid(self, obj):
@@ -162,6 +230,76 @@ class EmailTemplateAdmin(admin.ModelAdmin):
             return False
     is_valid.boolean = True
 
+    def complexity(self, obj):
+        try:
+            return str(obj.analyze())
+        except (TemplateSyntaxError, ImproperlyConfigured) as ex:
+            return str(ex)
+    complexity.short_description = _('Complexity')
+
+    def save_model(self, request, obj, form, change):
+        super(EmailTemplateAdmin, self).save_model(request, obj, form, change)
+        warning = getattr(form, 'complexity_warning', None)
+        if warning:
+            messages.warning(request, warning)
+
+    def render_count(self, obj):
+        return obj.stats_count
+    render_count.short_description = _('Renders')
+    render_count.admin_order_field = 'stats_count'
+
+    def mean_render_time(self, obj):
+        return _format_ms(obj.stats_mean_time)
+    mean_render_time.short_description = _('Mean render')
+    mean_render_time.admin_order_field = 'stats_mean_time'
+
+    def p95_render_time(self, obj):
+        return _format_ms(obj.stats_p95_time)
+    p95_render_time.short_description = _('p95 render (slowest part)')
+    p95_render_time.admin_order_field = 'stats_p95_time'
+
+    def mean_output_size(self, obj):
+        return _format_size(obj.stats_mean_size)
+    mean_output_size.short_description = _('Mean size')
+    mean_output_size.admin_order_field = 'stats_mean_size'
+
+    def render_statistics(self, obj):
+        rows = sorted(obj.render_stats.all(), key=lambda s: RENDER_STATS_PARTS.index(s.part))
+        if not rows:
+            return _("No render statistics recorded (see APPMAIL_RENDER_STATS).")
+        return format_html(
+            "<table><thead><tr><th>{}</th><th>{}</th><th>{}</th><th>{}</th><th>{}</th>"
+            "<th>{}</th></tr></thead><tbody>{}</tbody></table>",
+            _('Part'),
+            _('Renders'),
+            _('Mean render'),
+            _('p95 render'),
+            _('Mean size'),
+            _('Since'),
+            format_html_join('', "<tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td>{}</td></tr>", (
+                (
+                    s.get_part_display(),
+                    s.count,
+                    _format_ms(s.mean_time),
+                    _format_ms(s.p95_time),
+                    _format_size(s.mean_size),
+                    s.updated_at,
+                )
+                for s in rows
+            ))
+        )
+    render_statistics.short_description = _('Render statistics')
+
+    def profile_render(self, obj):
+        if obj.id is None:
+            return '-'
+        return format_html(
+            "<a href='{}'>{}</a>",
+            reverse('appmail:profile_template', kwargs={'template_id': obj.id}),
+            _("Profile render (using the test context)")
+        )
+    profile_render.short_description = _('Profile render')
+
     def render_subject(self, obj):
         if obj.id is None:
             url = ''
@@ -209,7 +347,7 @@ class EmailTemplateAdmin(admin.ModelAdmin):
 
     def clone_templates(self, request, queryset):
         selected = request.POST.getlist(admin.ACTION_CHECKBOX_NAME)
-        templates = EmailTemplate.objects.filter(pk__in=selected)
+        templates = EmailTemplate.objects.with_bodies().filter(pk__in=selected)
         for template in templates:
             template.clone()
             messages.success(request, _("Cloned template '%s'" % template.name))
@@ -232,5 +370,48 @@ class EmailTemplateAdmin(admin.ModelAdmin):
         return HttpResponseRedirect(request.path)
     deactivate_templates.short_description = _("Deactivate selected email templates")
 
+    def promote_templates(self, request, queryset):
+        selected = request.POST.getlist(admin.ACTION_CHECKBOX_NAME)
+        templates = EmailTemplate.objects.filter(pk__in=selected).order_by('version')
+        for template in templates:
+            template.promote()
+            messages.success(
+                request,
+                _("Template '%s' (%s) version %s is live" % (
+                    template.name, template.language, template.version
+                ))
+            )
+        return HttpResponseRedirect(request.path)
+    promote_templates.short_description = _("Make selected email templates live")
+
+
+class SentMessageAdmin(admin.ModelAdmin):
+
+    """Read-only view of the sent message log."""
+
+    list_display = ('recipient', 'template', 'sent_at', 'message_id')
+    list_select_related = ('template',)
+    search_fields = ('recipient', 'message_id')
+    date_hierarchy = 'sent_at'
+    raw_id_fields = ('template',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+class SuppressedAddressAdmin(admin.ModelAdmin):
+
+    """Addresses that messages are not sent to - see appmail.suppression."""
+
+    list_display = ('address', 'reason', 'created_at')
+    list_filter = ('reason',)
+    search_fields = ('address',)
+    date_hierarchy = 'created_at'
+
 
 admin.site.register(EmailTemplate, EmailTemplateAdmin)
+admin.site.register(SuppressedAddress, SuppressedAddressAdmin)
+admin.site.register(SentMessage, SentMessageAdmin)
@@ -0,0 +1,283 @@
+"""
+Static template complexity analysis.
+
+EmailTemplate.clean() proves that a template renders with an empty context,
+which says nothing about how expensive it will be with a real one. This
+module walks the compiled template - the Django nodelist, or the Jinja2
+AST - and reports:
+
+    * the number of nodes (tags, variables and text)
+    * the maximum depth of nested loops
+    * the number of {% include %} tags
+    * the filters used
+    * the size of the source
+
+from which a rough cost score is estimated. The score is a relative
+measure, not a time: each node costs 1, multiplied by LOOP_MULTIPLIER for
+each loop it is nested in (as it will be rendered once per iteration),
+each include costs INCLUDE_COST (the included template is not analysed),
+and every SIZE_UNIT characters of source costs 1.
+
+The score is stored on EmailTemplate.cost_score when a template is saved,
+and the admin form warns / rejects templates that score above
+APPMAIL_COMPLEXITY_WARN / APPMAIL_COMPLEXITY_MAX.
+
+It also lists the variable paths that a template looks up (such as
+('order', 'customer', 'name')), from which appmail.prefetch plans the
+select_related / prefetch_related calls for a queryset of context objects.
+
+"""
+from django.template.base import FilterExpression, NodeList, Variable, VariableNode
+from django.template.defaulttags import ForNode, WithNode
+from django.template.loader_tags import IncludeNode
+from django.template.smartif import TokenBase
+
+try:
+    from jinja2 import nodes as jinja2_nodes
+except ImportError:  # pragma: no cover
+    jinja2_nodes = None
+
+# assumed number of iterations of each loop
+LOOP_MULTIPLIER = 10
+INCLUDE_COST = 50
+SIZE_UNIT = 1000
+
+
+class TemplateAnalysis(object):
+
+    """Complexity metrics for a template (or a combination of templates)."""
+
+    def __init__(self, size=0):
+        self.size = size
+        self.node_count = 0
+        self.loop_depth = 0
+        self.includes = 0
+        self.filters = set()
+        # sum of node weights, by loop depth
+        self.weight = 0
+
+    def add_node(self, depth):
+        self.node_count += 1
+        self.loop_depth = max(self.loop_depth, depth)
+        self.weight += LOOP_MULTIPLIER ** depth
+
+    @property
+    def cost(self):
+        """Estimated relative cost of rendering the template."""
+        return int(self.weight + self.includes * INCLUDE_COST + self.size / SIZE_UNIT)
+
+    def __add__(self, other):
+        combined = TemplateAnalysis(self.size + other.size)
+        combined.node_count = self.node_count + other.node_count
+        combined.loop_depth = max(self.loop_depth, other.loop_depth)
+        combined.includes = self.includes + other.includes
+        combined.filters = self.filters | other.filters
+        combined.weight = self.weight + other.weight
+        return combined
+
+    def as_dict(self):
+        return {
+            'nodes': self.node_count,
+            'loop_depth': self.loop_depth,
+            'includes': self.includes,
+            'filters': sorted(self.filters),
+            'size': self.size,
+            'cost': self.cost,
+        }
+
+    def __str__(self):
+        return (
+            "cost {cost}: {nodes} nodes, loop depth {loop_depth}, {includes} includes, "
+            "{size} characters; filters: {filters}".format(
+                **dict(self.as_dict(), filters=', '.join(sorted(self.filters)) or '-')
+            )
+        )
+
+
+def analyze_django(template, size=0):
+    """Return TemplateAnalysis for a compiled Django Template."""
+    analysis = TemplateAnalysis(size)
+
+    def walk(nodelist, depth):
+        for node in nodelist:
+            analysis.add_node(depth)
+            if isinstance(node, VariableNode):
+                analysis.filters.update(_django_filters(node.filter_expression))
+            elif isinstance(node, IncludeNode):
+                analysis.includes += 1
+            elif isinstance(node, ForNode):
+                analysis.filters.update(_django_filters(node.sequence))
+            for attr in node.child_nodelists:
+                # only the loop body is repeated, not {% empty %}
+                child_depth = depth + 1 if attr == 'nodelist_loop' else depth
+                walk(getattr(node, attr, None) or [], child_depth)
+
+    walk(template.nodelist, 0)
+    return analysis
+
+
+def _django_filters(filter_expression):
+    for func, _args in getattr(filter_expression, 'filters', []):
+        yield getattr(func, '_filter_name', func.__name__)
+
+
+def analyze_jinja2(environment, source):
+    """Return TemplateAnalysis for Jinja2 source."""
+    analysis = TemplateAnalysis(len(source))
+    counted = (jinja2_nodes.Stmt, jinja2_nodes.Name, jinja2_nodes.TemplateData)
+
+    def visit(node, depth):
+        if isinstance(node, counted):
+            analysis.add_node(depth)
+        if isinstance(node, jinja2_nodes.Filter):
+            analysis.filters.add(node.name)
+        elif isinstance(node, jinja2_nodes.Include):
+            analysis.includes += 1
+        if isinstance(node, jinja2_nodes.For):
+            # the loop target / iterable are evaluated once, the body repeatedly
+            for child in node.iter_child_nodes(only=('target', 'iter')):
+                visit(child, depth)
+            for child in node.iter_child_nodes(only=('body', 'else_', 'test')):
+                visit(child, depth + 1)
+        else:
+            for child in node.iter_child_nodes():
+                visit(child, depth)
+
+    visit(environment.parse(source), 0)
+    return analysis
+
+
+def filter_expressions(value):
+    """Yield the FilterExpressions in a Django node attribute value."""
+    if isinstance(value, FilterExpression):
+        yield value
+    elif isinstance(value, (list, tuple)) and not isinstance(value, NodeList):
+        for item in value:
+            yield from filter_expressions(item)
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from filter_expressions(item)
+    elif isinstance(value, TokenBase):
+        # {% if %} conditions - operators and literals
+        for attr in ('first', 'second', 'value'):
+            yield from filter_expressions(getattr(value, attr, None))
+
+
+def _alias(path, aliases):
+    """Expand a path that starts with a loop / with variable."""
+    if path and path[0] in aliases:
+        if aliases[path[0]] is None:
+            return None
+        return aliases[path[0]] + path[1:]
+    return path
+
+
+def _django_paths(filter_expression, aliases):
+    variables = [filter_expression.var] + [
+        arg for _func, args in filter_expression.filters for is_var, arg in args if is_var
+    ]
+    for variable in variables:
+        if isinstance(variable, Variable) and variable.lookups:
+            path = _alias(tuple(variable.lookups), aliases)
+            if path:
+                yield path
+
+
+def variable_paths_django(template):
+    """
+    Return the set of variable paths looked up by a compiled Django Template.
+
+    Each path is a tuple of lookups, e.g. ('order', 'customer', 'name').
+    Paths that start with a {% for %} or {% with %} variable are expanded
+    to the path it is bound to - so within {% for line in order.lines.all %}
+    {{ line.product }} is ('order', 'lines', 'all', 'product').
+
+    """
+    paths = set()
+
+    def walk(nodelist, aliases):
+        for node in nodelist:
+            child_aliases = aliases
+            if isinstance(node, ForNode):
+                sequence = list(_django_paths(node.sequence, aliases))
+                paths.update(sequence)
+                child_aliases = dict(aliases)
+                bound = isinstance(node.sequence.var, Variable) and sequence
+                for loopvar in node.loopvars:
+                    # unpacked loop variables can't be followed
+                    child_aliases[loopvar] = sequence[0] if bound and len(node.loopvars) == 1 else None
+            elif isinstance(node, WithNode):
+                child_aliases = dict(aliases)
+                for name, expression in node.extra_context.items():
+                    bound = list(_django_paths(expression, aliases))
+                    paths.update(bound)
+                    child_aliases[name] = bound[0] if isinstance(expression.var, Variable) and bound else None
+            else:
+                for value in vars(node).values():
+                    for expression in filter_expressions(value):
+                        paths.update(_django_paths(expression, aliases))
+            for attr in node.child_nodelists:
+                walk(getattr(node, attr, None) or [], child_aliases)
+
+    walk(template.nodelist, {})
+    return paths
+
+
+def _jinja2_path(node, aliases):
+    """Return the path of a Jinja2 expression (or None)."""
+    if isinstance(node, jinja2_nodes.Name):
+        return _alias((node.name,), aliases)
+    if isinstance(node, jinja2_nodes.Getattr):
+        path = _jinja2_path(node.node, aliases)
+        return path and path + (node.attr,)
+    if isinstance(node, jinja2_nodes.Getitem) and isinstance(node.arg, jinja2_nodes.Const):
+        path = _jinja2_path(node.node, aliases)
+        return path and path + (str(node.arg.value),)
+    if isinstance(node, jinja2_nodes.Call) and not node.args and not node.kwargs:
+        # e.g. order.lines.all()
+        return _jinja2_path(node.node, aliases)
+    return None
+
+
+def variable_paths_jinja2(environment, source):
+    """Return the set of variable paths looked up by Jinja2 source."""
+    paths = set()
+    expressions = (jinja2_nodes.Name, jinja2_nodes.Getattr, jinja2_nodes.Getitem, jinja2_nodes.Call)
+
+    def bind(target, value, aliases):
+        path = _jinja2_path(value, aliases)
+        if isinstance(target, jinja2_nodes.Name):
+            aliases[target.name] = path
+        else:
+            for name in target.find_all(jinja2_nodes.Name):
+                aliases[name.name] = None
+
+    def visit(node, aliases):
+        if isinstance(node, expressions):
+            path = _jinja2_path(node, aliases)
+            if path:
+                paths.add(path)
+        if isinstance(node, jinja2_nodes.For):
+            for child in node.iter_child_nodes(only=('iter',)):
+                visit(child, aliases)
+            loop_aliases = dict(aliases)
+            bind(node.target, node.iter, loop_aliases)
+            for child in node.iter_child_nodes(only=('body', 'else_', 'test')):
+                visit(child, loop_aliases)
+        elif isinstance(node, jinja2_nodes.With):
+            with_aliases = dict(aliases)
+            for target, value in zip(node.targets, node.values):
+                visit(value, aliases)
+                bind(target, value, with_aliases)
+            for child in node.body:
+                visit(child, with_aliases)
+        elif isinstance(node, jinja2_nodes.Assign):
+            visit(node.node, aliases)
+            # {% set %} applies to the rest of the enclosing scope
+            bind(node.target, node.node, aliases)
+        else:
+            for child in node.iter_child_nodes():
+                visit(child, aliases)
+
+    visit(environment.parse(source), {})
+    return paths
@@ -1,7 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_save
 
 
 class AppmailConfig(AppConfig):
 
     name = 'appmail'
     configs = []
+
+    def ready(self):
+        from . import routers
+        # pin reads to the primary after a write - see appmail.routers
+        post_save.connect(routers.on_save, dispatch_uid='appmail.routers.on_save')
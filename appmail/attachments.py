@@ -0,0 +1,255 @@
+"""
+Attachments that are read from storage (or disk) at serialization time.
+
+Attaching a file with the standard EmailMessage.attach reads it into memory
+for every message, and base64-encodes it again for every recipient. The
+attachment classes here are MIME parts whose payload is only loaded when
+the message is serialized, streamed from a Django Storage (or mmap'd from a
+local path), and the encoded payload is cached by content hash - so a
+campaign attaching the same file to 50k messages reads and encodes it once.
+Each attachment keeps its payload once loaded, as serializing a message
+reads it several times.
+
+    >>> attachment = StorageAttachment('invoices/terms.pdf')
+    >>> template.create_message(context, to=[...], attachments=[attachment])
+
+"""
+import base64
+import collections
+import hashlib
+import mimetypes
+import mmap
+import os
+import pathlib
+import threading
+from email.mime.base import MIMEBase
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+
+from .settings import ATTACHMENT_CACHE_SIZE
+
+# read size - a multiple of 57 bytes, so that each base64-encoded chunk is
+# a whole number of 76 character lines.
+CHUNK_SIZE = 57 * 1024
+
+
+class PayloadCache(object):
+
+    """
+    Thread-safe LRU cache of encoded payloads, bounded by total size.
+
+    Payloads are keyed by content digest; file signatures (name, size,
+    modified time) are mapped to digests so that an unchanged file is
+    not re-read to compute its hash.
+
+    """
+
+    def __init__(self, max_size=ATTACHMENT_CACHE_SIZE):
+        self.max_size = max_size
+        self.size = 0
+        self.payloads = collections.OrderedDict()
+        self.digests = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.payloads)
+
+    def get(self, signature):
+        """Return the cached payload for a file signature, or None."""
+        if signature is None:
+            return None
+        with self._lock:
+            return self._get(self.digests.get(signature))
+
+    def get_by_digest(self, digest):
+        """Return the cached payload for a content digest, or None."""
+        with self._lock:
+            return self._get(digest)
+
+    def _get(self, digest):
+        if digest not in self.payloads:
+            return None
+        self.payloads.move_to_end(digest)
+        return self.payloads[digest]
+
+    def set(self, signature, digest, payload):
+        """Cache a payload, evicting least recently used entries."""
+        with self._lock:
+            if signature is not None:
+                self.digests[signature] = digest
+            if digest in self.payloads:
+                return self.payloads[digest]
+            if len(payload) > self.max_size:
+                return payload
+            self.payloads[digest] = payload
+            self.size += len(payload)
+            while self.size > self.max_size:
+                evicted, value = self.payloads.popitem(last=False)
+                self.size -= len(value)
+                self.digests = {k: v for k, v in self.digests.items() if v != evicted}
+            return payload
+
+    def clear(self):
+        with self._lock:
+            self.payloads.clear()
+            self.digests.clear()
+            self.size = 0
+
+
+cache = PayloadCache()
+
+
+def encode_chunks(chunks):
+    """Hash and base64-encode an iterable of bytes; return (digest, payload)."""
+    digest = hashlib.sha256()
+    encoded = []
+    remainder = b''
+    for chunk in chunks:
+        digest.update(chunk)
+        chunk = remainder + bytes(chunk)
+        cut = len(chunk) - len(chunk) % 57
+        encoded.append(base64.encodebytes(chunk[:cut]))
+        remainder = chunk[cut:]
+    encoded.append(base64.encodebytes(remainder))
+    return digest.hexdigest(), b''.join(encoded).decode('ascii')
+
+
+class Attachment(MIMEBase):
+
+    """
+    Base class for lazily-loaded, cached attachments.
+
+    Subclasses must implement `signature` (a hashable that changes if the
+    file content changes, or None if that cannot be determined cheaply)
+    and `chunks` (an iterator over the file content).
+
+    """
+
+    def __init__(self, filename, mimetype=None):
+        mimetype = mimetype or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        self._raw_payload = None
+        self._loaded_payload = None
+        maintype, subtype = mimetype.split('/', 1)
+        super(Attachment, self).__init__(maintype, subtype)
+        self.filename = filename
+        self['Content-Transfer-Encoding'] = 'base64'
+        self.add_header('Content-Disposition', 'attachment', filename=filename)
+
+    @property
+    def signature(self):
+        raise NotImplementedError()
+
+    def chunks(self):
+        raise NotImplementedError()
+
+    def load(self):
+        """Return the encoded payload, from cache if possible."""
+        if self._loaded_payload is None:
+            self._loaded_payload = self._load()
+        return self._loaded_payload
+
+    def _load(self):
+        signature = self.signature
+        if signature is not None:
+            payload = cache.get(signature)
+            if payload is None:
+                digest, payload = encode_chunks(self.chunks())
+                payload = cache.set(signature, digest, payload)
+            return payload
+        # the file must be read to tell whether it has changed - but a
+        # cached payload saves encoding it
+        chunks = list(self.chunks())
+        digest = hashlib.sha256()
+        for chunk in chunks:
+            digest.update(chunk)
+        payload = cache.get_by_digest(digest.hexdigest())
+        if payload is None:
+            digest, payload = encode_chunks(chunks)
+            payload = cache.set(None, digest, payload)
+        return payload
+
+    # the email package accesses the payload via the `_payload` attribute
+    # when serializing, so it is loaded on first access rather than when
+    # the message is created.
+    def _get_payload(self):
+        if self._raw_payload is None:
+            return self.load()
+        return self._raw_payload
+
+    def _set_payload(self, value):
+        self._raw_payload = value
+
+    _payload = property(_get_payload, _set_payload)
+
+
+class StorageAttachment(Attachment):
+
+    """Attachment streamed from a Django Storage (defaults to default_storage)."""
+
+    def __init__(self, name, storage=None, filename=None, mimetype=None):
+        self.name = name
+        self.storage = storage or default_storage
+        super(StorageAttachment, self).__init__(
+            filename or os.path.basename(name),
+            mimetype=mimetype
+        )
+
+    @property
+    def signature(self):
+        try:
+            modified = self.storage.get_modified_time(self.name)
+        except NotImplementedError:
+            return None
+        return (
+            self.storage.__class__.__name__,
+            self.name,
+            self.storage.size(self.name),
+            modified
+        )
+
+    def chunks(self):
+        with self.storage.open(self.name, 'rb') as f:
+            for chunk in f.chunks(chunk_size=CHUNK_SIZE):
+                yield chunk
+
+
+class FileAttachment(Attachment):
+
+    """Attachment mmap'd from a local file path."""
+
+    def __init__(self, path, filename=None, mimetype=None):
+        self.path = os.fspath(path)
+        super(FileAttachment, self).__init__(
+            filename or os.path.basename(self.path),
+            mimetype=mimetype
+        )
+
+    @property
+    def signature(self):
+        stat = os.stat(self.path)
+        return (self.path, stat.st_size, stat.st_mtime_ns)
+
+    def chunks(self):
+        with open(self.path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for i in range(0, len(mm), CHUNK_SIZE):
+                    yield mm[i:i + CHUNK_SIZE]
+
+
+def to_mime(attachment):
+    """
+    Convert a create_message attachment into something EmailMessage accepts.
+
+    Supports Django File objects that have a storage (e.g. FileField values)
+    and pathlib.Path objects, as well as the standard MIMEBase instances and
+    (filename, content, mimetype) tuples, which are passed through.
+
+    """
+    if isinstance(attachment, File) and getattr(attachment, 'storage', None):
+        return StorageAttachment(attachment.name, storage=attachment.storage)
+    if isinstance(attachment, pathlib.PurePath):
+        return FileAttachment(attachment)
+    return attachment
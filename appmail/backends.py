@@ -0,0 +1,446 @@
+"""
+Email backends for use with appmail-created messages.
+
+The PooledEmailBackend is a drop-in replacement for Django's SMTP backend
+that keeps a bounded pool of open SMTP connections per process, so that
+successive sends (from any thread) reuse an authenticated connection rather
+than paying for TCP + TLS + AUTH on each message.
+
+    # settings.py
+    APPMAIL_EMAIL_BACKEND = 'appmail.backends.PooledEmailBackend'
+
+The MailboxEmailBackend writes messages to a local maildir or mbox instead
+of sending them - for load testing and capacity planning without an SMTP
+server, and for comparing the output of different template versions. As
+with the SMTP pool, each process keeps its mailboxes open, so that sending
+one message at a time does not reopen (and, for mbox, rescan) the mailbox.
+
+"""
+import atexit
+import logging
+import mailbox
+import os
+import smtplib
+import threading
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.mail.backends.smtp import EmailBackend as SMTPEmailBackend
+
+from .settings import (
+    BACKEND_POOL_SIZE,
+    BACKEND_POOL_TIMEOUT,
+    BACKEND_MAX_MESSAGES,
+    BACKEND_IDLE_TIMEOUT,
+    MAILBOX_BATCH_SIZE,
+    MAILBOX_FORMAT,
+    MAILBOX_NORMALIZE,
+    MAILBOX_PATH,
+    MAILBOX_SHARD,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+
+    """Raised when no pooled connection becomes available in time."""
+
+    pass
+
+
+class PooledConnection(object):
+
+    """An open SMTP connection along with its usage statistics."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.sent = 0
+        self.last_used = time.monotonic()
+        self.broken = False
+
+    def is_expired(self, max_messages, idle_timeout):
+        """Return True if the connection should be recycled."""
+        if self.broken:
+            return True
+        if max_messages and self.sent >= max_messages:
+            return True
+        if idle_timeout and time.monotonic() - self.last_used > idle_timeout:
+            return True
+        return False
+
+    def is_alive(self):
+        """Health check the connection with an SMTP NOOP."""
+        try:
+            return self.connection.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def close(self):
+        """Close the underlying connection, ignoring any errors."""
+        try:
+            self.connection.quit()
+        except (smtplib.SMTPException, OSError):
+            try:
+                self.connection.close()
+            except (smtplib.SMTPException, OSError):
+                pass
+
+
+class ConnectionPool(object):
+
+    """
+    Thread-safe, bounded pool of SMTP connections.
+
+    Connections are created on demand by the `connect` callable, up to
+    `size` connections in total (idle + in use). Idle connections are
+    checked with NOOP before being handed out, and are recycled once they
+    have sent `max_messages` messages or been idle for `idle_timeout`
+    seconds.
+
+    """
+
+    def __init__(self, size=BACKEND_POOL_SIZE, max_messages=BACKEND_MAX_MESSAGES,
+                 idle_timeout=BACKEND_IDLE_TIMEOUT, timeout=BACKEND_POOL_TIMEOUT):
+        self.size = size
+        self.max_messages = max_messages
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._idle = []
+        self._in_use = 0
+        self._condition = threading.Condition()
+
+    def __len__(self):
+        """Return the total number of open connections."""
+        with self._condition:
+            return len(self._idle) + self._in_use
+
+    def acquire(self, connect):
+        """Return an open PooledConnection, creating one if required."""
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        pooled = None
+        with self._condition:
+            while self._in_use >= self.size:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise PoolTimeout("No SMTP connection available after %ss" % self.timeout)
+                self._condition.wait(remaining)
+            # reserve the slot before releasing the lock
+            self._in_use += 1
+            if self._idle:
+                pooled = self._idle.pop()
+        # expiry / health checks happen outside of the lock - NOOP is a
+        # network round trip, as is closing a stale connection.
+        if pooled is not None:
+            if not pooled.is_expired(self.max_messages, self.idle_timeout) and pooled.is_alive():
+                return pooled
+            pooled.close()
+        try:
+            return PooledConnection(connect())
+        except Exception:
+            with self._condition:
+                self._in_use -= 1
+                self._condition.notify()
+            raise
+
+    def release(self, pooled):
+        """Return a connection to the pool (or close it if it has expired)."""
+        pooled.last_used = time.monotonic()
+        if pooled.is_expired(self.max_messages, self.idle_timeout):
+            pooled.close()
+            pooled = None
+        with self._condition:
+            self._in_use -= 1
+            if pooled is not None:
+                self._idle.append(pooled)
+            self._condition.notify()
+
+    def close(self):
+        """Close all idle connections."""
+        with self._condition:
+            idle, self._idle = self._idle, []
+        for pooled in idle:
+            pooled.close()
+
+
+# process-wide pools, keyed on the SMTP connection parameters
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(key):
+    """Return the ConnectionPool for a given connection key."""
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool()
+        return _pools[key]
+
+
+def close_pools():
+    """Close all idle pooled connections in this process."""
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close()
+
+
+class PooledEmailBackend(SMTPEmailBackend):
+
+    """
+    SMTP email backend that borrows connections from a process-wide pool.
+
+    Calling `close()` (which Django does at the end of `send_messages` and
+    when the backend is used as a context manager) returns the connection to
+    the pool rather than quitting it.
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(PooledEmailBackend, self).__init__(*args, **kwargs)
+        self.pooled = None
+
+    @property
+    def pool_key(self):
+        return (self.host, self.port, self.username, self.use_tls, self.use_ssl)
+
+    @property
+    def pool(self):
+        return get_pool(self.pool_key)
+
+    def _connect(self):
+        """Open a new SMTP connection using the standard backend."""
+        super(PooledEmailBackend, self).open()
+        connection, self.connection = self.connection, None
+        if connection is None:
+            # open() failed silently
+            raise smtplib.SMTPConnectError(-1, "Unable to connect to SMTP server")
+        return connection
+
+    def open(self):
+        if self.connection:
+            return False
+        try:
+            self.pooled = self.pool.acquire(self._connect)
+        except (smtplib.SMTPException, OSError, PoolTimeout):
+            if not self.fail_silently:
+                raise
+            return None
+        self.connection = self.pooled.connection
+        return True
+
+    def close(self):
+        if self.pooled is None:
+            return super(PooledEmailBackend, self).close()
+        pooled, self.pooled = self.pooled, None
+        self.connection = None
+        self.pool.release(pooled)
+
+    def _send(self, email_message):
+        try:
+            sent = super(PooledEmailBackend, self)._send(email_message)
+        except (smtplib.SMTPServerDisconnected, OSError):
+            if self.pooled is not None:
+                self.pooled.broken = True
+            raise
+        if sent and self.pooled is not None:
+            self.pooled.sent += 1
+        return sent
+
+
+# headers that differ on every send, removed from normalized messages
+VOLATILE_HEADERS = ('Date', 'Message-ID')
+
+# fixed mbox "From " line for normalized messages (the default has the time)
+NORMALIZED_FROM_LINE = b'From MAILER-DAEMON Thu Jan  1 00:00:00 1970\n'
+
+
+def normalize_message(message):
+    """
+    Make a MIME message repeatable, so that output can be diffed.
+
+    Removes the Date and Message-ID headers and replaces the (random)
+    multipart boundaries with fixed ones.
+
+    """
+    for header in VOLATILE_HEADERS:
+        del message[header]
+    for i, part in enumerate(message.walk()):
+        if part.is_multipart():
+            part.set_boundary('===============appmail-{}=='.format(i))
+    return message
+
+
+class SharedMailbox(object):
+
+    """A maildir or mbox kept open by a process, shared by its backends."""
+
+    def __init__(self, path, format):
+        self.format = format
+        if format == 'maildir':
+            self.mailbox = mailbox.Maildir(path, factory=None, create=True)
+        else:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.mailbox = mailbox.mbox(path, create=True)
+        self._lock = threading.Lock()
+
+    def add(self, batch):
+        """Write a batch of serialized messages."""
+        with self._lock:
+            # mbox is locked once per batch, rather than once per message
+            if self.format == 'mbox':
+                self.mailbox.lock()
+            try:
+                for data in batch:
+                    self.mailbox.add(data)
+                self.mailbox.flush()
+            finally:
+                if self.format == 'mbox':
+                    self.mailbox.unlock()
+
+    def close(self):
+        with self._lock:
+            self.mailbox.close()
+
+
+# process-wide mailboxes, keyed on (process id, path, format) - a forked
+# process must not share its parent's file (or its lock)
+_mailboxes = {}
+_mailboxes_lock = threading.Lock()
+
+
+def get_mailbox(path, format):
+    """Return the SharedMailbox for a path and format."""
+    key = (os.getpid(), path, format)
+    with _mailboxes_lock:
+        if key not in _mailboxes:
+            _mailboxes[key] = SharedMailbox(path, format)
+        return _mailboxes[key]
+
+
+def close_mailboxes():
+    """Close all the mailboxes opened by this process."""
+    with _mailboxes_lock:
+        mailboxes = [m for (pid, _path, _format), m in _mailboxes.items() if pid == os.getpid()]
+        _mailboxes.clear()
+    for shared in mailboxes:
+        shared.close()
+
+
+atexit.register(close_mailboxes)
+
+
+class MailboxEmailBackend(BaseEmailBackend):
+
+    """
+    Email backend that writes messages to a maildir or mbox.
+
+    Messages are serialized as they are sent, buffered, and written to the
+    mailbox in batches of APPMAIL_MAILBOX_BATCH_SIZE when the connection is
+    open (e.g. when used as a context manager, or by appmail_send), or at
+    the end of each send_messages call otherwise. The mailbox itself stays
+    open for the life of the process (see close_mailboxes).
+
+    Kwargs (default to the APPMAIL_MAILBOX_* settings):
+        path: the maildir directory, or mbox file.
+        format: 'maildir' or 'mbox'.
+        batch_size: number of messages buffered before writing.
+        shard: if True, each process writes to its own mailbox (a
+            subdirectory per process for maildir, a file suffix for mbox),
+            so that worker processes do not contend for locks.
+        normalize: if True, volatile headers and MIME boundaries are made
+            repeatable, so that the output of two runs can be diffed. Only
+            mbox preserves message order.
+
+    """
+
+    FORMATS = ('maildir', 'mbox')
+
+    def __init__(
+        self,
+        path=None,
+        format=None,
+        batch_size=None,
+        shard=None,
+        normalize=None,
+        fail_silently=False,
+        **kwargs
+    ):
+        super(MailboxEmailBackend, self).__init__(fail_silently=fail_silently, **kwargs)
+        self.path = path or MAILBOX_PATH
+        if not self.path:
+            raise ImproperlyConfigured("MailboxEmailBackend requires APPMAIL_MAILBOX_PATH.")
+        self.format = format or MAILBOX_FORMAT
+        if self.format not in self.FORMATS:
+            raise ImproperlyConfigured("Invalid mailbox format: '{}'".format(self.format))
+        self.batch_size = batch_size or MAILBOX_BATCH_SIZE
+        self.shard = MAILBOX_SHARD if shard is None else shard
+        self.normalize = MAILBOX_NORMALIZE if normalize is None else normalize
+        self.mailbox = None
+        self._buffer = []
+        self._lock = threading.Lock()
+
+    def get_path(self):
+        """Return the mailbox path, sharded by process id if required."""
+        if not self.shard:
+            return self.path
+        if self.format == 'maildir':
+            return os.path.join(self.path, 'worker-{}'.format(os.getpid()))
+        return '{}.{}'.format(self.path, os.getpid())
+
+    def open(self):
+        if self.mailbox is not None:
+            return False
+        self.mailbox = get_mailbox(self.get_path(), self.format)
+        return True
+
+    def close(self):
+        if self.mailbox is None:
+            return
+        try:
+            self.flush()
+        finally:
+            # the shared mailbox is left open, for the next connection
+            self.mailbox = None
+
+    def flush(self):
+        """Write buffered messages to the mailbox; return the number written."""
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+            if batch:
+                self.mailbox.add(batch)
+        return len(batch)
+
+    def serialize(self, email_message):
+        """Return the message as bytes, as it would be sent."""
+        message = email_message.message()
+        if self.normalize:
+            normalize_message(message)
+        data = message.as_bytes(linesep='\n')
+        if self.normalize and self.format == 'mbox':
+            data = NORMALIZED_FROM_LINE + data
+        return data
+
+    def send_messages(self, email_messages):
+        if not email_messages:
+            return 0
+        new_conn_created = self.open()
+        count = 0
+        try:
+            for email_message in email_messages:
+                data = self.serialize(email_message)
+                with self._lock:
+                    self._buffer.append(data)
+                    pending = len(self._buffer)
+                count += 1
+            if pending >= self.batch_size:
+                self.flush()
+        except Exception:
+            if not self.fail_silently:
+                raise
+        finally:
+            if new_conn_created:
+                self.close()
+        return count
@@ -0,0 +1,343 @@
+"""
+Bulk ("campaign") sending of a single template to many recipients.
+
+This is the engine behind the `appmail_send` management command. Records -
+one per recipient - are streamed from a JSON Lines or CSV file, grouped into
+batches, and rendered and sent by a pool of worker processes. Each worker
+resolves nothing from the database: the template (with its bodies) is
+fetched once by the parent and passed to the workers when they start, and
+each worker sends everything through a single, persistent backend
+connection.
+
+A record is a dict with a 'to' (or 'email') value, which may be a comma
+separated string or a list, optional 'cc' and 'bcc' values, and an optional
+'context' dict (in a CSV file, a JSON object). Any other keys are added to
+the template context - so a CSV file with 'email' and 'first_name' columns
+works as expected.
+
+Progress is checkpointed as the number of records processed, so that an
+interrupted run can be resumed. Batches are checkpointed in order, so a
+resumed run may resend at most the batches that were in flight.
+
+Workers may be forked or spawned (see multiprocessing start methods) -
+spawned workers set Django up themselves, so DJANGO_SETTINGS_MODULE must be
+set in the environment.
+
+"""
+import csv
+import io
+import itertools
+import json
+import logging
+import multiprocessing
+import multiprocessing.util
+import os
+import pickle
+import sys
+import threading
+import time
+
+import django
+from django.apps import apps
+from django.core.mail import get_connection
+from django.db import connections
+
+from . import recipients, sentlog
+from .settings import EMAIL_BACKEND
+
+logger = logging.getLogger(__name__)
+
+ADDRESS_FIELDS = ('to', 'cc', 'bcc')
+
+# per-process worker state - set by init_worker
+_worker = {}
+
+
+def read_records(stream, format='jsonl'):
+    """Yield record dicts from a JSON Lines or CSV stream."""
+    if format == 'csv':
+        for row in csv.DictReader(stream):
+            yield row
+        return
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def guess_format(path):
+    """Return 'csv' or 'jsonl' from a file path (stdin is JSON Lines)."""
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+
+def parse_addresses(value):
+    """Return a list of addresses from a list or comma separated string."""
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(',')
+    return [v.strip() for v in value if v.strip()]
+
+
+def parse_record(record):
+    """Split a record into (context, email_kwargs)."""
+    record = dict(record)
+    if 'email' in record and 'to' not in record:
+        record['to'] = record.pop('email')
+    email_kwargs = {f: parse_addresses(record.pop(f, None)) for f in ADDRESS_FIELDS}
+    if not email_kwargs['to']:
+        raise ValueError("Record has no 'to' address.")
+    context = record.pop('context', None) or {}
+    if isinstance(context, str):
+        # e.g. a CSV column
+        try:
+            context = json.loads(context)
+        except ValueError as ex:
+            raise ValueError("Record 'context' is not valid JSON: {}".format(ex))
+    if not isinstance(context, dict):
+        raise ValueError("Record 'context' must be a JSON object.")
+    record.update(context)
+    return record, email_kwargs
+
+
+def batches(records, size, start=0):
+    """Yield (offset, list of records) batches, skipping the first `start` records."""
+    records = itertools.islice(records, start, None)
+    offset = start
+    while True:
+        batch = list(itertools.islice(records, size))
+        if not batch:
+            return
+        yield offset, batch
+        offset += len(batch)
+
+
+def init_worker(template, email_kwargs):
+    """Set up the per-process state: the template and a persistent connection."""
+    _worker.update(template=template, email_kwargs=email_kwargs, connection=None, error=None)
+    connection = get_connection(EMAIL_BACKEND, fail_silently=False)
+    try:
+        connection.open()
+    except Exception as ex:
+        # raising here would make the pool restart the worker, forever -
+        # instead every record sent by this worker fails with the error.
+        logger.exception("Error opening email connection")
+        _worker['error'] = "Error opening email connection: {}".format(ex)
+        return
+    _worker['connection'] = connection
+    # close the connection (and write the sent log) on clean exit
+    multiprocessing.util.Finalize(None, close_worker, exitpriority=10)
+
+
+def start_worker(state):
+    """
+    Pool initializer - call init_worker with the pickled (template, email_kwargs).
+
+    The state is unpickled here, rather than by the pool, so that workers
+    started with the 'spawn' (or 'forkserver') method - which are fresh
+    interpreters - can set Django up before the template is unpickled.
+
+    """
+    if not apps.ready:
+        django.setup()
+    init_worker(*pickle.loads(state))
+
+
+def close_worker():
+    connection = _worker.pop('connection', None)
+    if connection is not None:
+        connection.close()
+    sentlog.buffer.flush()
+
+
+def send_batch(batch):
+    """
+    Render and send a batch of records.
+
+    Returns (offset, count, sent, failures, rejections). `failures` is a
+    list of (record, error message) tuples, and `rejections` the
+    appmail.recipients.Rejections of the batch's invalid and duplicate
+    addresses - which are dropped. Addresses are deduplicated within the
+    batch, not across batches.
+
+    """
+    offset, records = batch
+    processor = recipients.RecipientProcessor()
+    if _worker['error']:
+        return offset, len(records), 0, [(r, _worker['error']) for r in records], processor.rejections
+    template = _worker['template']
+    connection = _worker['connection']
+    sent = 0
+    failures = []
+    for record in records:
+        try:
+            context, email_kwargs = parse_record(record)
+            addresses = email_kwargs['to']
+            email_kwargs.update(processor.process(**email_kwargs))
+            if not email_kwargs['to']:
+                if any(recipients.normalize(a) is None for a in addresses):
+                    failures.append((record, "Record has no valid 'to' address."))
+                # else every recipient has already been sent this batch
+                continue
+            email_kwargs.update(_worker['email_kwargs'])
+            message = template.create_message(context, connection=connection, **email_kwargs)
+            if message.suppressed and not message.recipients():
+                failures.append((record, "All recipients are suppressed."))
+            elif connection.send_messages([message]):
+                sentlog.record(message)
+                sent += 1
+            else:
+                failures.append((record, "Message was not sent."))
+        except Exception as ex:
+            logger.debug("Error sending campaign message", exc_info=True)
+            failures.append((record, str(ex)))
+    sentlog.buffer.flush()
+    return offset, len(records), sent, failures, processor.rejections
+
+
+class Checkpoint(object):
+
+    """Number of records processed, persisted to a file (if path is set)."""
+
+    def __init__(self, path=None):
+        self.path = path
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return 0
+        with open(self.path) as f:
+            return json.load(f)['processed']
+
+    def save(self, processed):
+        if not self.path:
+            return
+        # write and rename, so that the checkpoint is never half-written
+        tmp = '{}.tmp'.format(self.path)
+        with open(tmp, 'w') as f:
+            json.dump({'processed': processed}, f)
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Stats(object):
+
+    """Campaign throughput statistics."""
+
+    def __init__(self, start=0):
+        self.start = start
+        self.processed = start
+        self.sent = 0
+        self.failed = 0
+        self.rejected = recipients.Rejections()
+        self.started = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self):
+        """Messages sent per second."""
+        return self.sent / self.elapsed if self.elapsed else 0
+
+    def __str__(self):
+        summary = (
+            "{} processed ({} sent, {} failed, {} skipped) in {:.1f}s - {:.1f} messages/s"
+            .format(
+                self.processed - self.start,
+                self.sent,
+                self.failed,
+                self.start,
+                self.elapsed,
+                self.rate
+            )
+        )
+        if self.rejected:
+            summary += "; addresses rejected: {}".format(self.rejected)
+        return summary
+
+
+def run(
+    template,
+    records,
+    workers=None,
+    batch_size=100,
+    checkpoint=None,
+    on_batch=None,
+    **email_kwargs
+):
+    """
+    Send template to each record; return Stats.
+
+    Args:
+        template: the EmailTemplate to send (its bodies are loaded here).
+        records: an iterable of record dicts (see module docstring).
+
+    Kwargs:
+        workers: number of worker processes; defaults to the number of
+            CPUs. If 0 everything is sent in-process.
+        batch_size: number of records sent by a worker per task.
+        checkpoint: a Checkpoint instance; processing starts after the
+            checkpointed number of records, and the checkpoint is updated
+            as batches complete (and cleared when the run completes).
+        on_batch: optional callable(stats, failures) called after each batch.
+        email_kwargs: passed to create_message for every record, e.g.
+            from_email.
+
+    """
+    checkpoint = checkpoint or Checkpoint()
+    start = checkpoint.load()
+    stats = Stats(start)
+    # load the bodies now, so that they are pickled with the template
+    for field_name in ('body_text', 'body_html'):
+        getattr(template, field_name)
+
+    def handle(result):
+        offset, count, sent, failures, rejections = result
+        stats.processed = offset + count
+        stats.sent += sent
+        stats.failed += len(failures)
+        stats.rejected.update(rejections)
+        checkpoint.save(stats.processed)
+        if on_batch:
+            on_batch(stats, failures)
+
+    if workers == 0:
+        init_worker(template, email_kwargs)
+        try:
+            for batch in batches(records, batch_size, start):
+                handle(send_batch(batch))
+        finally:
+            close_worker()
+    else:
+        workers = workers or os.cpu_count()
+        # bound the number of batches read ahead of the workers, as the pool
+        # would otherwise consume the entire input up front.
+        slots = threading.BoundedSemaphore(workers * 2)
+
+        def feed():
+            for batch in batches(records, batch_size, start):
+                slots.acquire()
+                yield batch
+
+        # forked workers must not share the parent's database connections
+        connections.close_all()
+        state = pickle.dumps((template, email_kwargs))
+        with multiprocessing.Pool(workers, start_worker, (state,)) as pool:
+            for result in pool.imap(send_batch, feed()):
+                slots.release()
+                handle(result)
+            pool.close()
+            pool.join()
+    checkpoint.clear()
+    return stats
+
+
+def open_input(path):
+    """Return a text stream for a path, or stdin for '-'."""
+    if path == '-':
+        return io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8')
+    return open(path, encoding='utf-8', newline='')
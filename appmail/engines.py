@@ -0,0 +1,247 @@
+"""
+Pluggable template rendering engines.
+
+Templates are rendered with the Django template language by default. The
+engine can be set for the installation (APPMAIL_TEMPLATE_ENGINE) and
+overridden for each template (EmailTemplate.engine). Two engines are built
+in - 'django' and 'jinja2' (which requires the Jinja2 package, and is
+considerably faster for loop-heavy templates) - and others can be added
+via APPMAIL_TEMPLATE_ENGINES, a dict of name: dotted path to an Engine
+subclass.
+
+Both built-in engines honour the render limits (see appmail.limits), and
+raise the standard Django TemplateSyntaxError / TemplateDoesNotExist so
+that EmailTemplate validation works the same whichever is used.
+
+"""
+import threading
+
+from django.core.exceptions import ImproperlyConfigured
+from django.template import (
+    Template,
+    TemplateDoesNotExist,
+    TemplateSyntaxError
+)
+from django.utils.module_loading import import_string
+
+from . import analysis, limits, profiler
+from .settings import JINJA2_OPTIONS, TEMPLATE_ENGINE, TEMPLATE_ENGINES
+
+try:
+    import jinja2
+    from jinja2 import nodes as jinja2_nodes
+    from jinja2.runtime import Context as Jinja2Context
+except ImportError:  # pragma: no cover
+    jinja2 = None
+
+ENGINES = {
+    'django': 'appmail.engines.DjangoEngine',
+    'jinja2': 'appmail.engines.Jinja2Engine',
+}
+ENGINES.update(TEMPLATE_ENGINES)
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+class Engine(object):
+
+    """
+    Base class for template engines.
+
+    Subclasses must implement `compile` (source -> compiled template, raising
+    TemplateSyntaxError) and `render` (compiled template, context dict ->
+    str), applying the render limits. They may implement `analyze` (compiled
+    template, source -> appmail.analysis.TemplateAnalysis); by default only
+    the size of the source is analysed, and `variable_paths` (compiled
+    template, source -> set of lookup tuples); by default none are found.
+    They may implement `profile` (source, context, appmail.profiler.Profile
+    -> str); by default only the total render time is profiled.
+
+    """
+
+    def compile(self, source):
+        raise NotImplementedError()
+
+    def render(self, compiled, context):
+        raise NotImplementedError()
+
+    def analyze(self, compiled, source):
+        return analysis.TemplateAnalysis(len(source))
+
+    def variable_paths(self, compiled, source):
+        return set()
+
+    def profile(self, source, context, profile):
+        profile.supported = False
+        return profile.measure(self.render, self.compile(source), context)
+
+
+class DjangoEngine(Engine):
+
+    """Django template language engine (the default)."""
+
+    def compile(self, source):
+        return Template(source)
+
+    def render(self, compiled, context):
+        return limits.render(compiled, context)
+
+    def analyze(self, compiled, source):
+        return analysis.analyze_django(compiled, len(source))
+
+    def variable_paths(self, compiled, source):
+        return analysis.variable_paths_django(compiled)
+
+    def profile(self, source, context, profile):
+        # compile a private copy, as the timers are set on the nodes
+        compiled = profiler.instrument(self.compile(source), profile)
+        return profile.measure(self.render, compiled, context)
+
+
+if jinja2 is not None:
+
+    class BudgetContext(Jinja2Context):
+
+        """Jinja2 Context that charges top-level name lookups to the budget."""
+
+        def resolve_or_missing(self, key):
+            budget = self.environment.budget
+            if budget is not None:
+                budget.tick()
+            return super(BudgetContext, self).resolve_or_missing(key)
+
+    class BudgetEnvironment(jinja2.Environment):
+
+        """
+        Jinja2 Environment that charges lookups and loop iterations to a budget.
+
+        Top-level names are looked up through the Context (BudgetContext), and
+        attribute / item lookups go through getattr / getitem. Loops have no
+        such hook, so the iterable of every {% for %} is wrapped in a call
+        to budget_iter when the template is compiled - each iteration is
+        charged, so a long loop is stopped as it runs rather than when it
+        finishes. The budget for the current render is stored per thread.
+
+        """
+
+        context_class = BudgetContext
+
+        def __init__(self, *args, **kwargs):
+            super(BudgetEnvironment, self).__init__(*args, **kwargs)
+            self._local = threading.local()
+
+        def _generate(self, source, *args, **kwargs):
+            for node in source.find_all(jinja2_nodes.For):
+                node.iter = jinja2_nodes.Call(
+                    jinja2_nodes.EnvironmentAttribute('budget_iter', lineno=node.lineno),
+                    [node.iter], [], None, None,
+                    lineno=node.lineno
+                )
+            return super(BudgetEnvironment, self)._generate(source, *args, **kwargs)
+
+        def budget_iter(self, iterable):
+            """Return iterable, charging each item to the budget (if any)."""
+            budget = self.budget
+            if budget is None:
+                return iterable
+            return self._ticking(iterable, budget)
+
+        def _ticking(self, iterable, budget):
+            for item in iterable:
+                budget.tick()
+                yield item
+
+        @property
+        def budget(self):
+            return getattr(self._local, 'budget', None)
+
+        @budget.setter
+        def budget(self, value):
+            self._local.budget = value
+
+        def getattr(self, obj, attribute):
+            if self.budget is not None:
+                self.budget.tick()
+            return super(BudgetEnvironment, self).getattr(obj, attribute)
+
+        def getitem(self, obj, argument):
+            if self.budget is not None:
+                self.budget.tick()
+            return super(BudgetEnvironment, self).getitem(obj, argument)
+
+
+class Jinja2Engine(Engine):
+
+    """
+    Jinja2 engine.
+
+    The defaults match the Django template language - autoescaping is on, and
+    missing variables (and their attributes) render as empty strings rather
+    than raising errors. Environment options, such as a loader for
+    {% include %}, can be set with APPMAIL_JINJA2_OPTIONS.
+
+    """
+
+    def __init__(self):
+        if jinja2 is None:
+            raise ImproperlyConfigured(
+                "The Jinja2 package is required to use the 'jinja2' template engine."
+            )
+        options = {
+            'autoescape': True,
+            'undefined': jinja2.ChainableUndefined,
+            'loader': jinja2.DictLoader({}),
+        }
+        options.update(JINJA2_OPTIONS)
+        self.environment = BudgetEnvironment(**options)
+
+    def compile(self, source):
+        try:
+            return self.environment.from_string(source)
+        except jinja2.TemplateSyntaxError as ex:
+            raise TemplateSyntaxError(str(ex)) from ex
+
+    def render(self, compiled, context):
+        budget = limits.RenderBudget()
+        self.environment.budget = budget if budget.is_limited else None
+        try:
+            output = compiled.render(context)
+        except jinja2.TemplateNotFound as ex:
+            raise TemplateDoesNotExist(str(ex)) from ex
+        except jinja2.TemplateError as ex:
+            # errors that Django would (mostly) raise at compile time
+            raise TemplateSyntaxError(str(ex)) from ex
+        finally:
+            self.environment.budget = None
+        if budget.is_limited:
+            budget.check_output(output)
+        return output
+
+    def analyze(self, compiled, source):
+        # compiled Jinja2 templates do not keep their AST, so parse again
+        return analysis.analyze_jinja2(self.environment, source)
+
+    def variable_paths(self, compiled, source):
+        return analysis.variable_paths_jinja2(self.environment, source)
+
+
+def get_engine(name=None):
+    """Return the (shared) engine instance for a name; defaults to TEMPLATE_ENGINE."""
+    name = name or TEMPLATE_ENGINE
+    engine = _engines.get(name)
+    if engine is None:
+        try:
+            path = ENGINES[name]
+        except KeyError:
+            raise ImproperlyConfigured("Unknown template engine: '{}'".format(name))
+        with _engines_lock:
+            if name not in _engines:
+                _engines[name] = import_string(path)()
+            engine = _engines[name]
+    return engine
+
+
+def engine_choices():
+    """Return (name, name) choices for the available engines."""
+    return [(name, name) for name in sorted(ENGINES)]
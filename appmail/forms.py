@@ -2,11 +2,13 @@ import json
 import logging
 
 from django import forms
-from django.contrib import messages
-from django.core.validators import validate_email
+from django.core.exceptions import ImproperlyConfigured
+from django.template import TemplateSyntaxError
 from django.utils.translation import ugettext_lazy as _
 
+from . import engines, jobs, recipients
 from .models import EmailTemplate, EmailTemplateQuerySet
+from .settings import COMPLEXITY_MAX, COMPLEXITY_WARN
 
 logger = logging.getLogger(__name__)
 
@@ -30,6 +32,86 @@ class JSONWidget(forms.Textarea):
         return super(JSONWidget, self).render(name, value, attrs=attrs)
 
 
+class EmailTemplateForm(forms.ModelForm):
+
+    """
+    Admin form for EmailTemplate.
+
+    Template bodies are stored as content-addressed blobs, so the body
+    fields are declared here and copied to the instance properties.
+
+    """
+
+    body_text = forms.CharField(
+        label=_("Plain text template"),
+        widget=forms.Textarea(attrs={'class': 'vLargeTextField'}),
+        help_text=_("Plain text content (may contain template variables)."),
+        strip=False
+    )
+    body_html = forms.CharField(
+        label=_("HTML template"),
+        widget=forms.Textarea(attrs={'class': 'vLargeTextField'}),
+        help_text=_("HTML content (may contain template variables)."),
+        strip=False
+    )
+    engine = forms.ChoiceField(
+        label=_("Template engine"),
+        help_text=_("Template language; leave blank to use the default."),
+        required=False
+    )
+
+    class Meta:
+        model = EmailTemplate
+        fields = '__all__'
+
+    def __init__(self, *args, **kwargs):
+        super(EmailTemplateForm, self).__init__(*args, **kwargs)
+        self.fields['engine'].choices = (
+            [('', _("Default ({})").format(engines.TEMPLATE_ENGINE))] +
+            engines.engine_choices()
+        )
+        if self.instance.pk is not None:
+            self.initial.setdefault('body_text', self.instance.body_text)
+            self.initial.setdefault('body_html', self.instance.body_html)
+
+    def clean(self):
+        """Set the bodies on the instance before model validation."""
+        cleaned_data = super(EmailTemplateForm, self).clean()
+        for field_name in ('body_text', 'body_html'):
+            if field_name in cleaned_data:
+                setattr(self.instance, field_name, cleaned_data[field_name])
+        self.analysis = self._analyze(cleaned_data)
+        if (
+            self.analysis is not None and
+            COMPLEXITY_MAX is not None and
+            self.analysis.cost > COMPLEXITY_MAX
+        ):
+            raise forms.ValidationError(
+                _("Template is too complex (%(analysis)s) - the maximum cost is %(max)s."),
+                params={'analysis': self.analysis, 'max': COMPLEXITY_MAX}
+            )
+        return cleaned_data
+
+    def _analyze(self, cleaned_data):
+        """Return the TemplateAnalysis of the cleaned data, or None if invalid."""
+        for field_name in ('subject', 'engine'):
+            if field_name in cleaned_data:
+                setattr(self.instance, field_name, cleaned_data[field_name])
+        try:
+            return self.instance.analyze()
+        except (TemplateSyntaxError, ImproperlyConfigured):
+            # reported by model validation
+            return None
+
+    @property
+    def complexity_warning(self):
+        """Return a warning message if the template exceeds COMPLEXITY_WARN."""
+        analysis = getattr(self, 'analysis', None)
+        if analysis is None or COMPLEXITY_WARN is None or analysis.cost <= COMPLEXITY_WARN:
+            return None
+        return _("Template may be slow to render (%(analysis)s).") % {'analysis': analysis}
+
+
 class MultiEmailField(forms.Field):
 
     """Taken from https://docs.djangoproject.com/en/1.11/ref/forms/validation/#form-field-default-cleaning """  # noqa
@@ -48,8 +130,18 @@ class MultiEmailField(forms.Field):
         """Check if value consists only of valid emails."""
         # Use the parent's handling of required fields, etc.
         super(MultiEmailField, self).validate(value)
-        for email in value:
-            validate_email(email)
+        _cleaned, rejections = recipients.clean(value)
+        invalid = rejections.counts[recipients.INVALID]
+        if invalid:
+            # report every invalid address, not just the first
+            raise forms.ValidationError(
+                _("Enter valid email addresses (%(count)s invalid): %(addresses)s"),
+                code='invalid',
+                params={
+                    'count': invalid,
+                    'addresses': ', '.join(rejections.samples[recipients.INVALID]),
+                }
+            )
 
 
 class MultiEmailTemplateField(forms.Field):
@@ -65,7 +157,7 @@ class MultiEmailTemplateField(forms.Field):
             return EmailTemplate.objects.none()
 
         values = [int(i) for i in value.split(',')]
-        return EmailTemplate.objects.filter(pk__in=values)
+        return EmailTemplate.objects.with_bodies().filter(pk__in=values)
 
 
 class EmailTestForm(forms.Form):
@@ -112,30 +204,19 @@ class EmailTestForm(forms.Form):
         except (TypeError, ValueError) as ex:
             raise forms.ValidationError(_("Invalid JSON: %s" % ex))
 
-    def _create_message(self, template):
-        """Create EmailMultiMessage from form data."""
-        return template.create_message(
+    def _email_kwargs(self):
+        """Return the create_message kwargs from form data."""
+        return {
+            'from_email': self.cleaned_data['from_email'],
+            'to': self.cleaned_data['to'],
+            'cc': self.cleaned_data['cc'],
+            'bcc': self.cleaned_data['bcc'],
+        }
+
+    def submit_job(self):
+        """Send test emails in the background; return the job id."""
+        return jobs.submit_test_emails(
+            list(self.cleaned_data.get('templates')),
             self.cleaned_data['context'],
-            from_email=self.cleaned_data['from_email'],
-            to=self.cleaned_data['to'],
-            cc=self.cleaned_data['cc'],
-            bcc=self.cleaned_data['bcc']
+            **self._email_kwargs()
         )
-
-    def send_emails(self, request):
-        """Send test emails."""
-        for template in self.cleaned_data.get('templates'):
-            email = self._create_message(template)
-            try:
-                email.send()
-            except Exception as ex:
-                logger.exception("Error sending test email")
-                messages.error(
-                    request,
-                    _("Error sending test email '%s': %s" % (template.name, ex))
-                )
-            else:
-                messages.success(
-                    request,
-                    _("'%s' email sent to '%s'" % (template.name, ', '.join(email.to)))
-                )
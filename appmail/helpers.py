@@ -1,3 +1,5 @@
+import hashlib
+import json
 import re
 
 # regex for extracting django template {{ variable }}s
@@ -97,3 +99,9 @@ def patch_context(context, processors, request=None):
     """Add template context_processor content to context."""
     cpx = [p(request) for p in processors]
     return merge_dicts(context, *cpx)
+
+
+def content_hash(*parts):
+    """Return a hex digest that identifies a set of JSON-serializable values."""
+    data = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
@@ -0,0 +1,162 @@
+"""
+Background delivery of admin test emails.
+
+Sending test emails for many templates synchronously inside the admin POST
+can take long enough to hit proxy timeouts. Instead the work is submitted to
+an executor, and the job's progress is stored in the Django cache so that
+it can be polled from the progress page.
+
+The executor is pluggable - APPMAIL_JOB_EXECUTOR is the dotted path to a
+callable that returns an object with a `submit(fn, *args)` method, such as
+a concurrent.futures.Executor. The default is a process-wide thread pool.
+If you run multiple web processes the job cache (APPMAIL_JOB_CACHE) must be
+shared between them. A job run in a worker thread closes that thread's
+database connections when it finishes, as nothing else would.
+
+"""
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.cache import caches
+from django.db import connections
+from django.core.mail import get_connection
+from django.utils.module_loading import import_string
+
+from . import sentlog
+from .settings import (
+    EMAIL_BACKEND,
+    JOB_CACHE,
+    JOB_EXECUTOR,
+    JOB_TIMEOUT,
+    JOB_WORKERS,
+)
+
+logger = logging.getLogger(__name__)
+
+STATUS_PENDING = 'pending'
+STATUS_RUNNING = 'running'
+STATUS_COMPLETE = 'complete'
+
+RESULT_SENT = 'sent'
+RESULT_ERROR = 'error'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def thread_pool_executor():
+    """Return the process-wide thread pool executor (the default)."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS)
+        return _executor
+
+
+class SynchronousExecutor(object):
+
+    """Executor that runs jobs immediately, in the calling thread."""
+
+    def submit(self, fn, *args, **kwargs):
+        fn(*args, **kwargs)
+
+
+def synchronous_executor():
+    """Executor for use in development / tests."""
+    return SynchronousExecutor()
+
+
+def get_executor():
+    return import_string(JOB_EXECUTOR)()
+
+
+def _cache_key(job_id):
+    return 'appmail:job:{}'.format(job_id)
+
+
+def get_job(job_id):
+    """Return the job state dict, or None if it does not exist (or expired)."""
+    return caches[JOB_CACHE].get(_cache_key(job_id))
+
+
+def _save_job(job):
+    caches[JOB_CACHE].set(_cache_key(job['id']), job, JOB_TIMEOUT)
+
+
+def submit_test_emails(templates, context, **email_kwargs):
+    """
+    Queue test emails for a list of templates; return the job id.
+
+    The templates must already have been fetched - the job does not touch
+    the database itself (other than through the template context).
+
+    """
+    job = {
+        'id': uuid.uuid4().hex,
+        'status': STATUS_PENDING,
+        'total': len(templates),
+        'results': [],
+        'error': None,
+    }
+    _save_job(job)
+    get_executor().submit(
+        run_job, threading.get_ident(), send_test_emails, job, templates, context, email_kwargs
+    )
+    return job['id']
+
+
+def run_job(submitter, fn, *args):
+    """Run a job, closing its database connections if run in another thread."""
+    try:
+        fn(*args)
+    finally:
+        # the submitting thread (the synchronous executor) is still using them
+        if threading.get_ident() != submitter:
+            connections.close_all()
+
+
+def send_test_emails(job, templates, context, email_kwargs):
+    """Send one email per template, reusing a single backend connection."""
+    job['status'] = STATUS_RUNNING
+    _save_job(job)
+    connection = get_connection(EMAIL_BACKEND, fail_silently=False)
+    try:
+        # opening explicitly stops send_messages closing it after each email
+        connection.open()
+    except Exception as ex:
+        logger.exception("Error opening email connection")
+        job['status'] = STATUS_COMPLETE
+        job['error'] = str(ex)
+        _save_job(job)
+        return
+    try:
+        for template in templates:
+            result = {
+                'id': template.id,
+                'name': template.name,
+                'language': template.language,
+                'version': template.version,
+            }
+            try:
+                email = template.create_message(
+                    context,
+                    connection=connection,
+                    **email_kwargs
+                )
+                if connection.send_messages([email]):
+                    sentlog.record(email)
+            except Exception as ex:
+                logger.exception("Error sending test email")
+                result['status'] = RESULT_ERROR
+                result['detail'] = str(ex)
+            else:
+                result['status'] = RESULT_SENT
+                result['detail'] = ', '.join(email.to)
+            job['results'].append(result)
+            _save_job(job)
+    finally:
+        connection.close()
+        job['status'] = STATUS_COMPLETE
+        _save_job(job)
@@ -0,0 +1,121 @@
+"""
+Render budget guardrails.
+
+A pathological template (nested loops over a large context, say) can pin a
+worker's CPU. Rendering through a BudgetContext counts every variable
+lookup and loop iteration, checks the wall-clock time as it goes, and
+raises RenderLimitExceeded as soon as a configured limit is breached. The
+rendered output size is checked once rendering completes.
+
+All limits default to None (unlimited) - see settings.APPMAIL_RENDER_*.
+
+"""
+import time
+
+from django.template import Context
+from django.utils.translation import ugettext_lazy as _lazy
+
+from .settings import (
+    RENDER_MAX_OPERATIONS,
+    RENDER_MAX_SIZE,
+    RENDER_TIMEOUT,
+)
+
+# check the clock once every N operations - time.monotonic is cheap, but
+# not free, and this is the innermost loop of template rendering.
+CLOCK_INTERVAL = 64
+
+
+class RenderLimitExceeded(Exception):
+
+    """Raised when a template render exceeds the configured budget."""
+
+    pass
+
+
+class RenderBudget(object):
+
+    """
+    Tracks operations and elapsed time for a single render.
+
+    Limits default to the APPMAIL_RENDER_* settings.
+
+    """
+
+    def __init__(self, max_operations=None, timeout=None, max_size=None):
+        self.max_operations = RENDER_MAX_OPERATIONS if max_operations is None else max_operations
+        self.timeout = RENDER_TIMEOUT if timeout is None else timeout
+        self.max_size = RENDER_MAX_SIZE if max_size is None else max_size
+        self.operations = 0
+        self.started = time.monotonic()
+
+    @property
+    def is_limited(self):
+        return any(
+            x is not None for x in (self.max_operations, self.timeout, self.max_size)
+        )
+
+    def tick(self):
+        """Record a single operation, raising if the budget is exceeded."""
+        self.operations += 1
+        if self.max_operations is not None and self.operations > self.max_operations:
+            raise RenderLimitExceeded(
+                _lazy("Template exceeded {} render operations.").format(self.max_operations)
+            )
+        if self.timeout is not None and self.operations % CLOCK_INTERVAL == 0:
+            self.check_time()
+
+    def check_time(self):
+        if time.monotonic() - self.started > self.timeout:
+            raise RenderLimitExceeded(
+                _lazy("Template exceeded render time limit of {}s.").format(self.timeout)
+            )
+
+    def check_output(self, output):
+        """Check the final output against the size and time limits."""
+        if self.timeout is not None:
+            self.check_time()
+        if self.max_size is not None and len(output) > self.max_size:
+            raise RenderLimitExceeded(
+                _lazy("Rendered template exceeded {} characters.").format(self.max_size)
+            )
+        return output
+
+
+class BudgetContext(Context):
+
+    """Template Context that charges each lookup / assignment to a budget."""
+
+    def __init__(self, dict_=None, budget=None, **kwargs):
+        self.budget = budget or RenderBudget()
+        super(BudgetContext, self).__init__(dict_, **kwargs)
+
+    def __getitem__(self, key):
+        self.budget.tick()
+        return super(BudgetContext, self).__getitem__(key)
+
+    def __setitem__(self, key, value):
+        self.budget.tick()
+        super(BudgetContext, self).__setitem__(key, value)
+
+    def push(self, *args, **kwargs):
+        self.budget.tick()
+        return super(BudgetContext, self).push(*args, **kwargs)
+
+    def update(self, other_dict):
+        self.budget.tick()
+        return super(BudgetContext, self).update(other_dict)
+
+
+def render(template, context):
+    """
+    Render a django Template with a context dict within budget.
+
+    If no limits are configured this is a straight render, with no
+    overhead.
+
+    """
+    budget = RenderBudget()
+    if not budget.is_limited:
+        return template.render(Context(context))
+    return budget.check_output(template.render(BudgetContext(context, budget=budget)))
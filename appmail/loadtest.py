@@ -0,0 +1,374 @@
+"""
+End-to-end load testing against a local SMTP sink.
+
+Measures the messages/second that appmail can render and send on the
+current hardware, without any outside services:
+
+    >>> templates = seed_templates(count=10, size=5000)
+    >>> with ThreadedSMTPSink() as sink:
+    ...     report = run(templates, messages=10000, concurrency=8, port=sink.port)
+    >>> print(report)
+
+Each message is created with create_message and sent over SMTP to the sink,
+which accepts (and discards) everything. Concurrency is provided by threads
+or processes, and each thread / process sends through its own persistent
+connection. The latency of each message (render + send) is
+recorded, along with the peak memory use of the process (and its children).
+
+The sink is a minimal threaded SMTP server from the standard library; if the
+aiosmtpd package is installed it can be used instead (AiosmtpdSink).
+
+See also the `appmail_loadtest` management command.
+
+"""
+import math
+import multiprocessing
+import multiprocessing.util
+import socketserver
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.mail import get_connection
+from django.db import connections
+
+from .models import EmailTemplate
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - Windows
+    resource = None
+
+try:
+    from aiosmtpd.controller import Controller
+except ImportError:
+    Controller = None
+
+MODES = ('threads', 'processes')
+
+SMTP_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+
+# name prefix of the templates seeded by seed_templates
+SEED_PREFIX = 'appmail-loadtest'
+
+# template seeded by seed_templates - a loop over order lines, padded to size
+SEED_LINE = "{{ line.name }} x {{ line.quantity }} for {{ user.first_name }}\n"
+SEED_TEMPLATE = "Hello {{ user.first_name }},\n{% for line in lines %}{}{% endfor %}"
+
+
+class Sink(object):
+
+    """Base class for SMTP sinks - counts the messages received."""
+
+    host = '127.0.0.1'
+
+    def __init__(self):
+        self.port = None
+        self.received = 0
+        self._lock = threading.Lock()
+
+    def receive(self, data):
+        with self._lock:
+            self.received += 1
+
+    def start(self):
+        raise NotImplementedError()
+
+    def stop(self):
+        raise NotImplementedError()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+
+    """Just enough SMTP to accept messages from smtplib."""
+
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        self.reply('220 appmail sink')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command in (b'HELO', b'EHLO'):
+                self.reply('250 appmail')
+            elif command in (b'MAIL', b'RCPT', b'RSET', b'NOOP'):
+                self.reply('250 OK')
+            elif command == b'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                for line in self.rfile:
+                    if line == b'.\r\n':
+                        break
+                    data.append(line)
+                self.server.sink.receive(b''.join(data))
+                self.reply('250 OK')
+            elif command == b'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class ThreadedSMTPSink(Sink):
+
+    """SMTP sink using a thread per connection (standard library only)."""
+
+    def start(self):
+        self.server = socketserver.ThreadingTCPServer((self.host, 0), _SMTPHandler)
+        self.server.daemon_threads = True
+        self.server.sink = self
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class AiosmtpdSink(Sink):
+
+    """SMTP sink using aiosmtpd (which must be installed)."""
+
+    def start(self):
+        if Controller is None:
+            raise ImportError("aiosmtpd is not installed.")
+        sink = self
+
+        class Handler(object):
+
+            async def handle_DATA(self, server, session, envelope):
+                sink.receive(envelope.content)
+                return '250 OK'
+
+        self.controller = Controller(Handler(), hostname=self.host, port=0)
+        self.controller.start()
+        self.port = self.controller.server.sockets[0].getsockname()[1]
+
+    def stop(self):
+        self.controller.stop()
+
+
+SINKS = {
+    'threaded': ThreadedSMTPSink,
+    'aiosmtpd': AiosmtpdSink,
+}
+
+
+def seed_templates(count=10, size=1000, prefix=SEED_PREFIX, replace=False):
+    """
+    Create `count` templates with bodies of approximately `size` characters.
+
+    The templates are named '<prefix>-0', '<prefix>-1' etc. If any templates
+    with these names exist ValueError is raised, unless replace is True, in
+    which case they are deleted first.
+
+    """
+    names = ['{}-{}'.format(prefix, i) for i in range(count)]
+    existing = EmailTemplate.objects.filter(name__in=names)
+    if replace:
+        existing.delete()
+    elif existing.exists():
+        raise ValueError(
+            "Templates named '{}-N' already exist - delete them, or replace them "
+            "with replace=True.".format(prefix)
+        )
+    lines = SEED_LINE * max(1, math.ceil(size / len(SEED_LINE)))
+    body = SEED_TEMPLATE.replace('{}', lines)
+    return [
+        EmailTemplate(
+            name=name,
+            subject='Order summary for {{ user.first_name }}',
+            body_text=body,
+            body_html='<pre>{}</pre>'.format(body)
+        ).save()
+        for name in names
+    ]
+
+
+def get_context(i):
+    """Return the context for message i."""
+    return {
+        'user': {'first_name': 'User {}'.format(i)},
+        'lines': [{'name': 'Item {}'.format(n), 'quantity': n} for n in range(10)],
+    }
+
+
+def send_message(template, i, connection):
+    """Create and send message i; return the latency in seconds."""
+    start = time.perf_counter()
+    message = template.create_message(
+        get_context(i),
+        to=['user{}@example.com'.format(i)],
+        connection=connection
+    )
+    connection.send_messages([message])
+    return time.perf_counter() - start
+
+
+def open_connection(host, port):
+    connection = get_connection(SMTP_BACKEND, host=host, port=port, fail_silently=False)
+    connection.open()
+    return connection
+
+
+def peak_memory():
+    """Return the peak RSS, in bytes, of this process and its children."""
+    if resource is None:
+        return None
+    usage = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    )
+    # ru_maxrss is in bytes on macOS, KB elsewhere
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+
+class Report(object):
+
+    """Load test results."""
+
+    def __init__(self, mode, concurrency, latencies, elapsed, memory=None):
+        self.mode = mode
+        self.concurrency = concurrency
+        self.latencies = sorted(latencies)
+        self.elapsed = elapsed
+        self.memory = memory
+
+    @property
+    def messages(self):
+        return len(self.latencies)
+
+    @property
+    def throughput(self):
+        """Messages per second."""
+        return self.messages / self.elapsed if self.elapsed else 0
+
+    def percentile(self, p):
+        """Return the p-th percentile latency (in seconds)."""
+        if not self.latencies:
+            return 0
+        index = max(0, math.ceil(p / 100 * len(self.latencies)) - 1)
+        return self.latencies[index]
+
+    def as_dict(self):
+        return {
+            'mode': self.mode,
+            'concurrency': self.concurrency,
+            'messages': self.messages,
+            'elapsed': self.elapsed,
+            'throughput': self.throughput,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.percentile(100),
+            'memory': self.memory,
+        }
+
+    def __str__(self):
+        lines = [
+            "{} messages, {} x {}, in {:.2f}s".format(
+                self.messages, self.concurrency, self.mode, self.elapsed
+            ),
+            "throughput: {:.1f} messages/s".format(self.throughput),
+            "latency: p50 {:.2f}ms, p90 {:.2f}ms, p99 {:.2f}ms, max {:.2f}ms".format(
+                *[self.percentile(p) * 1000 for p in (50, 90, 99, 100)]
+            ),
+        ]
+        if self.memory is not None:
+            lines.append("peak memory: {:.1f}MB".format(self.memory / 1024 / 1024))
+        return '\n'.join(lines)
+
+
+# per-process state for the 'processes' mode
+_worker = {}
+
+
+def _init_worker(templates, host, port):
+    _worker['templates'] = templates
+    _worker['connection'] = open_connection(host, port)
+    multiprocessing.util.Finalize(None, _worker['connection'].close, exitpriority=10)
+
+
+def _send_chunk(indexes):
+    templates = _worker['templates']
+    connection = _worker['connection']
+    return [send_message(templates[i % len(templates)], i, connection) for i in indexes]
+
+
+def _run_threads(templates, messages, concurrency, host, port):
+    local = threading.local()
+    opened = []
+    lock = threading.Lock()
+
+    def send(i):
+        if not hasattr(local, 'connection'):
+            local.connection = open_connection(host, port)
+            with lock:
+                opened.append(local.connection)
+        return send_message(templates[i % len(templates)], i, local.connection)
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(send, range(messages)))
+    finally:
+        for connection in opened:
+            connection.close()
+
+
+def _run_processes(templates, messages, concurrency, host, port):
+    chunk_size = max(1, min(100, messages // (concurrency * 4)))
+    chunks = [
+        range(i, min(i + chunk_size, messages)) for i in range(0, messages, chunk_size)
+    ]
+    # forked workers must not share the parent's database connections
+    connections.close_all()
+    with multiprocessing.Pool(concurrency, _init_worker, (templates, host, port)) as pool:
+        latencies = [t for chunk in pool.imap_unordered(_send_chunk, chunks) for t in chunk]
+        pool.close()
+        pool.join()
+    return latencies
+
+
+RUNNERS = {
+    'threads': _run_threads,
+    'processes': _run_processes,
+}
+
+
+def run(templates, messages=1000, concurrency=4, mode='threads', host='127.0.0.1', port=25):
+    """
+    Send `messages` messages, cycling through templates; return a Report.
+
+    Args:
+        templates: list of EmailTemplate objects to send.
+
+    Kwargs:
+        messages: total number of messages to send.
+        concurrency: number of threads / processes.
+        mode: 'threads' or 'processes'.
+        host, port: SMTP server to send to (e.g. a Sink).
+
+    """
+    if mode not in RUNNERS:
+        raise ValueError("Invalid mode '{}' - must be one of {}".format(mode, MODES))
+    templates = list(templates)
+    # load the bodies up front (and so that they are pickled with the templates)
+    for template in templates:
+        for field_name in ('body_text', 'body_html'):
+            getattr(template, field_name)
+    start = time.perf_counter()
+    latencies = RUNNERS[mode](templates, messages, concurrency, host, port)
+    elapsed = time.perf_counter() - start
+    return Report(mode, concurrency, latencies, elapsed, memory=peak_memory())
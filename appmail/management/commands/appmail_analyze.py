@@ -0,0 +1,51 @@
+"""
+Set the cost score of existing templates (see appmail.analysis).
+
+    $ ./manage.py appmail_analyze
+    $ ./manage.py appmail_analyze --all
+
+Templates are scored when they are saved. This command scores templates
+that have no score - such as those that existed before scores were added -
+or, with --all, recalculates every score (e.g. after upgrading appmail).
+Templates that cannot be compiled are left without a score.
+
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand
+from django.template import TemplateSyntaxError
+
+from ...models import EmailTemplate, EmailTemplateQuerySet
+
+
+class Command(BaseCommand):
+
+    help = "Set the cost score of templates that have none."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help="Recalculate the score of every template."
+        )
+
+    def handle(self, *args, **options):
+        templates = EmailTemplate.objects.with_bodies()
+        if not options['all']:
+            templates = templates.filter(cost_score__isnull=True)
+        scored = failed = 0
+        for template in templates.iterator():
+            try:
+                cost_score = template.analyze().cost
+            except (TemplateSyntaxError, ImproperlyConfigured) as ex:
+                self.stderr.write("Unable to analyse template {!r}: {}".format(template, ex))
+                failed += 1
+                continue
+            if cost_score != template.cost_score:
+                # the score doesn't affect rendering, so this bypasses
+                # EmailTemplateQuerySet.update - which records the change,
+                # invalidating the template caches
+                super(EmailTemplateQuerySet, EmailTemplate.objects.filter(pk=template.pk)).update(
+                    cost_score=cost_score
+                )
+            scored += 1
+        self.stdout.write("{} templates scored, {} could not be analysed.".format(scored, failed))
@@ -0,0 +1,116 @@
+"""
+Compare template engine render times.
+
+    $ ./manage.py appmail_benchmark
+    $ ./manage.py appmail_benchmark --template order-summary --iterations 500
+
+Without --template a built-in, loop-heavy "digest" template is rendered.
+With --template the bodies of the current version of the named template
+are rendered using its test_context. Each engine renders the same source
+and context; templates that use syntax one engine does not support will
+report an error for that engine.
+
+"""
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from django.template import TemplateSyntaxError
+
+from ... import engines
+from ...models import EmailTemplate
+
+DIGEST_TEMPLATE = (
+    "{% for order in orders %}"
+    "Order {{ order.number }} for {{ user.first_name }}:\n"
+    "{% for line in order.lines %}"
+    "  {{ line.name }} x {{ line.quantity }} @ {{ line.price }}\n"
+    "{% endfor %}"
+    "{% endfor %}"
+)
+
+
+def digest_context(orders):
+    return {
+        'user': {'first_name': 'Fred'},
+        'orders': [
+            {
+                'number': i,
+                'lines': [
+                    {'name': 'Item {}'.format(j), 'quantity': j, 'price': '9.99'}
+                    for j in range(10)
+                ]
+            }
+            for i in range(orders)
+        ]
+    }
+
+
+class Command(BaseCommand):
+
+    help = "Compare render times of the available template engines."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--template',
+            help="Name of the EmailTemplate to render (defaults to a built-in digest)."
+        )
+        parser.add_argument('--language', help="EmailTemplate language.")
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=200,
+            help="Number of renders per engine (default 200)."
+        )
+        parser.add_argument(
+            '--orders',
+            type=int,
+            default=20,
+            help="Number of orders in the built-in digest context (default 20)."
+        )
+
+    def get_sources(self, options):
+        """Return list of (label, source) and the context to render."""
+        if not options['template']:
+            return [('digest', DIGEST_TEMPLATE)], digest_context(options['orders'])
+        kwargs = {'name': options['template']}
+        if options['language']:
+            kwargs['language'] = options['language']
+        template = EmailTemplate.objects.current(**kwargs)
+        if template is None:
+            raise CommandError("Template not found: '{}'".format(options['template']))
+        sources = [
+            ('subject', template.subject),
+            ('body_text', template.body_text),
+            ('body_html', template.body_html),
+        ]
+        return sources, template.test_context
+
+    def time_engine(self, engine, source, context, iterations):
+        """Return the mean render time in ms."""
+        compiled = engine.compile(source)
+        engine.render(compiled, context)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            engine.render(compiled, context)
+        return (time.perf_counter() - start) * 1000 / iterations
+
+    def handle(self, *args, **options):
+        sources, context = self.get_sources(options)
+        iterations = options['iterations']
+        for label, source in sources:
+            self.stdout.write("{} ({} chars, {} iterations):".format(label, len(source), iterations))
+            timings = {}
+            for name, _ in engines.engine_choices():
+                try:
+                    engine = engines.get_engine(name)
+                    timings[name] = self.time_engine(engine, source, context, iterations)
+                except (ImproperlyConfigured, TemplateSyntaxError) as ex:
+                    self.stdout.write("  {:<10} error: {}".format(name, ex))
+            if not timings:
+                continue
+            fastest = min(timings.values())
+            for name, elapsed in sorted(timings.items(), key=lambda t: t[1]):
+                self.stdout.write(
+                    "  {:<10} {:8.3f}ms  x{:.1f}".format(name, elapsed, elapsed / fastest)
+                )
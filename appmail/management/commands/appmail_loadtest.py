@@ -0,0 +1,89 @@
+"""
+Measure end-to-end send throughput against a local SMTP sink.
+
+    $ ./manage.py appmail_loadtest --messages 10000 --concurrency 8 --mode processes
+
+Seeds templates (named 'appmail-loadtest-N', deleted afterwards unless
+--keep is set), starts an in-process SMTP sink and reports throughput,
+latency percentiles and peak memory. If templates with those names already
+exist the command fails, unless --replace is set. See appmail.loadtest.
+
+"""
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import loadtest
+from ...models import EmailTemplate
+
+
+class Command(BaseCommand):
+
+    help = "Load test create_message + send against a local SMTP sink."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--templates',
+            type=int,
+            default=10,
+            help="Number of templates to seed (default 10)."
+        )
+        parser.add_argument(
+            '--size',
+            type=int,
+            default=1000,
+            help="Approximate template body size in characters (default 1000)."
+        )
+        parser.add_argument(
+            '--messages',
+            type=int,
+            default=1000,
+            help="Number of messages to send (default 1000)."
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=4,
+            help="Number of threads / processes (default 4)."
+        )
+        parser.add_argument('--mode', choices=loadtest.MODES, default='threads')
+        parser.add_argument('--sink', choices=sorted(loadtest.SINKS), default='threaded')
+        parser.add_argument('--json', action='store_true', help="Output the report as JSON.")
+        parser.add_argument('--keep', action='store_true', help="Do not delete the seeded templates.")
+        parser.add_argument(
+            '--replace',
+            action='store_true',
+            help="Delete existing templates with the seeded names first."
+        )
+
+    def handle(self, *args, **options):
+        try:
+            templates = loadtest.seed_templates(
+                options['templates'],
+                options['size'],
+                replace=options['replace']
+            )
+        except ValueError as ex:
+            raise CommandError(str(ex))
+        try:
+            with loadtest.SINKS[options['sink']]() as sink:
+                report = loadtest.run(
+                    templates,
+                    messages=options['messages'],
+                    concurrency=options['concurrency'],
+                    mode=options['mode'],
+                    host=sink.host,
+                    port=sink.port
+                )
+                received = sink.received
+        except ImportError as ex:
+            raise CommandError(str(ex))
+        finally:
+            if not options['keep']:
+                EmailTemplate.objects.filter(pk__in=[t.pk for t in templates]).delete()
+        if received != report.messages:
+            self.stderr.write("Sink received {} of {} messages.".format(received, report.messages))
+        if options['json']:
+            self.stdout.write(json.dumps(report.as_dict(), indent=4))
+        else:
+            self.stdout.write(str(report))
@@ -0,0 +1,114 @@
+"""
+Send a template to a list of recipients.
+
+    $ ./manage.py appmail_send order-summary --input recipients.jsonl
+    $ cat recipients.csv | ./manage.py appmail_send welcome --format csv
+
+See appmail.campaign for the input format. Use --checkpoint to be able to
+resume an interrupted run (re-run the same command), and --failures to
+write records that could not be sent to a file, in JSON Lines format, so
+that they can be retried.
+
+"""
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import campaign
+from ...models import EmailTemplate
+
+
+class Command(BaseCommand):
+
+    help = "Send an email template to each recipient in a JSON Lines / CSV file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('template', help="Name of the EmailTemplate to send.")
+        parser.add_argument('--language', help="Template language (defaults to LANGUAGE_CODE).")
+        parser.add_argument(
+            '--template-version',
+            type=int,
+            help="Template version (defaults to the current version)."
+        )
+        parser.add_argument(
+            '--input',
+            default='-',
+            help="JSON Lines or CSV file of recipients ('-' for stdin, the default)."
+        )
+        parser.add_argument(
+            '--format',
+            choices=('jsonl', 'csv'),
+            help="Input format (defaults to csv for .csv files, else jsonl)."
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help="Number of worker processes (defaults to the number of CPUs, 0 to run in-process)."
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help="Number of messages sent by a worker per batch (default 100)."
+        )
+        parser.add_argument('--checkpoint', help="File used to record progress, for resuming.")
+        parser.add_argument('--failures', help="File to write failed records to (JSON Lines).")
+        parser.add_argument('--from-email', help="Override the template sender.")
+        parser.add_argument(
+            '--reply-to',
+            help="Override the template Reply-To (comma separated)."
+        )
+
+    def get_template(self, options):
+        kwargs = {'name': options['template']}
+        if options['language']:
+            kwargs['language'] = options['language']
+        if options['template_version'] is None:
+            template = EmailTemplate.objects.current(**kwargs)
+        else:
+            try:
+                template = EmailTemplate.objects.version(
+                    version=options['template_version'], **kwargs
+                )
+            except EmailTemplate.DoesNotExist:
+                template = None
+        if template is None:
+            raise CommandError("Template not found: '{}'".format(options['template']))
+        return template
+
+    def handle(self, *args, **options):
+        template = self.get_template(options)
+        email_kwargs = {}
+        if options['from_email']:
+            email_kwargs['from_email'] = options['from_email']
+        if options['reply_to']:
+            email_kwargs['reply_to'] = campaign.parse_addresses(options['reply_to'])
+        path = options['input']
+        fmt = options['format'] or campaign.guess_format(path)
+        failures = open(options['failures'], 'a') if options['failures'] else None
+
+        def on_batch(stats, failed):
+            for record, error in failed:
+                self.stderr.write("Error sending to {}: {}".format(
+                    record.get('to') or record.get('email'), error
+                ))
+                if failures:
+                    failures.write(json.dumps(dict(record, error=error)) + '\n')
+            if options['verbosity'] > 1:
+                self.stdout.write(str(stats))
+
+        try:
+            with campaign.open_input(path) as stream:
+                stats = campaign.run(
+                    template,
+                    campaign.read_records(stream, fmt),
+                    workers=options['workers'],
+                    batch_size=options['batch_size'],
+                    checkpoint=campaign.Checkpoint(options['checkpoint']),
+                    on_batch=on_batch,
+                    **email_kwargs
+                )
+        finally:
+            if failures:
+                failures.close()
+        self.stdout.write(str(stats))
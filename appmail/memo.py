@@ -0,0 +1,216 @@
+"""
+Memoizing template context.
+
+EmailTemplate.create_message renders the subject, plain text and HTML body
+with the same context, so an expensive lookup - a model property that runs
+a query, say {{ order.total_display }}, or {% for line in order.lines.all %}
+- would otherwise be evaluated once per part (and once per loop iteration
+that references it). create_message wraps the context values in proxies
+that memoize every attribute / item lookup and (argument-less) call for the
+lifetime of the message, so each is evaluated once:
+
+    >>> context = memoize({'order': order})
+    >>> context['order'].total_display  # evaluated
+    >>> context['order'].total_display  # memoized
+
+Lookups are memoized by the identity of the object they are made on, so the
+same object reached by two different paths shares its lookups. Simple values
+- strings, numbers, dates etc. - are not wrapped, so filters and
+localization see the real values. Nor are containers, which filters such as
+json_script, tojson and dictsort (and Jinja2's `is mapping` test) check the
+type of: a dict, list or tuple is copied, with its items wrapped, and other
+containers - sets, and subclasses such as OrderedDict - are left as they are.
+
+Memoization is off by default - turn it on with APPMAIL_MEMOIZE_CONTEXT =
+True. Templates then see proxies rather than the objects themselves, so a
+custom tag or filter that checks the type of its argument (isinstance(value,
+Order), say) must unwrap() it first, and a template must not rely on a value
+changing between the parts.
+
+"""
+import datetime
+import decimal
+import uuid
+
+# values of these types are returned as they are, rather than proxied
+LEAF_TYPES = (
+    str,
+    bytes,
+    int,
+    float,
+    complex,
+    decimal.Decimal,
+    datetime.date,
+    datetime.time,
+    datetime.timedelta,
+    uuid.UUID,
+    type,
+    type(None),
+)
+
+# containers that are copied, with their items wrapped, rather than proxied
+COPIED_TYPES = (dict, list, tuple)
+
+# containers that are returned as they are
+CONTAINER_TYPES = COPIED_TYPES + (set, frozenset)
+
+
+def unwrap(value):
+    """Return the object behind a proxy (or the value, if it isn't one)."""
+    return value._obj if isinstance(value, MemoProxy) else value
+
+
+class Memo(object):
+
+    """The memoized lookups for a single message."""
+
+    def __init__(self):
+        self._values = {}
+        # the copies of the containers wrapped, by id
+        self._copies = {}
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, obj, kind, key, func):
+        """Return the memoized value of func(), a lookup of key on obj."""
+        try:
+            memo_key = (id(obj), kind, key)
+            # the object is kept alive with the value, so its id is not reused
+            _obj, value = self._values[memo_key]
+        except TypeError:
+            # unhashable key, e.g. a slice
+            return self.wrap(func())
+        except KeyError:
+            self.misses += 1
+            value = self.wrap(func())
+            self._values[memo_key] = (obj, value)
+        else:
+            self.hits += 1
+        return value
+
+    def wrap(self, value):
+        """Return a memoizing proxy for value - unless it is a simple value or container."""
+        if isinstance(value, (MemoProxy,) + LEAF_TYPES):
+            return value
+        if type(value) in COPIED_TYPES:
+            return self.copy(value)
+        if isinstance(value, CONTAINER_TYPES) or hasattr(value, '__next__'):
+            # (iterators can only be consumed once anyway)
+            return value
+        if callable(value):
+            return MemoCallableProxy(value, self)
+        return MemoProxy(value, self)
+
+    def copy(self, value):
+        """Return a copy of a dict, list or tuple with its items wrapped."""
+        try:
+            # the container is kept alive with the copy, so its id is not reused
+            return self._copies[id(value)][1]
+        except KeyError:
+            pass
+        # register the copy before filling it, in case the container contains
+        # itself (a tuple can't be filled, so the original stands in for it)
+        copy = value if isinstance(value, tuple) else type(value)()
+        self._copies[id(value)] = (value, copy)
+        if isinstance(value, dict):
+            copy.update((key, self.wrap(item)) for key, item in value.items())
+        elif isinstance(value, list):
+            copy.extend(self.wrap(item) for item in value)
+        else:
+            copy = tuple(self.wrap(item) for item in value)
+            self._copies[id(value)] = (value, copy)
+        return copy
+
+
+class MemoProxy(object):
+
+    """Proxy that memoizes the attribute and item lookups on an object."""
+
+    __slots__ = ('_obj', '_memo')
+
+    def __init__(self, obj, memo):
+        object.__setattr__(self, '_obj', obj)
+        object.__setattr__(self, '_memo', memo)
+
+    def __getattr__(self, name):
+        obj = self._obj
+        if name.startswith('__'):
+            # protocol probes, such as __html__
+            return getattr(obj, name)
+        return self._memo.lookup(obj, '.', name, lambda: getattr(obj, name))
+
+    def __setattr__(self, name, value):
+        setattr(self._obj, name, value)
+
+    def __getitem__(self, key):
+        obj = self._obj
+        return self._memo.lookup(obj, '[]', key, lambda: obj[key])
+
+    def __iter__(self):
+        for item in self._obj:
+            yield self._memo.wrap(item)
+
+    def __reversed__(self):
+        for item in reversed(self._obj):
+            yield self._memo.wrap(item)
+
+    def __len__(self):
+        return len(self._obj)
+
+    def __bool__(self):
+        return bool(self._obj)
+
+    def __contains__(self, item):
+        return unwrap(item) in self._obj
+
+    def __str__(self):
+        return str(self._obj)
+
+    def __repr__(self):
+        return repr(self._obj)
+
+    def __hash__(self):
+        return hash(self._obj)
+
+    def __eq__(self, other):
+        return self._obj == unwrap(other)
+
+    def __ne__(self, other):
+        return self._obj != unwrap(other)
+
+    def __lt__(self, other):
+        return self._obj < unwrap(other)
+
+    def __le__(self, other):
+        return self._obj <= unwrap(other)
+
+    def __gt__(self, other):
+        return self._obj > unwrap(other)
+
+    def __ge__(self, other):
+        return self._obj >= unwrap(other)
+
+
+class MemoCallableProxy(MemoProxy):
+
+    """MemoProxy for a callable - calls without arguments are memoized."""
+
+    __slots__ = ()
+
+    @property
+    def __wrapped__(self):
+        # so that inspect.signature sees the callable's own signature
+        return self._obj
+
+    def __call__(self, *args, **kwargs):
+        obj = self._obj
+        if args or kwargs:
+            return self._memo.wrap(obj(*args, **kwargs))
+        return self._memo.lookup(obj, '()', None, obj)
+
+
+def memoize(context, memo=None):
+    """Return a copy of a context dict with memoizing proxies for its values."""
+    if memo is None:
+        memo = Memo()
+    return {key: memo.wrap(value) for key, value in context.items()}
@@ -0,0 +1,36 @@
+from .routers import has_written, pin, unpin
+from .settings import READ_REPLICA_PIN_COOKIE, READ_REPLICA_PIN_SECONDS
+
+
+class ReplicaPinningMiddleware(object):
+
+    """
+    Pin appmail reads to the primary after a write (see appmail.routers).
+
+    A request that writes to an appmail model sets a cookie, and requests
+    carrying the cookie - for the next APPMAIL_READ_REPLICA_PIN_SECONDS -
+    read from the primary, so that e.g. the previews shown after saving a
+    template in the admin are not stale. The pin is cleared at the end of
+    every request.
+
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        unpin()
+        if request.COOKIES.get(READ_REPLICA_PIN_COOKIE):
+            pin()
+        try:
+            response = self.get_response(request)
+            if has_written():
+                response.set_cookie(
+                    READ_REPLICA_PIN_COOKIE,
+                    '1',
+                    max_age=READ_REPLICA_PIN_SECONDS,
+                    httponly=True
+                )
+        finally:
+            unpin()
+        return response
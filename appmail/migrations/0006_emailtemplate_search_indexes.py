@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# fields covered by EmailTemplateQuerySet.search
+SEARCH_FIELDS = ('name', 'subject', 'body_text', 'body_html')
+
+
+def create_indexes(apps, schema_editor):
+    """
+    Add trigram GIN indexes on PostgreSQL.
+
+    The expression matches the SQL Django generates for `icontains` lookups
+    (UPPER("field"::text) LIKE UPPER(%s)), so these indexes are used by
+    EmailTemplateQuerySet.search and the admin search. Other databases fall
+    back to a sequential scan.
+
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for field in SEARCH_FIELDS:
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS appmail_emailtemplate_{0}_trgm '
+            'ON appmail_emailtemplate USING gin (UPPER("{0}"::text) gin_trgm_ops)'.format(field)
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for field in SEARCH_FIELDS:
+        schema_editor.execute(
+            'DROP INDEX IF EXISTS appmail_emailtemplate_{0}_trgm'.format(field)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appmail', '0005_emailtemplate_from_email__reply_to'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
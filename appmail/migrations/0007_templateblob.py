@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import hashlib
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def make_digest(content):
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def store_blobs(apps, schema_editor):
+    """Move template bodies into content-addressed blobs."""
+    EmailTemplate = apps.get_model('appmail', 'EmailTemplate')
+    TemplateBlob = apps.get_model('appmail', 'TemplateBlob')
+    db_alias = schema_editor.connection.alias
+    blobs = {}
+    templates = EmailTemplate.objects.using(db_alias).all()
+    for template in templates.only('id', 'body_text', 'body_html').iterator():
+        text_digest = make_digest(template.body_text)
+        html_digest = make_digest(template.body_html)
+        blobs[text_digest] = template.body_text
+        blobs[html_digest] = template.body_html
+        EmailTemplate.objects.using(db_alias).filter(id=template.id).update(
+            body_text_blob=text_digest,
+            body_html_blob=html_digest
+        )
+    TemplateBlob.objects.using(db_alias).bulk_create(
+        [TemplateBlob(digest=k, content=v) for k, v in blobs.items()],
+        batch_size=100
+    )
+
+
+def restore_bodies(apps, schema_editor):
+    EmailTemplate = apps.get_model('appmail', 'EmailTemplate')
+    TemplateBlob = apps.get_model('appmail', 'TemplateBlob')
+    db_alias = schema_editor.connection.alias
+    blobs = TemplateBlob.objects.using(db_alias)
+    for template in EmailTemplate.objects.using(db_alias).all().iterator():
+        EmailTemplate.objects.using(db_alias).filter(id=template.id).update(
+            body_text=blobs.get(digest=template.body_text_blob_id).content,
+            body_html=blobs.get(digest=template.body_html_blob_id).content
+        )
+
+
+def create_indexes(apps, schema_editor):
+    """Add a trigram GIN index on blob content (see 0006) on PostgreSQL."""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS appmail_templateblob_content_trgm '
+        'ON appmail_templateblob USING gin (UPPER("content"::text) gin_trgm_ops)'
+    )
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS appmail_templateblob_content_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appmail', '0006_emailtemplate_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TemplateBlob',
+            fields=[
+                ('digest', models.CharField(max_length=64, primary_key=True, serialize=False, verbose_name='SHA-256 digest')),
+                ('content', models.TextField(blank=True, verbose_name='Content')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='emailtemplate',
+            name='body_text_blob',
+            field=models.ForeignKey(db_constraint=False, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='appmail.TemplateBlob', verbose_name='Plain text template'),
+        ),
+        migrations.AddField(
+            model_name='emailtemplate',
+            name='body_html_blob',
+            field=models.ForeignKey(db_constraint=False, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='appmail.TemplateBlob', verbose_name='HTML template'),
+        ),
+        migrations.RunPython(store_blobs, restore_bodies),
+        migrations.RemoveField(
+            model_name='emailtemplate',
+            name='body_text',
+        ),
+        migrations.RemoveField(
+            model_name='emailtemplate',
+            name='body_html',
+        ),
+        migrations.AlterField(
+            model_name='emailtemplate',
+            name='body_text_blob',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='appmail.TemplateBlob', verbose_name='Plain text template'),
+        ),
+        migrations.AlterField(
+            model_name='emailtemplate',
+            name='body_html_blob',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='appmail.TemplateBlob', verbose_name='HTML template'),
+        ),
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appmail', '0007_templateblob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SentMessage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recipient', models.CharField(max_length=254, verbose_name='Recipient')),
+                ('message_id', models.CharField(blank=True, max_length=255, verbose_name='Message-ID')),
+                ('sent_at', models.DateTimeField(db_index=True, verbose_name='Sent at')),
+                ('template', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sent_messages', to='appmail.emailtemplate')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='sentmessage',
+            index=models.Index(fields=['recipient', 'sent_at'], name='appmail_sen_recipie_0420e5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sentmessage',
+            index=models.Index(fields=['template', 'sent_at'], name='appmail_sen_templat_685f2d_idx'),
+        ),
+    ]
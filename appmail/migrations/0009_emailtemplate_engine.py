@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appmail', '0008_sentmessage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailtemplate',
+            name='engine',
+            field=models.CharField(blank=True, help_text="Template language used to render this template, e.g. 'django', 'jinja2'. Leave blank to use the default (settings.APPMAIL_TEMPLATE_ENGINE).", max_length=20, verbose_name='Template engine'),
+        ),
+    ]
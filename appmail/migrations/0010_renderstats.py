@@ -0,0 +1,32 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appmail', '0009_emailtemplate_engine'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RenderStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('part', models.CharField(choices=[('subject', 'Subject'), ('body_text', 'Plain text'), ('body_html', 'HTML')], max_length=10, verbose_name='Part')),
+                ('digest', models.CharField(help_text='Digest of the content the stats were collected for.', max_length=64, verbose_name='Content digest')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Renders')),
+                ('total_time', models.FloatField(default=0, verbose_name='Total render time (s)')),
+                ('total_size', models.BigIntegerField(default=0, verbose_name='Total output size (chars)')),
+                ('p95_time', models.FloatField(blank=True, help_text='95th percentile render time over the most recent sample window.', null=True, verbose_name='p95 render time (s)')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated at')),
+                ('template', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='render_stats', to='appmail.emailtemplate')),
+            ],
+            options={
+                'verbose_name_plural': 'render stats',
+                'unique_together': {('template', 'part')},
+            },
+        ),
+    ]
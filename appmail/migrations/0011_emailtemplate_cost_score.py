@@ -0,0 +1,21 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # existing templates are scored by the appmail_analyze command (the
+    # analysis depends on the current engines, so it can't run here)
+
+    dependencies = [
+        ('appmail', '0010_renderstats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailtemplate',
+            name='cost_score',
+            field=models.PositiveIntegerField(blank=True, editable=False, help_text='Estimated relative cost of rendering the template (set on save) - see appmail.analysis.', null=True, verbose_name='Cost score'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:28
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appmail', '0011_emailtemplate_cost_score'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TemplateChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(blank=True, help_text='Blank if the change may affect any template.', max_length=100, verbose_name='Template name')),
+                ('language', models.CharField(blank=True, max_length=20, verbose_name='Language')),
+                ('changed_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Changed at')),
+            ],
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_pointers(apps, schema_editor):
+    """Point each template at its latest active version."""
+    EmailTemplate = apps.get_model('appmail', 'EmailTemplate')
+    LiveTemplate = apps.get_model('appmail', 'LiveTemplate')
+    db_alias = schema_editor.connection.alias
+    latest = {}
+    templates = EmailTemplate.objects.using(db_alias).filter(is_active=True).order_by('version')
+    for pk, name, language in templates.values_list('id', 'name', 'language'):
+        latest[(name, language)] = pk
+    LiveTemplate.objects.using(db_alias).bulk_create(
+        [
+            LiveTemplate(name=name, language=language, template_id=pk)
+            for (name, language), pk in latest.items()
+        ],
+        batch_size=100
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appmail', '0012_templatechange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LiveTemplate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='Template name')),
+                ('language', models.CharField(max_length=20, verbose_name='Language')),
+                ('template', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='live', to='appmail.emailtemplate')),
+            ],
+            options={
+                'unique_together': {('name', 'language')},
+            },
+        ),
+        migrations.RunPython(create_pointers, migrations.RunPython.noop),
+    ]
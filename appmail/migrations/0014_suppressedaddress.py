@@ -0,0 +1,27 @@
+# Generated by Django 3.2.25 on 2026-10-18 17:48
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appmail', '0013_livetemplate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SuppressedAddress',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('address', models.CharField(max_length=254, unique=True, verbose_name='Address')),
+                ('address_hash', models.BigIntegerField(editable=False, verbose_name='Address hash')),
+                ('reason', models.CharField(choices=[('bounce', 'Bounced'), ('complaint', 'Complained'), ('unsubscribe', 'Unsubscribed'), ('manual', 'Added manually')], default='manual', max_length=20, verbose_name='Reason')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Created at')),
+            ],
+            options={
+                'verbose_name_plural': 'suppressed addresses',
+            },
+        ),
+    ]
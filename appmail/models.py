@@ -1,37 +1,282 @@
+import collections
+import functools
+import hashlib
+import threading
+import time
+
 from django.conf import settings
 from django.contrib.postgres.fields import JSONField
-from django.core.exceptions import ValidationError
-from django.core.mail import EmailMultiAlternatives
-from django.db import models
-from django.template import (
-    Context,
-    Template,
-    TemplateDoesNotExist,
-    TemplateSyntaxError
-)
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.message import make_msgid
+from django.core.mail.utils import DNS_NAME
+from django.db import IntegrityError, models, transaction
+from django.db.models import Q
+from django.template import TemplateDoesNotExist, TemplateSyntaxError
+from django.utils import timezone
+from django.utils.text import smart_split, unescape_string_literal
 from django.utils.translation import ugettext_lazy as _lazy
 
-from . import helpers
+from . import (
+    attachments,
+    engines,
+    helpers,
+    limits,
+    memo,
+    prefetch,
+    profiler,
+    routers,
+    sentlog,
+    stats,
+    suppression,
+    templatecache,
+)
 from .settings import (
     ADD_EXTRA_HEADERS,
+    BLOB_CACHE_SIZE,
+    COMPILED_CACHE_SIZE,
+    CONTEXT_PROCESSORS,
+    EMAIL_BACKEND,
+    MEMOIZE_CONTEXT,
+    SUPPRESSION_LIST,
+    TEMPLATE_CACHE,
     VALIDATE_ON_SAVE,
-    CONTEXT_PROCESSORS
 )
 
 
+@functools.lru_cache(maxsize=COMPILED_CACHE_SIZE)
+def compile_template(source, engine=None):
+    """
+    Return compiled template for source, cached per process.
+
+    Template bodies are shared (content-addressed) across versions and
+    languages, so identical content is only compiled once (per engine).
+
+    """
+    return engines.get_engine(engine).compile(source)
+
+
+class TemplateBlobQuerySet(models.query.QuerySet):
+
+    # process-wide LRU cache of digest: content. As blobs are immutable
+    # (the key _is_ the content) this never needs invalidating.
+    _cache = collections.OrderedDict()
+    _cache_lock = threading.Lock()
+
+    def _cache_get(self, digest):
+        with self._cache_lock:
+            if digest in self._cache:
+                self._cache.move_to_end(digest)
+                return self._cache[digest]
+
+    def _cache_set(self, digest, content):
+        with self._cache_lock:
+            self._cache[digest] = content
+            while len(self._cache) > BLOB_CACHE_SIZE:
+                self._cache.popitem(last=False)
+
+    def store(self, content):
+        """Save content (if it doesn't already exist) and return its digest."""
+        digest = TemplateBlob.make_digest(content)
+        self.get_or_create(digest=digest, defaults={'content': content})
+        self._cache_set(digest, content)
+        return digest
+
+    def get_content(self, digest):
+        """Return content for a digest, from the process cache if possible."""
+        return self.get_contents([digest])[digest]
+
+    def get_contents(self, digests):
+        """Return dict of digest: content, fetching uncached blobs in one query."""
+        contents = {d: self._cache_get(d) for d in set(digests)}
+        missing = [d for d, c in contents.items() if c is None]
+        if missing:
+            for digest, content in self.filter(digest__in=missing).values_list('digest', 'content'):
+                self._cache_set(digest, content)
+                contents[digest] = content
+        return contents
+
+    def unreferenced(self):
+        """Return blobs that are no longer used by any template."""
+        return self.exclude(
+            digest__in=EmailTemplate.objects.values('body_text_blob')
+        ).exclude(
+            digest__in=EmailTemplate.objects.values('body_html_blob')
+        )
+
+
+class TemplateBlob(models.Model):
+
+    """
+    Content-addressed template body.
+
+    Template bodies are stored once per unique content, keyed by the
+    SHA-256 digest of the content, and referenced from EmailTemplate - so
+    the many near-identical versions / languages of a template do not
+    each store their own copy of unchanged bodies. Blobs are immutable.
+
+    """
+    digest = models.CharField(
+        _lazy('SHA-256 digest'),
+        max_length=64,
+        primary_key=True
+    )
+    content = models.TextField(
+        _lazy('Content'),
+        blank=True
+    )
+
+    objects = TemplateBlobQuerySet().as_manager()
+
+    def __str__(self):
+        return self.digest
+
+    def __repr__(self):
+        return "<TemplateBlob digest='{}'>".format(self.digest)
+
+    @staticmethod
+    def make_digest(content):
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
 class EmailTemplateQuerySet(models.query.QuerySet):
 
+    # fields matched by `search` - on PostgreSQL these have trigram indexes.
+    SEARCH_FIELDS = ('name', 'subject', 'body_text_blob__content', 'body_html_blob__content')
+
     def active(self):
         """Returns active templates only."""
         return self.filter(is_active=True)
 
+    def with_bodies(self):
+        """Fetch the template bodies (see TemplateBlob) in the same query."""
+        return self.select_related('body_text_blob', 'body_html_blob')
+
     def current(self, name, language=settings.LANGUAGE_CODE):
-        """Returns the latest version of a template."""
-        return self.active().filter(name=name, language=language).order_by('version').last()
+        """Returns the live (by default the latest active) version of a template."""
+        return self._cached(
+            (name, language, None),
+            lambda: self.with_bodies().filter(live__name=name, live__language=language).first()
+        )
+
+    def current_many(self, pairs):
+        """
+        Returns the live versions of many templates, in a single query.
+
+        pairs is a list of (name, language) tuples, and the return value is
+        a dict of (name, language): template - None if there is no active
+        template for the pair.
+
+        """
+        keys = [(name, language, None) for name, language in pairs]
+
+        def load(keys):
+            lookups = Q()
+            for name, language, _version in keys:
+                lookups |= Q(live__name=name, live__language=language)
+            found = {(t.name, t.language, None): t for t in self.with_bodies().filter(lookups)}
+            return {key: found.get(key) for key in keys}
+
+        templates = self._cached_many(keys, load) if keys else {}
+        return {key[:2]: template for key, template in templates.items()}
 
     def version(self, name, version, language=settings.LANGUAGE_CODE):
         """Returns a specific version of a template."""
-        return self.active().get(name=name, language=language, version=version)
+        def load():
+            try:
+                return self.active().with_bodies().get(name=name, language=language, version=version)
+            except EmailTemplate.DoesNotExist:
+                return None
+
+        template = self._cached((name, language, version), load)
+        if template is None:
+            raise EmailTemplate.DoesNotExist(
+                "EmailTemplate matching query does not exist."
+            )
+        return template
+
+    def _cached(self, key, loader):
+        return self._cached_many([key], lambda keys: {key: loader()})[key]
+
+    def _cached_many(self, keys, loader):
+        # only unfiltered lookups are cached - see appmail.templatecache
+        if not TEMPLATE_CACHE or self.query.where:
+            return loader(keys)
+
+        def load(keys):
+            templates = loader(keys)
+            for template in templates.values():
+                if template is not None:
+                    # cache the bodies along with the template
+                    template.body_text, template.body_html
+            return templates
+
+        return templatecache.cache.get_many(keys, load)
+
+    def update(self, **kwargs):
+        """
+        Update templates, updating the live pointers and recording the change.
+
+        See LiveTemplate and appmail.templatecache.
+
+        """
+        db = routers.for_write(self)
+        queryset = self.using(db)
+        with transaction.atomic(using=db):
+            pairs = queryset._changed_pairs()
+            ids = list(queryset.values_list('id', flat=True))
+            updated = super(EmailTemplateQuerySet, queryset).update(**kwargs)
+            moved = EmailTemplate.objects.using(db).filter(id__in=ids)
+            # renamed - the new names are affected too
+            new_pairs = moved._changed_pairs() - pairs if 'name' in kwargs or 'language' in kwargs else set()
+            if set(kwargs) & {'name', 'language', 'is_active', 'version'}:
+                # only the pairs whose live template has moved or been
+                # deactivated are refreshed, so promote() pins are kept -
+                # the old names first, as they may release a live template
+                for name, language in sorted(pairs) + sorted(new_pairs):
+                    LiveTemplate.objects.check_live(name, language)
+                for template in moved:
+                    LiveTemplate.objects.offer(template)
+            pairs |= new_pairs
+            templatecache.record_changes(pairs)
+        return updated
+    update.alters_data = True
+
+    def delete(self):
+        """Delete templates, updating the live pointers and recording the change."""
+        db = routers.for_write(self)
+        queryset = self.using(db)
+        with transaction.atomic(using=db):
+            pairs = queryset._changed_pairs()
+            deleted = super(EmailTemplateQuerySet, queryset).delete()
+            for name, language in pairs:
+                LiveTemplate.objects.refresh(name, language)
+            templatecache.record_changes(pairs)
+        return deleted
+    delete.alters_data = True
+
+    def _changed_pairs(self):
+        return set(self.order_by().values_list('name', 'language').distinct())
+
+    def search(self, query):
+        """
+        Returns templates that contain all of the terms in the query.
+
+        Each term (which may be a "quoted phrase") is matched,
+        case-insensitively, against the name, subject and bodies, e.g.
+
+            >>> EmailTemplate.objects.search('"{{ user.first_name }}"')
+
+        """
+        queryset = self
+        for term in smart_split(query):
+            if term[0] in ('"', "'") and term[0] == term[-1] and len(term) > 1:
+                term = unescape_string_literal(term)
+            match = Q()
+            for field in self.SEARCH_FIELDS:
+                match |= Q(**{'{}__icontains'.format(field): term})
+            queryset = queryset.filter(match)
+        return queryset
 
 
 class EmailTemplate(models.Model):
@@ -90,13 +335,40 @@ class EmailTemplate(models.Model):
         max_length=100,
         help_text=_lazy("Email subject line (may contain template variables)."),
     )
-    body_text = models.TextField(
-        _lazy('Plain text template'),
-        help_text=_lazy("Plain text content (may contain template variables)."),
+    # template bodies are stored as content-addressed blobs, and exposed
+    # via the body_text and body_html properties.
+    body_text_blob = models.ForeignKey(
+        TemplateBlob,
+        on_delete=models.PROTECT,
+        related_name='+',
+        verbose_name=_lazy('Plain text template'),
+        editable=False
+    )
+    body_html_blob = models.ForeignKey(
+        TemplateBlob,
+        on_delete=models.PROTECT,
+        related_name='+',
+        verbose_name=_lazy('HTML template'),
+        editable=False
     )
-    body_html = models.TextField(
-        _lazy('HTML template'),
-        help_text=_lazy("HTML content (may contain template variables)."),
+    engine = models.CharField(
+        _lazy('Template engine'),
+        max_length=20,
+        blank=True,
+        help_text=_lazy(
+            "Template language used to render this template, e.g. 'django', 'jinja2'. "
+            "Leave blank to use the default (settings.APPMAIL_TEMPLATE_ENGINE)."
+        )
+    )
+    cost_score = models.PositiveIntegerField(
+        _lazy('Cost score'),
+        null=True,
+        blank=True,
+        editable=False,
+        help_text=_lazy(
+            "Estimated relative cost of rendering the template (set on save) - "
+            "see appmail.analysis."
+        )
     )
     test_context = JSONField(
         default=dict,
@@ -146,6 +418,107 @@ class EmailTemplate(models.Model):
             )
         }
 
+    def _get_body(self, field_name):
+        attname = '_{}'.format(field_name)
+        if attname not in self.__dict__:
+            blob_name = '{}_blob'.format(field_name)
+            if getattr(EmailTemplate, blob_name).is_cached(self):
+                # fetched with the template - see EmailTemplateQuerySet.with_bodies
+                blob = getattr(self, blob_name)
+                content = blob.content if blob else ''
+            else:
+                digest = getattr(self, '{}_blob_id'.format(field_name))
+                content = TemplateBlob.objects.get_content(digest) if digest else ''
+            self.__dict__[attname] = content
+        return self.__dict__[attname]
+
+    @property
+    def body_text(self):
+        """Plain text template content."""
+        return self._get_body('body_text')
+
+    @body_text.setter
+    def body_text(self, value):
+        self.__dict__['_body_text'] = value
+
+    @property
+    def body_html(self):
+        """HTML template content."""
+        return self._get_body('body_html')
+
+    @body_html.setter
+    def body_html(self, value):
+        self.__dict__['_body_html'] = value
+
+    @property
+    def has_body_text(self):
+        """Return True if the plain text body is not empty (without loading it)."""
+        if '_body_text' in self.__dict__ or self.body_text_blob_id is None:
+            return len(self.body_text) > 0
+        return self.body_text_blob_id != TemplateBlob.make_digest('')
+
+    @property
+    def has_body_html(self):
+        """Return True if the HTML body is not empty (without loading it)."""
+        if '_body_html' in self.__dict__ or self.body_html_blob_id is None:
+            return len(self.body_html) > 0
+        return self.body_html_blob_id != TemplateBlob.make_digest('')
+
+    @property
+    def engine_name(self):
+        """Return the name of the engine used to render this template."""
+        return self.engine or engines.TEMPLATE_ENGINE
+
+    def _render(self, source, context, part):
+        engine = engines.get_engine(self.engine_name)
+        if profiler.should_profile():
+            return profiler.render(engine, self, part, source, context)
+        return engine.render(compile_template(source, self.engine_name), context)
+
+    def analyze(self):
+        """
+        Return the combined TemplateAnalysis of the subject and bodies.
+
+        Raises TemplateSyntaxError if any part cannot be compiled.
+
+        """
+        engine = engines.get_engine(self.engine_name)
+        result = None
+        for source in (self.subject, self.body_text, self.body_html):
+            part = engine.analyze(compile_template(source, self.engine_name), source)
+            result = part if result is None else result + part
+        return result
+
+    def variable_paths(self):
+        """
+        Return the set of variable paths looked up by the subject and bodies.
+
+        See appmail.analysis.variable_paths_django. Raises TemplateSyntaxError
+        if any part cannot be compiled.
+
+        """
+        engine = engines.get_engine(self.engine_name)
+        paths = set()
+        for source in (self.subject, self.body_text, self.body_html):
+            paths |= engine.variable_paths(compile_template(source, self.engine_name), source)
+        return paths
+
+    def prefetch(self, queryset, name):
+        """
+        Return queryset with the related objects the template uses prefetched.
+
+        queryset is of the objects passed in the context as `name` - see
+        appmail.prefetch.
+
+        """
+        return prefetch.apply(queryset, prefetch.paths_for(self.variable_paths(), name))
+
+    def _get_cost_score(self):
+        try:
+            return self.analyze().cost
+        except (TemplateSyntaxError, ImproperlyConfigured):
+            return None
+
     @property
     def reply_to_list(self):
         """Convert the reply_to field to a list."""
@@ -159,7 +532,8 @@ class EmailTemplate(models.Model):
                 to settings.VALIDATE_ON_SAVE.
 
         """
-        if self.pk is None:
+        created = self.pk is None
+        if created:
             self.test_context = helpers.get_context(
                 self.subject +
                 self.body_text +
@@ -168,11 +542,68 @@ class EmailTemplate(models.Model):
         validate = kwargs.pop('validate', VALIDATE_ON_SAVE)
         if validate:
             self.clean()
-        super(EmailTemplate, self).save(*args, **kwargs)
+        self.cost_score = self._get_cost_score()
+        for field_name in ('body_text', 'body_html'):
+            attname = '{}_blob_id'.format(field_name)
+            content = getattr(self, field_name)
+            # only touch the blob table if the content has changed
+            if getattr(self, attname) != TemplateBlob.make_digest(content):
+                setattr(self, attname, TemplateBlob.objects.store(content))
+        with transaction.atomic():
+            super(EmailTemplate, self).save(*args, **kwargs)
+            pairs = self._changed_pairs()
+            for name, language in pairs - {(self.name, self.language)}:
+                # renamed - the old name may need a new live template
+                LiveTemplate.objects.refresh(name, language)
+            # only a new, renamed or reactivated version can take over - an
+            # edit to an existing version must not undo a promote() rollback
+            # (an instance that wasn't loaded from the db may be either)
+            loaded_active = getattr(self, '_loaded_active', None)
+            if created or pairs != {(self.name, self.language)} or not loaded_active:
+                LiveTemplate.objects.offer(self)
+            LiveTemplate.objects.check_live(self.name, self.language)
+            templatecache.record_changes(pairs)
+        self._loaded_key = (self.name, self.language)
+        self._loaded_active = self.is_active
         return self
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(EmailTemplate, cls).from_db(db, field_names, values)
+        # the original name / language, so that a rename invalidates both
+        instance._loaded_key = (instance.__dict__.get('name'), instance.__dict__.get('language'))
+        instance._loaded_active = instance.__dict__.get('is_active', True)
+        return instance
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            deleted = super(EmailTemplate, self).delete(*args, **kwargs)
+            routers.written()
+            pairs = self._changed_pairs()
+            for name, language in pairs:
+                LiveTemplate.objects.refresh(name, language)
+            templatecache.record_changes(pairs)
+        return deleted
+
+    def _changed_pairs(self):
+        pairs = {(self.name, self.language)}
+        loaded_key = getattr(self, '_loaded_key', None)
+        if loaded_key and None not in loaded_key:
+            pairs.add(loaded_key)
+        return pairs
+
+    def refresh_from_db(self, *args, **kwargs):
+        """Discard any locally set body content on refresh."""
+        super(EmailTemplate, self).refresh_from_db(*args, **kwargs)
+        self.__dict__.pop('_body_text', None)
+        self.__dict__.pop('_body_html', None)
+
     def clean(self):
         """Validate model - specifically that the template can be rendered."""
+        try:
+            engines.get_engine(self.engine_name)
+        except ImproperlyConfigured as ex:
+            raise ValidationError({'engine': str(ex)})
         validation_errors = {}
         validation_errors.update(self._validate_body(EmailTemplate.CONTENT_TYPE_PLAIN))
         validation_errors.update(self._validate_body(EmailTemplate.CONTENT_TYPE_HTML))
@@ -182,8 +613,8 @@ class EmailTemplate(models.Model):
 
     def render_subject(self, context, processors=CONTEXT_PROCESSORS):
         """Render subject line."""
-        ctx = Context(helpers.patch_context(context, processors))
-        return Template(self.subject).render(ctx)
+        ctx = helpers.patch_context(context, processors)
+        return self._render(self.subject, ctx, 'subject')
 
     def _validate_subject(self):
         """Try rendering the body template and capture any errors."""
@@ -191,7 +622,7 @@ class EmailTemplate(models.Model):
             self.render_subject({})
         except TemplateDoesNotExist as ex:
             return {'subject': _lazy("Template does not exist: {}".format(ex))}
-        except TemplateSyntaxError as ex:
+        except (TemplateSyntaxError, limits.RenderLimitExceeded) as ex:
             return {'subject': str(ex)}
         else:
             return {}
@@ -199,11 +630,11 @@ class EmailTemplate(models.Model):
     def render_body(self, context, content_type=CONTENT_TYPE_PLAIN, processors=CONTEXT_PROCESSORS):
         """Render email body in plain text or HTML format."""
         assert content_type in EmailTemplate.CONTENT_TYPES, _lazy("Invalid content type.")
-        ctx = Context(helpers.patch_context(context, processors))
+        ctx = helpers.patch_context(context, processors)
         if content_type == EmailTemplate.CONTENT_TYPE_PLAIN:
-            return Template(self.body_text).render(ctx)
+            return self._render(self.body_text, ctx, 'body_text')
         if content_type == EmailTemplate.CONTENT_TYPE_HTML:
-            return Template(self.body_html).render(ctx)
+            return self._render(self.body_html, ctx, 'body_html')
 
     def _validate_body(self, content_type):
         """Try rendering the body template and capture any errors."""
@@ -216,7 +647,7 @@ class EmailTemplate(models.Model):
             self.render_body({}, content_type=content_type)
         except TemplateDoesNotExist as ex:
             return {field_name: _lazy("Template does not exist: {}".format(ex))}
-        except TemplateSyntaxError as ex:
+        except (TemplateSyntaxError, limits.RenderLimitExceeded) as ex:
             return {field_name: str(ex)}
         else:
             return {}
@@ -238,20 +669,60 @@ class EmailTemplate(models.Model):
         constructor kwargs except for 'subject', 'body' and 'alternatives' - as
         these are set from the template (subject, body_text and body_html).
 
+        If no 'connection' kwarg is passed, and settings.APPMAIL_EMAIL_BACKEND
+        is set, the message is bound to a connection from that backend.
+
+        Attribute / item lookups on the context values are memoized for the
+        message, so each is evaluated once for all three parts - see
+        appmail.memo.
+
+        If settings.APPMAIL_SUPPRESSION_LIST is True, suppressed addresses are
+        removed from the 'to', 'cc' and 'bcc' kwargs (and listed in the
+        message's `suppressed` attribute) - see appmail.suppression.
+
+        In addition to the standard MIMEBase / tuple values, 'attachments' may
+        contain Django File objects with a storage (e.g. FileField values),
+        pathlib.Path objects, or appmail.attachments.Attachment instances -
+        these are streamed at send time, and encoded once per process.
+
         """
         for kw in ('subject', 'body', 'alternatives'):
             assert kw not in email_kwargs, _lazy("Invalid create_message kwarg: '{}'".format(kw))
+        if MEMOIZE_CONTEXT:
+            # expensive lookups are evaluated once for all three parts
+            context = memo.memoize(context)
+        start = time.perf_counter()
         subject = self.render_subject(context)
+        subject_done = time.perf_counter()
         body = self.render_body(context, content_type=EmailTemplate.CONTENT_TYPE_PLAIN)
+        body_done = time.perf_counter()
         html = self.render_body(context, content_type=EmailTemplate.CONTENT_TYPE_HTML)
+        stats.record(self, [
+            ('subject', subject_done - start, subject),
+            ('body_text', body_done - subject_done, body),
+            ('body_html', time.perf_counter() - body_done, html),
+        ])
         email_kwargs['reply_to'] = email_kwargs.get('reply_to') or self.reply_to_list
         email_kwargs['from_email'] = email_kwargs.get('from_email') or self.from_email
+        # copied, as the message adds to its headers (see AppmailMessage), and
+        # the caller may pass the same dict to many create_message calls
+        email_kwargs['headers'] = dict(email_kwargs.get('headers') or {})
         if ADD_EXTRA_HEADERS:
-            email_kwargs['headers'] = email_kwargs.get('headers', {})
             email_kwargs['headers'].update(self.extra_headers)
+        if email_kwargs.get('attachments'):
+            email_kwargs['attachments'] = [
+                attachments.to_mime(a) for a in email_kwargs['attachments']
+            ]
+        suppressed = []
+        if SUPPRESSION_LIST:
+            suppressed = suppression.suppression_list.strip(email_kwargs)
+        if EMAIL_BACKEND and email_kwargs.get('connection') is None:
+            email_kwargs['connection'] = get_connection(EMAIL_BACKEND)
         # alternatives is a list of (content, mimetype) tuples
         # https://github.com/django/django/blob/master/django/core/mail/message.py#L435
-        return EmailMultiAlternatives(
+        return AppmailMessage(
+            template=self,
+            suppressed=suppressed,
             subject=subject,
             body=body,
             alternatives=[(html, EmailTemplate.CONTENT_TYPE_HTML)],
@@ -263,3 +734,449 @@ class EmailTemplate(models.Model):
         self.pk = None
         self.version += 1
         return self.save()
+
+    def promote(self):
+        """Make this the live version of the template - see LiveTemplate."""
+        return LiveTemplate.objects.promote(self.name, self.version, language=self.language)
+
+    @property
+    def is_live(self):
+        """Return True if this is the live version of the template."""
+        return LiveTemplate.objects.filter(template_id=self.pk).exists()
+
+
+class LiveTemplateQuerySet(models.query.QuerySet):
+
+    def _get_locked(self, name, language):
+        return (
+            self.select_for_update()
+            .select_related('template')
+            .filter(name=name, language=language)
+            .first()
+        )
+
+    def _set(self, name, language, template):
+        self.update_or_create(name=name, language=language, defaults={'template': template})
+
+    def offer(self, template):
+        """Make template live if it is active and newer than the live version."""
+        if not template.is_active:
+            return
+        live = self._get_locked(template.name, template.language)
+        if live is None or live.template.version < template.version:
+            self._set(template.name, template.language, template)
+
+    def check_live(self, name, language):
+        """Refresh the live template if the current one has been deactivated / moved."""
+        live = self._get_locked(name, language)
+        if live is None:
+            return self.refresh(name, language)
+        template = live.template
+        if not template.is_active or (template.name, template.language) != (name, language):
+            self.refresh(name, language)
+
+    def refresh(self, name, language):
+        """Point (name, language) at its latest active version (or remove it)."""
+        latest = (
+            EmailTemplate.objects.active()
+            .filter(name=name, language=language)
+            .order_by('version')
+            .last()
+        )
+        if latest is None:
+            self.filter(name=name, language=language).delete()
+        else:
+            self._set(name, language, latest)
+
+    def rebuild(self):
+        """Recreate all live pointers, as the latest active version of each template."""
+        db = routers.for_write(self)
+        with transaction.atomic(using=db):
+            latest = {}
+            for pk, name, language in (
+                EmailTemplate.objects.using(db).active()
+                .order_by('version')
+                .values_list('id', 'name', 'language')
+            ):
+                latest[(name, language)] = pk
+            self.using(db).delete()
+            self.using(db).bulk_create([
+                LiveTemplate(name=name, language=language, template_id=pk)
+                for (name, language), pk in latest.items()
+            ])
+
+    def promote(self, name, version, language=settings.LANGUAGE_CODE):
+        """
+        Atomically make a version of a template live, activating it if required.
+
+        This may be an older version (a rollback) - it remains live until
+        it's deactivated or a newer version is created or activated.
+
+        """
+        db = routers.for_write(self)
+        with transaction.atomic(using=db):
+            template = EmailTemplate.objects.using(db).select_for_update().get(
+                name=name, language=language, version=version
+            )
+            if not template.is_active:
+                template.is_active = True
+                # bypass EmailTemplate.save - the pointer is set explicitly
+                models.Model.save(template, using=db, update_fields=['is_active'])
+            self.using(db)._set(name, language, template)
+            templatecache.record_changes({(name, language)})
+        return template
+
+
+class LiveTemplate(models.Model):
+
+    """
+    The live version of each template (name, language).
+
+    EmailTemplate.objects.current() fetches the template through this table,
+    rather than sorting all the versions of a template. The pointer is kept
+    up to date on save, clone, delete and (bulk) activation / deactivation -
+    by default the live version is the latest active one - and can be set
+    explicitly with promote(), e.g. to roll back to an earlier version.
+
+    """
+    name = models.CharField(
+        _lazy('Template name'),
+        max_length=100
+    )
+    language = models.CharField(
+        _lazy('Language'),
+        max_length=20
+    )
+    template = models.OneToOneField(
+        EmailTemplate,
+        on_delete=models.CASCADE,
+        related_name='live'
+    )
+
+    objects = LiveTemplateQuerySet().as_manager()
+
+    class Meta:
+        unique_together = ('name', 'language')
+
+    def __str__(self):
+        return "{} ({})".format(self.name, self.language)
+
+    def __repr__(self):
+        return "<LiveTemplate name='{}' language='{}' template_id={}>".format(
+            self.name, self.language, self.template_id
+        )
+
+
+class AppmailMessage(EmailMultiAlternatives):
+
+    """
+    EmailMultiAlternatives that knows which EmailTemplate it came from.
+
+    If settings.APPMAIL_LOG_SENT_MESSAGES is True, each successful send() is
+    recorded in the SentMessage log (via the write-behind buffer).
+
+    `suppressed` lists the recipients removed by the suppression list.
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.template = kwargs.pop('template', None)
+        self.suppressed = kwargs.pop('suppressed', [])
+        super(AppmailMessage, self).__init__(*args, **kwargs)
+
+    def message(self):
+        # fix the Message-ID (which would otherwise be generated afresh on
+        # each serialization) so that the ID that is logged is the one that
+        # was sent.
+        self.extra_headers.setdefault('Message-ID', make_msgid(domain=DNS_NAME))
+        return super(AppmailMessage, self).message()
+
+    def send(self, fail_silently=False):
+        sent = super(AppmailMessage, self).send(fail_silently=fail_silently)
+        if sent:
+            sentlog.record(self)
+        return sent
+
+
+class SentMessageQuerySet(models.query.QuerySet):
+
+    def prune(self, max_age):
+        """Delete log rows older than max_age (a timedelta), in bulk."""
+        return self.filter(sent_at__lt=timezone.now() - max_age).delete()
+
+
+class SentMessage(models.Model):
+
+    """
+    Audit log of messages sent from EmailTemplates - one row per recipient.
+
+    Rows are written in batches by appmail.sentlog, rather than as each
+    message is sent.
+
+    """
+    template = models.ForeignKey(
+        EmailTemplate,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='sent_messages'
+    )
+    recipient = models.CharField(
+        _lazy('Recipient'),
+        max_length=254
+    )
+    message_id = models.CharField(
+        _lazy('Message-ID'),
+        max_length=255,
+        blank=True
+    )
+    sent_at = models.DateTimeField(
+        _lazy('Sent at'),
+        db_index=True
+    )
+
+    objects = SentMessageQuerySet().as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['recipient', 'sent_at']),
+            models.Index(fields=['template', 'sent_at']),
+        ]
+
+    def __str__(self):
+        return "{} ({})".format(self.recipient, self.sent_at)
+
+    def __repr__(self):
+        return (
+            "<SentMessage id={} template_id={} recipient='{}'>".format(
+                self.id, self.template_id, self.recipient
+            )
+        )
+
+
+class SuppressedAddressQuerySet(models.query.QuerySet):
+
+    def add(self, addresses, reason):
+        """Suppress addresses (in bulk), ignoring any that already are.
+
+        Returns the SuppressedAddress objects created.
+
+        """
+        rows = {}
+        for address in addresses:
+            address = suppression.normalize(address)
+            if address:
+                rows[address] = SuppressedAddress(address=address, reason=reason)
+        for row in rows.values():
+            row.address_hash = suppression.address_hash(row.address)
+        rows = list(rows.values())
+        db = routers.for_write(self)
+        queryset = self.using(db)
+        created = []
+        for i in range(0, len(rows), 1000):
+            batch = rows[i:i + 1000]
+            existing = set(
+                queryset.filter(address__in=[row.address for row in batch])
+                .values_list('address', flat=True)
+            )
+            batch = [row for row in batch if row.address not in existing]
+            if not batch:
+                continue
+            try:
+                with transaction.atomic(using=db):
+                    created.extend(queryset.bulk_create(batch))
+            except IntegrityError:
+                # some were added since - add the rest one at a time
+                for row in batch:
+                    try:
+                        with transaction.atomic(using=db):
+                            created.append(row.save(using=db))
+                    except IntegrityError:
+                        pass
+        return created
+
+
+class SuppressedAddress(models.Model):
+
+    """
+    An address that messages must not be sent to.
+
+    See appmail.suppression - addresses are stored normalized (the bare
+    address, in lower case), along with their hash.
+
+    """
+
+    REASON_BOUNCE = 'bounce'
+    REASON_COMPLAINT = 'complaint'
+    REASON_UNSUBSCRIBE = 'unsubscribe'
+    REASON_MANUAL = 'manual'
+    REASON_CHOICES = (
+        (REASON_BOUNCE, _lazy('Bounced')),
+        (REASON_COMPLAINT, _lazy('Complained')),
+        (REASON_UNSUBSCRIBE, _lazy('Unsubscribed')),
+        (REASON_MANUAL, _lazy('Added manually')),
+    )
+
+    address = models.CharField(
+        _lazy('Address'),
+        max_length=254,
+        unique=True
+    )
+    address_hash = models.BigIntegerField(
+        _lazy('Address hash'),
+        editable=False
+    )
+    reason = models.CharField(
+        _lazy('Reason'),
+        max_length=20,
+        choices=REASON_CHOICES,
+        default=REASON_MANUAL
+    )
+    created_at = models.DateTimeField(
+        _lazy('Created at'),
+        default=timezone.now
+    )
+
+    objects = SuppressedAddressQuerySet().as_manager()
+
+    class Meta:
+        verbose_name_plural = 'suppressed addresses'
+
+    def __str__(self):
+        return self.address
+
+    def __repr__(self):
+        return "<SuppressedAddress id={} address='{}'>".format(self.id, self.address)
+
+    def save(self, *args, **kwargs):
+        self.address = suppression.normalize(self.address)
+        self.address_hash = suppression.address_hash(self.address)
+        super(SuppressedAddress, self).save(*args, **kwargs)
+        return self
+
+
+class RenderStats(models.Model):
+
+    """
+    Aggregate render statistics for one part of an EmailTemplate.
+
+    Rows are written periodically by appmail.stats (if APPMAIL_RENDER_STATS
+    is True), and are reset when the content of the part changes.
+
+    """
+    PART_CHOICES = (
+        ('subject', _lazy('Subject')),
+        ('body_text', _lazy('Plain text')),
+        ('body_html', _lazy('HTML')),
+    )
+
+    template = models.ForeignKey(
+        EmailTemplate,
+        on_delete=models.CASCADE,
+        related_name='render_stats'
+    )
+    part = models.CharField(
+        _lazy('Part'),
+        max_length=10,
+        choices=PART_CHOICES
+    )
+    digest = models.CharField(
+        _lazy('Content digest'),
+        max_length=64,
+        help_text=_lazy("Digest of the content the stats were collected for.")
+    )
+    count = models.PositiveIntegerField(
+        _lazy('Renders'),
+        default=0
+    )
+    total_time = models.FloatField(
+        _lazy('Total render time (s)'),
+        default=0
+    )
+    total_size = models.BigIntegerField(
+        _lazy('Total output size (chars)'),
+        default=0
+    )
+    p95_time = models.FloatField(
+        _lazy('p95 render time (s)'),
+        null=True,
+        blank=True,
+        help_text=_lazy("95th percentile render time over the most recent sample window.")
+    )
+    updated_at = models.DateTimeField(
+        _lazy('Updated at'),
+        auto_now=True
+    )
+
+    class Meta:
+        unique_together = ('template', 'part')
+        verbose_name_plural = 'render stats'
+
+    def __str__(self):
+        return "{} ({})".format(self.template_id, self.part)
+
+    def __repr__(self):
+        return (
+            "<RenderStats id={} template_id={} part='{}' count={}>".format(
+                self.id, self.template_id, self.part, self.count
+            )
+        )
+
+    @property
+    def mean_time(self):
+        return self.total_time / self.count if self.count else None
+
+    @property
+    def mean_size(self):
+        return self.total_size / self.count if self.count else None
+
+
+class TemplateChangeQuerySet(models.query.QuerySet):
+
+    def generation(self):
+        """Return the current generation - the id of the latest change, or 0."""
+        return self.aggregate(generation=models.Max('id'))['generation'] or 0
+
+    def prune(self, max_age):
+        """Delete changes older than max_age (a timedelta), keeping the latest."""
+        return self.filter(
+            changed_at__lt=timezone.now() - max_age,
+            id__lt=self.generation()
+        ).delete()
+
+
+class TemplateChange(models.Model):
+
+    """
+    Log of changes to EmailTemplates, used to invalidate per-process caches.
+
+    A row is written for each (name, language) affected by every save,
+    delete and bulk update - see appmail.templatecache.
+
+    """
+    name = models.CharField(
+        _lazy('Template name'),
+        max_length=100,
+        blank=True,
+        help_text=_lazy("Blank if the change may affect any template.")
+    )
+    language = models.CharField(
+        _lazy('Language'),
+        max_length=20,
+        blank=True
+    )
+    changed_at = models.DateTimeField(
+        _lazy('Changed at'),
+        default=timezone.now,
+        db_index=True
+    )
+
+    objects = TemplateChangeQuerySet().as_manager()
+
+    def __str__(self):
+        return "{} ({})".format(self.name, self.language)
+
+    def __repr__(self):
+        return "<TemplateChange id={} name='{}' language='{}'>".format(
+            self.id, self.name, self.language
+        )
@@ -0,0 +1,99 @@
+"""
+Prefetch planning from template variable paths.
+
+A template that traverses relations - {{ order.customer.address.city }},
+{% for line in order.lines.all %} - makes queries as it renders, once per
+context object: rendering it for each of a queryset of orders is an N+1
+query problem. appmail.analysis lists the variable paths that a template
+looks up, and this module turns those that start with a given context
+variable into select_related (forward foreign keys and one-to-ones) and
+prefetch_related (reverse foreign keys and many-to-manys, iterated with
+.all) lookups on the model:
+
+    >>> orders = template.prefetch(Order.objects.filter(...), 'order')
+    >>> for order in orders:
+    ...     template.create_message({'order': order}, to=[order.email])
+
+so that rendering the whole queryset takes a fixed number of queries.
+
+Lookups that can't be planned - properties, methods other than .all, or
+relations reached through them - are ignored.
+
+"""
+from django.core.exceptions import FieldDoesNotExist
+
+
+def _relation(model, name):
+    """Return the relation field for an attribute name, or None."""
+    try:
+        field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        # reverse relations are looked up by their query name, not accessor
+        field = None
+        for f in model._meta.get_fields():
+            if f.auto_created and not f.concrete and f.get_accessor_name() == name:
+                field = f
+                break
+    if field is None or not field.is_relation or field.related_model is None:
+        return None
+    if field.auto_created and not field.concrete:
+        # check the accessor - e.g. 'sentmessage_set', not 'sentmessage'
+        if field.get_accessor_name() != name:
+            return None
+    return field
+
+
+def _maximal(lookups):
+    """Drop lookups that are prefixes of other lookups."""
+    return sorted(
+        lookup for lookup in lookups
+        if not any(other.startswith(lookup + '__') for other in lookups)
+    )
+
+
+def plan(model, paths):
+    """
+    Return (select_related, prefetch_related) lookups for paths on a model.
+
+    paths are tuples of lookups relative to an instance of the model, e.g.
+    ('customer', 'address', 'city') or ('lines', 'all', 'product').
+
+    """
+    select, prefetch = set(), set()
+    for path in paths:
+        current = model
+        lookup = []
+        many = False
+        bits = list(path)
+        i = 0
+        while i < len(bits):
+            name = bits[i]
+            field = _relation(current, name)
+            if field is None:
+                break
+            if field.one_to_many or field.many_to_many:
+                # only iterating over .all can use prefetched rows
+                if bits[i + 1:i + 2] != ['all']:
+                    break
+                many = True
+                i += 1
+            lookup.append(name)
+            (prefetch if many else select).add('__'.join(lookup))
+            current = field.related_model
+            i += 1
+    return _maximal(select), _maximal(prefetch)
+
+
+def paths_for(paths, name):
+    """Return the paths (relative to the variable) that start with a context variable name."""
+    return {path[1:] for path in paths if len(path) > 1 and path[0] == name}
+
+
+def apply(queryset, paths):
+    """Return queryset with the select / prefetch_related lookups for paths."""
+    select, prefetch = plan(queryset.model, paths)
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    return queryset
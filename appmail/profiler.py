@@ -0,0 +1,217 @@
+"""
+Template render profiling.
+
+Profiling times every node and variable resolution in a template render,
+and aggregates the timings by template source line - so that the tag or
+variable that makes a template slow can be found. Renders are profiled:
+
+* in the current thread, within a `profiling()` block:
+
+    >>> with profiling() as profiles:
+    ...     template.render_subject(context)
+    >>> print(profiles[0].rows())
+
+* at random, for a fraction (APPMAIL_PROFILE_SAMPLE_RATE) of all renders -
+  sampled profiles are logged to the 'appmail.profiler' logger.
+
+The admin shows the profile of a render of the template's test_context
+("Profile render" on the template change page).
+
+Only the Django template engine supports per-line profiling - other engines
+record the total render time only. A profiled render compiles a private
+copy of the template (the cached copy is shared, and must not be altered),
+so it is considerably slower than a normal render.
+
+"""
+import contextlib
+import logging
+import random
+import threading
+import time
+
+from django.template.base import Node
+
+from . import analysis
+from .settings import PROFILE_SAMPLE_RATE
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class LineProfile(object):
+
+    """
+    Timings for a single template source line.
+
+    `total_time` is the (inclusive) time spent rendering the line's nodes,
+    and `self_time` excludes the time spent in nodes on other lines - e.g.
+    the body of a {% for %} loop. `depth` is the nesting depth of the
+    outermost node on the line.
+
+    """
+
+    def __init__(self, lineno, source):
+        self.lineno = lineno
+        self.source = source
+        self.depth = None
+        self.calls = 0
+        self.total_time = 0.0
+        self.self_time = 0.0
+        self.resolves = 0
+        self.resolve_time = 0.0
+        self.percent = 0.0
+
+    def __repr__(self):
+        return "<LineProfile line={} calls={} total_time={:.6f}>".format(
+            self.lineno, self.calls, self.total_time
+        )
+
+
+class Profile(object):
+
+    """The profile of a single render of a template part."""
+
+    def __init__(self, template, part, source):
+        self.template = template
+        self.part = part
+        self.lines = source.splitlines()
+        self.total_time = 0.0
+        # False if the engine does not support per-line profiling
+        self.supported = True
+        self._stats = {}
+        # stack of [lineno, time spent in children] for the nodes being rendered
+        self._stack = []
+
+    def __str__(self):
+        return "\n".join(
+            "{:>5} {:>9.3f}ms {:>9.3f}ms {:>6} {}{}".format(
+                row.lineno,
+                row.total_time * 1000,
+                row.self_time * 1000,
+                row.calls,
+                '  ' * row.depth,
+                row.source.strip()
+            )
+            for row in self.rows()
+        )
+
+    def line(self, lineno):
+        stats = self._stats.get(lineno)
+        if stats is None:
+            source = self.lines[lineno - 1] if 0 < lineno <= len(self.lines) else ''
+            stats = self._stats[lineno] = LineProfile(lineno, source)
+        return stats
+
+    def rows(self):
+        """Return the LineProfile of every line rendered, in source order."""
+        rows = sorted(self._stats.values(), key=lambda row: row.lineno)
+        for row in rows:
+            row.percent = 100 * row.total_time / self.total_time if self.total_time else 0.0
+        return rows
+
+    def measure(self, func, *args):
+        """Call func(*args), recording the total render time."""
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self.total_time += time.perf_counter() - start
+
+    def timed(self, func, lineno, resolve=False):
+        """Wrap a node's render_annotated or a variable's resolve with a timer."""
+        def wrapper(*args, **kwargs):
+            self._stack.append([lineno, 0.0])
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._record(lineno, time.perf_counter() - start, resolve)
+        return wrapper
+
+    def _record(self, lineno, elapsed, resolve):
+        _lineno, children = self._stack.pop()
+        stats = self.line(lineno)
+        if resolve:
+            stats.resolves += 1
+            stats.resolve_time += elapsed
+        else:
+            stats.calls += 1
+        stats.self_time += elapsed - children
+        # nested nodes on the same line are already included in the outer node
+        if not any(outer == lineno for outer, _children in self._stack):
+            stats.total_time += elapsed
+        if stats.depth is None or len(self._stack) < stats.depth:
+            stats.depth = len(self._stack)
+        if self._stack:
+            self._stack[-1][1] += elapsed
+
+
+def instrument(template, profile):
+    """
+    Wrap every node (and variable) in a compiled django Template with timers.
+
+    The template must not be shared - the timers are set on its nodes.
+
+    """
+    nodes = list(template.nodelist)
+    while nodes:
+        node = nodes.pop()
+        if not isinstance(node, Node):
+            continue
+        token = getattr(node, 'token', None)
+        lineno = getattr(token, 'lineno', 0) or 0
+        node.render_annotated = profile.timed(node.render_annotated, lineno)
+        for value in vars(node).values():
+            for expression in analysis.filter_expressions(value):
+                expression.resolve = profile.timed(expression.resolve, lineno, resolve=True)
+        # (IfNode.nodelist includes the nodes of every branch)
+        for attr in node.child_nodelists:
+            nodes.extend(getattr(node, attr, None) or [])
+    return template
+
+
+def is_profiling():
+    """Return True if renders in this thread are profiled - see profiling()."""
+    return getattr(_local, 'profiles', None) is not None
+
+
+@contextlib.contextmanager
+def profiling():
+    """Profile all renders in this thread; yields the list of Profiles."""
+    previous = getattr(_local, 'profiles', None)
+    profiles = _local.profiles = []
+    try:
+        yield profiles
+    finally:
+        _local.profiles = previous
+
+
+def should_profile():
+    """Return True if the next render should be profiled (explicitly or sampled)."""
+    if is_profiling():
+        return True
+    return bool(PROFILE_SAMPLE_RATE) and random.random() < PROFILE_SAMPLE_RATE
+
+
+def render(engine, template, part, source, context):
+    """Render source with the engine, profiling it, and return the output."""
+    profile = Profile(template, part, source)
+    try:
+        return engine.profile(source, context, profile)
+    finally:
+        collect(profile)
+
+
+def collect(profile):
+    if is_profiling():
+        _local.profiles.append(profile)
+    else:
+        logger.info(
+            "Profiled render of template %s (%s) in %.3fms\n%s",
+            profile.template.pk,
+            profile.part,
+            profile.total_time * 1000,
+            profile,
+            extra={'profile': profile}
+        )
@@ -0,0 +1,158 @@
+"""
+Recipient normalization, validation and deduplication.
+
+Validating addresses one at a time with Django's validate_email - which
+raises on the first invalid address, and re-validates the domain of every
+address - is slow for large recipient lists, and does nothing about
+duplicates. This module processes lists of addresses:
+
+* addresses are normalized - stripped, with the domain lower cased and
+  IDN domains converted to their ASCII (punycode) form (the local part may
+  be case sensitive, so its case is kept);
+* the local part is checked with a precompiled regex (the common
+  dot-atom form first, then the quoted form), and the domain with Django's
+  EmailValidator rules - domain results are cached per process, as bulk
+  lists have relatively few distinct domains;
+* duplicates - compared case insensitively, as most mail servers treat the
+  local part - are removed, across to / cc / bcc and (with a
+  RecipientProcessor) across a batch of messages;
+* rejected addresses are collected in a Rejections aggregate - counts by
+  reason, with a sample of the addresses - rather than raising.
+
+Display names ('Fred <fred@example.com>') are not accepted, as with
+validate_email.
+
+"""
+import collections
+import functools
+import re
+
+from django.core.validators import EmailValidator
+
+from .settings import RECIPIENT_DOMAIN_CACHE_SIZE
+
+ADDRESS_FIELDS = ('to', 'cc', 'bcc')
+
+INVALID = 'invalid'
+DUPLICATE = 'duplicate'
+
+# RFC 3696
+MAX_LENGTH = 320
+
+_validator = EmailValidator()
+
+# domain_whitelist was renamed domain_allowlist in Django 3.2
+if hasattr(_validator, 'domain_allowlist'):
+    _domain_allowlist = _validator.domain_allowlist
+else:
+    _domain_allowlist = _validator.domain_whitelist
+
+DOT_ATOM = re.compile(r"[-!#$%&'*+/=?^_`{}|~0-9a-z]+(?:\.[-!#$%&'*+/=?^_`{}|~0-9a-z]+)*\Z", re.IGNORECASE)
+QUOTED = re.compile(
+    r'"(?:[\001-\010\013\014\016-\037!#-\[\]-\177]|\\[\001-\011\013\014\016-\177])*"\Z',
+    re.IGNORECASE
+)
+
+
+@functools.lru_cache(maxsize=RECIPIENT_DOMAIN_CACHE_SIZE)
+def normalize_domain(domain):
+    """Return the lower case ASCII form of a valid domain, or None."""
+    domain = domain.lower()
+    try:
+        domain = domain.encode('idna').decode('ascii')
+    except UnicodeError:
+        return None
+    if domain in _domain_allowlist or _validator.validate_domain_part(domain):
+        return domain
+    return None
+
+
+def normalize(address):
+    """Return the normalized form of an address, or None if it is invalid."""
+    address = address.strip()
+    if len(address) > MAX_LENGTH:
+        return None
+    local, at, domain = address.rpartition('@')
+    if not at or not (DOT_ATOM.match(local) or QUOTED.match(local)):
+        return None
+    domain = normalize_domain(domain)
+    if domain is None:
+        return None
+    return '{}@{}'.format(local, domain)
+
+
+class Rejections(object):
+
+    """Rejected addresses - the number for each reason, and a sample of each."""
+
+    SAMPLE_SIZE = 10
+
+    def __init__(self):
+        self.counts = collections.Counter()
+        self.samples = collections.defaultdict(list)
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def __str__(self):
+        return ', '.join(
+            "{} {} ({}{})".format(
+                count,
+                reason,
+                ', '.join(self.samples[reason]),
+                ', ...' if count > len(self.samples[reason]) else ''
+            )
+            for reason, count in sorted(self.counts.items())
+        )
+
+    def add(self, reason, address):
+        self.counts[reason] += 1
+        if len(self.samples[reason]) < self.SAMPLE_SIZE:
+            self.samples[reason].append(address)
+
+    def update(self, other):
+        """Add the rejections from another Rejections."""
+        for reason, count in other.counts.items():
+            self.counts[reason] += count
+            sample = self.samples[reason]
+            sample.extend(other.samples[reason][:self.SAMPLE_SIZE - len(sample)])
+
+
+class RecipientProcessor(object):
+
+    """
+    Normalize, validate and dedupe the recipients of a batch of messages.
+
+    Each address is sent to at most once per processor - the first time it
+    is seen, in to, cc or bcc (in that order) of the first message. Addresses
+    that differ only in case are duplicates.
+
+    """
+
+    def __init__(self):
+        self.seen = set()
+        self.rejections = Rejections()
+
+    def clean(self, addresses):
+        """Return the valid, unseen, normalized addresses from a list."""
+        cleaned = []
+        for address in addresses or []:
+            normalized = normalize(address)
+            if normalized is None:
+                self.rejections.add(INVALID, address)
+            elif normalized.lower() in self.seen:
+                self.rejections.add(DUPLICATE, address)
+            else:
+                self.seen.add(normalized.lower())
+                cleaned.append(normalized)
+        return cleaned
+
+    def process(self, **email_kwargs):
+        """Return a dict of the cleaned to / cc / bcc kwargs of one message."""
+        return {field: self.clean(email_kwargs.get(field)) for field in ADDRESS_FIELDS}
+
+
+def clean(addresses):
+    """Return (normalized, deduplicated addresses, Rejections) for a list."""
+    processor = RecipientProcessor()
+    return processor.clean(addresses), processor.rejections
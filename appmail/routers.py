@@ -0,0 +1,118 @@
+"""
+Read-replica routing for appmail models.
+
+Add the router to DATABASE_ROUTERS, and set APPMAIL_READ_REPLICA to the
+alias of a replica database:
+
+    DATABASE_ROUTERS = ['appmail.routers.AppmailReplicaRouter']
+    APPMAIL_READ_REPLICA = 'replica'
+
+Reads of appmail models - template lookups, previews, the admin changelist -
+then go to the replica, and writes to the default database. Replicas lag,
+so once the current thread has written to an appmail model - saved one, or
+changed templates with a bulk update / delete - its reads are pinned to the
+primary. (The pin is set by the write itself, not by db_for_write, which
+Django also calls for e.g. the transaction around an admin change page GET.)
+Bulk writes that read first - to find the templates that they change, say -
+call for_write() before those reads, so that they are pinned too, and run
+in a transaction on the primary.
+The pin lasts until unpin() is called, which
+appmail.middleware.ReplicaPinningMiddleware does at the end of each request
+(it also carries the pin over to the next few requests from the same
+client, with a cookie, to cover the admin's save-then-preview flow).
+
+"""
+import contextlib
+import threading
+
+from django.db import DEFAULT_DB_ALIAS, router
+
+from .settings import READ_REPLICA
+
+APP_LABEL = 'appmail'
+
+_local = threading.local()
+
+
+def is_pinned():
+    """Return True if reads in this thread are pinned to the primary."""
+    return getattr(_local, 'pinned', False)
+
+
+def pin():
+    """Pin reads in this thread to the primary."""
+    _local.pinned = True
+
+
+def has_written():
+    """Return True if this thread has written to an appmail model since unpin()."""
+    return getattr(_local, 'written', False)
+
+
+def unpin():
+    _local.pinned = False
+    _local.written = False
+
+
+def written():
+    """Record a write to an appmail model - pinning reads, if a replica is used."""
+    if READ_REPLICA:
+        pin()
+        _local.written = True
+
+
+def for_write(queryset):
+    """
+    Record a write by queryset, and return the alias of the database it writes to.
+
+    Call this before any reads that the write depends on (and use the alias
+    for the transaction), as until then the queryset reads from the replica.
+
+    """
+    written()
+    return queryset._db or router.db_for_write(queryset.model, **queryset._hints)
+
+
+def on_save(sender, **kwargs):
+    """post_save receiver (connected by AppmailConfig) that calls written()."""
+    if sender._meta.app_label == APP_LABEL:
+        written()
+
+
+@contextlib.contextmanager
+def use_primary():
+    """Context manager that pins reads to the primary for the duration."""
+    pinned = is_pinned()
+    pin()
+    try:
+        yield
+    finally:
+        _local.pinned = pinned
+
+
+class AppmailReplicaRouter(object):
+
+    """Route appmail reads to APPMAIL_READ_REPLICA, unless pinned to the primary."""
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != APP_LABEL or not READ_REPLICA:
+            return None
+        if is_pinned():
+            return DEFAULT_DB_ALIAS
+        return READ_REPLICA
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label != APP_LABEL:
+            return None
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replica has the same data as the primary
+        if APP_LABEL in (obj1._meta.app_label, obj2._meta.app_label):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if app_label == APP_LABEL and READ_REPLICA and db == READ_REPLICA:
+            return False
+        return None
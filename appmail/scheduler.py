@@ -0,0 +1,209 @@
+"""
+Per-domain rate-limited send scheduler.
+
+Mailbox providers throttle per destination domain, and bursts trigger 421
+deferrals. The DomainScheduler groups messages (as produced by
+EmailTemplate.create_message) by recipient domain, applies token bucket
+rate limits per domain and globally, and interleaves the domains so that
+the connection is kept busy with whichever domain has budget available.
+
+    >>> scheduler = DomainScheduler()
+    >>> for user in users:
+    ...     scheduler.add(template.create_message(context, to=[user.email]))
+    >>> scheduler.send()
+
+"""
+import collections
+import logging
+import time
+
+from django.core.mail import get_connection
+
+from . import sentlog
+from .settings import (
+    EMAIL_BACKEND,
+    SCHEDULER_DEFAULT_DOMAIN_RATE,
+    SCHEDULER_DOMAIN_RATES,
+    SCHEDULER_GLOBAL_RATE,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def get_domain(address):
+    """Return the lowercased domain part of an email address."""
+    return address.rpartition('@')[2].strip(' >').lower()
+
+
+class TokenBucket(object):
+
+    """
+    Classic token bucket.
+
+    Tokens accrue at `rate` per second up to `capacity` (which defaults
+    to one second's worth, with a minimum of one token). Each send consumes
+    a token; when the bucket is empty the caller must wait. A capacity of
+    less than one token raises ValueError, as the bucket could never fill.
+
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        assert rate > 0, "rate must be a positive number"
+        if capacity is None:
+            capacity = max(rate, 1)
+        if capacity < 1:
+            raise ValueError("Token bucket capacity must be at least 1, not {}".format(capacity))
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated = clock()
+
+    def __repr__(self):
+        return "<TokenBucket rate={} capacity={}>".format(self.rate, self.capacity)
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, tokens=1):
+        """Return the number of seconds until `tokens` are available."""
+        self._refill()
+        if self.tokens >= tokens:
+            return 0
+        return (tokens - self.tokens) / self.rate
+
+    def consume(self, tokens=1):
+        """Take `tokens` from the bucket if available; return success."""
+        if self.delay(tokens) > 0:
+            return False
+        self.tokens -= tokens
+        return True
+
+
+def parse_rate(value, clock=time.monotonic):
+    """
+    Convert a rate setting into a TokenBucket (or None if unlimited).
+
+    Rates may be specified as a number (messages per second), or as a
+    (rate, burst) tuple.
+
+    """
+    if value is None:
+        return None
+    if isinstance(value, (tuple, list)):
+        return TokenBucket(value[0], capacity=value[1], clock=clock)
+    return TokenBucket(value, clock=clock)
+
+
+class DomainScheduler(object):
+
+    """
+    Interleaves messages by recipient domain within token bucket limits.
+
+    Each message is queued under the domain of its first recipient, and
+    must take a token from the bucket of every distinct domain it is
+    addressed to, as well as from the global bucket.
+
+    Kwargs:
+        domain_rates: dict of domain: rate (or (rate, burst)); defaults
+            to settings.APPMAIL_SCHEDULER_DOMAIN_RATES.
+        default_rate: rate applied to any other domain; defaults to
+            settings.APPMAIL_SCHEDULER_DEFAULT_DOMAIN_RATE (None = unlimited).
+        global_rate: overall rate across all domains; defaults to
+            settings.APPMAIL_SCHEDULER_GLOBAL_RATE (None = unlimited).
+        clock, sleep: time functions, overridable for testing.
+
+    """
+
+    def __init__(self, domain_rates=None, default_rate=SCHEDULER_DEFAULT_DOMAIN_RATE,
+                 global_rate=SCHEDULER_GLOBAL_RATE, clock=time.monotonic, sleep=time.sleep):
+        self.domain_rates = {
+            k.lower(): v for k, v in (
+                SCHEDULER_DOMAIN_RATES if domain_rates is None else domain_rates
+            ).items()
+        }
+        self.default_rate = default_rate
+        self.clock = clock
+        self.sleep = sleep
+        self.global_bucket = parse_rate(global_rate, clock=clock)
+        self.buckets = {}
+        # domain: deque of messages, in insertion order of domain
+        self.queues = collections.OrderedDict()
+
+    def __len__(self):
+        return sum(len(q) for q in self.queues.values())
+
+    def bucket(self, domain):
+        """Return the (lazily created) bucket for a domain, or None."""
+        if domain not in self.buckets:
+            self.buckets[domain] = parse_rate(
+                self.domain_rates.get(domain, self.default_rate),
+                clock=self.clock
+            )
+        return self.buckets[domain]
+
+    def add(self, message):
+        """Queue a message for sending."""
+        recipients = message.recipients()
+        domain = get_domain(recipients[0]) if recipients else ''
+        self.queues.setdefault(domain, collections.deque()).append(message)
+
+    def _buckets_for(self, message):
+        domains = set(get_domain(r) for r in message.recipients())
+        buckets = [self.bucket(d) for d in domains]
+        buckets.append(self.global_bucket)
+        return [b for b in buckets if b is not None]
+
+    def _next(self):
+        """
+        Return the next message that can be sent now, or the delay (in
+        seconds) until one will be ready.
+
+        Domains are visited round-robin, so a throttled domain does not
+        hold up the others.
+
+        """
+        wait = None
+        for domain in list(self.queues):
+            queue = self.queues[domain]
+            buckets = self._buckets_for(queue[0])
+            delay = max([b.delay() for b in buckets] or [0])
+            if delay == 0:
+                for b in buckets:
+                    b.consume()
+                message = queue.popleft()
+                # rotate this domain to the back of the line
+                del self.queues[domain]
+                if queue:
+                    self.queues[domain] = queue
+                return message
+            wait = delay if wait is None else min(wait, delay)
+        return wait
+
+    def __iter__(self):
+        """Yield messages in send order, sleeping while throttled."""
+        while self.queues:
+            result = self._next()
+            if isinstance(result, (int, float)):
+                self.sleep(result)
+            else:
+                yield result
+
+    def send(self, connection=None, fail_silently=False):
+        """
+        Send all queued messages over a single connection.
+
+        Returns the number of messages sent.
+
+        """
+        connection = connection or get_connection(EMAIL_BACKEND, fail_silently=fail_silently)
+        sent = 0
+        with connection:
+            for message in self:
+                if connection.send_messages([message]):
+                    sentlog.record(message)
+                    sent += 1
+        logger.debug("DomainScheduler sent %s messages", sent)
+        return sent
@@ -0,0 +1,129 @@
+"""
+Write-behind log of sent messages.
+
+Writing an audit row per recipient on every send() would double the DB load
+during a campaign, so rows are buffered in memory and written with
+bulk_create once APPMAIL_SENT_LOG_BATCH_SIZE rows are pending, or every
+APPMAIL_SENT_LOG_FLUSH_INTERVAL milliseconds (from a background thread),
+whichever comes first. The buffer is flushed on interpreter shutdown.
+
+Logging is disabled unless APPMAIL_LOG_SENT_MESSAGES is True.
+
+"""
+import atexit
+import logging
+import threading
+
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .settings import (
+    LOG_SENT_MESSAGES,
+    SENT_LOG_BATCH_SIZE,
+    SENT_LOG_FLUSH_INTERVAL,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer(object):
+
+    """
+    Thread-safe buffer of SentMessage rows that are written in batches.
+
+    Kwargs:
+        batch_size: flush as soon as this many rows are pending.
+        flush_interval: flush pending rows at least this often (in ms),
+            from a background thread. None disables the timer.
+
+    """
+
+    def __init__(self, batch_size=SENT_LOG_BATCH_SIZE, flush_interval=SENT_LOG_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._rows = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer = None
+        self._stopped = threading.Event()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def add(self, rows):
+        """Add unsaved SentMessage objects to the buffer."""
+        with self._lock:
+            self._rows.extend(rows)
+            pending = len(self._rows)
+        self._start_timer()
+        if pending >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write all pending rows; return the number written."""
+        from .models import SentMessage
+        # the flush lock ensures batches are written in order
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+            if not rows:
+                return 0
+            try:
+                SentMessage.objects.bulk_create(rows, batch_size=self.batch_size)
+            except Exception:
+                # never let the audit log break sending - the rows are lost.
+                logger.exception("Error writing %s sent message log rows", len(rows))
+                return 0
+        return len(rows)
+
+    def _start_timer(self):
+        if not self.flush_interval or self._timer is not None:
+            return
+        with self._lock:
+            if self._timer is None:
+                self._timer = threading.Thread(
+                    target=self._run,
+                    name='appmail-sentlog',
+                    daemon=True
+                )
+                self._timer.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval / 1000):
+            if self._rows:
+                close_old_connections()
+                self.flush()
+
+    def stop(self):
+        """Stop the background thread and flush any pending rows."""
+        self._stopped.set()
+        self.flush()
+
+
+buffer = WriteBehindBuffer()
+atexit.register(buffer.stop)
+
+
+def record(message, sent_at=None):
+    """
+    Log a sent message produced by EmailTemplate.create_message.
+
+    Adds one row per recipient (to, cc and bcc) to the write-behind buffer.
+    Does nothing if logging is disabled.
+
+    """
+    if not LOG_SENT_MESSAGES:
+        return
+    from .models import SentMessage
+    template = getattr(message, 'template', None)
+    sent_at = sent_at or timezone.now()
+    message_id = message.extra_headers.get('Message-ID', '')
+    buffer.add([
+        SentMessage(
+            template_id=template.pk if template else None,
+            recipient=recipient,
+            message_id=message_id,
+            sent_at=sent_at
+        )
+        for recipient in message.recipients()
+    ])
@@ -8,3 +8,103 @@ VALIDATE_ON_SAVE = getattr(settings, 'APPMAIL_VALIDATE_ON_SAVE', True)
 ADD_EXTRA_HEADERS = getattr(settings, 'APPMAIL_ADD_HEADERS', True)
 # list of context processor functions applied on each render
 CONTEXT_PROCESSORS = [import_string(s) for s in getattr(settings, 'APPMAIL_CONTEXT_PROCESSORS', [])]  # noqa
+# dotted path to the email backend used for messages created by
+# EmailTemplate.create_message; defaults to Django's EMAIL_BACKEND.
+EMAIL_BACKEND = getattr(settings, 'APPMAIL_EMAIL_BACKEND', None)
+# maximum number of open SMTP connections per process (PooledEmailBackend)
+BACKEND_POOL_SIZE = getattr(settings, 'APPMAIL_BACKEND_POOL_SIZE', 4)
+# seconds to wait for a pooled connection before giving up (None = forever)
+BACKEND_POOL_TIMEOUT = getattr(settings, 'APPMAIL_BACKEND_POOL_TIMEOUT', 30)
+# recycle a pooled connection after it has sent this many messages
+BACKEND_MAX_MESSAGES = getattr(settings, 'APPMAIL_BACKEND_MAX_MESSAGES', 100)
+# recycle a pooled connection after it has been idle for this many seconds
+BACKEND_IDLE_TIMEOUT = getattr(settings, 'APPMAIL_BACKEND_IDLE_TIMEOUT', 30)
+# DomainScheduler rate limits, in messages per second, or (rate, burst)
+# tuples. None means unlimited.
+SCHEDULER_GLOBAL_RATE = getattr(settings, 'APPMAIL_SCHEDULER_GLOBAL_RATE', None)
+SCHEDULER_DEFAULT_DOMAIN_RATE = getattr(settings, 'APPMAIL_SCHEDULER_DEFAULT_DOMAIN_RATE', None)  # noqa
+# dict of domain: rate overrides, e.g. {'gmail.com': 10, 'yahoo.com': (5, 20)}
+SCHEDULER_DOMAIN_RATES = getattr(settings, 'APPMAIL_SCHEDULER_DOMAIN_RATES', {})
+# render budget guardrails - None means unlimited.
+# maximum number of context lookups / loop iterations per render
+RENDER_MAX_OPERATIONS = getattr(settings, 'APPMAIL_RENDER_MAX_OPERATIONS', None)
+# maximum wall-clock time (in seconds) per render
+RENDER_TIMEOUT = getattr(settings, 'APPMAIL_RENDER_TIMEOUT', None)
+# maximum size (in characters) of rendered output
+RENDER_MAX_SIZE = getattr(settings, 'APPMAIL_RENDER_MAX_SIZE', None)
+# maximum total size (in bytes) of encoded attachment payloads cached per process
+ATTACHMENT_CACHE_SIZE = getattr(settings, 'APPMAIL_ATTACHMENT_CACHE_SIZE', 64 * 1024 * 1024)
+# dotted path to a callable returning the executor used for background jobs
+# (e.g. admin test emails) - must have a `submit(fn, *args)` method.
+JOB_EXECUTOR = getattr(settings, 'APPMAIL_JOB_EXECUTOR', 'appmail.jobs.thread_pool_executor')
+# number of threads in the default job executor
+JOB_WORKERS = getattr(settings, 'APPMAIL_JOB_WORKERS', 2)
+# cache alias used to store job progress - must be shared across processes
+JOB_CACHE = getattr(settings, 'APPMAIL_JOB_CACHE', 'default')
+# seconds for which job progress is kept
+JOB_TIMEOUT = getattr(settings, 'APPMAIL_JOB_TIMEOUT', 3600)
+# cache alias, and timeout in seconds, for rendered previews
+PREVIEW_CACHE = getattr(settings, 'APPMAIL_PREVIEW_CACHE', 'default')
+PREVIEW_CACHE_TIMEOUT = getattr(settings, 'APPMAIL_PREVIEW_CACHE_TIMEOUT', 24 * 3600)
+# number of template blobs (bodies) cached per process
+BLOB_CACHE_SIZE = getattr(settings, 'APPMAIL_BLOB_CACHE_SIZE', 1000)
+# number of compiled templates cached per process
+COMPILED_CACHE_SIZE = getattr(settings, 'APPMAIL_COMPILED_CACHE_SIZE', 1000)
+# if True, record sent messages in the SentMessage log
+LOG_SENT_MESSAGES = getattr(settings, 'APPMAIL_LOG_SENT_MESSAGES', False)
+# sent message log rows are written in batches of this size...
+SENT_LOG_BATCH_SIZE = getattr(settings, 'APPMAIL_SENT_LOG_BATCH_SIZE', 500)
+# ...or at least this often (in milliseconds); None to only flush on size / exit
+SENT_LOG_FLUSH_INTERVAL = getattr(settings, 'APPMAIL_SENT_LOG_FLUSH_INTERVAL', 1000)
+# default template engine - 'django' or 'jinja2' (requires Jinja2)
+TEMPLATE_ENGINE = getattr(settings, 'APPMAIL_TEMPLATE_ENGINE', 'django')
+# additional engines, as a dict of name: dotted path to an Engine subclass
+TEMPLATE_ENGINES = getattr(settings, 'APPMAIL_TEMPLATE_ENGINES', {})
+# extra kwargs for the jinja2 Environment, e.g. 'loader', 'extensions'
+JINJA2_OPTIONS = getattr(settings, 'APPMAIL_JINJA2_OPTIONS', {})
+# MailboxEmailBackend - maildir directory or mbox file to write messages to
+MAILBOX_PATH = getattr(settings, 'APPMAIL_MAILBOX_PATH', None)
+# 'maildir' or 'mbox'
+MAILBOX_FORMAT = getattr(settings, 'APPMAIL_MAILBOX_FORMAT', 'maildir')
+# number of messages buffered before they are written
+MAILBOX_BATCH_SIZE = getattr(settings, 'APPMAIL_MAILBOX_BATCH_SIZE', 1000)
+# if True, each process writes to its own maildir / mbox
+MAILBOX_SHARD = getattr(settings, 'APPMAIL_MAILBOX_SHARD', False)
+# if True, remove volatile headers / boundaries so that output can be diffed
+MAILBOX_NORMALIZE = getattr(settings, 'APPMAIL_MAILBOX_NORMALIZE', False)
+# if True, record per-template render statistics (shown in the admin)
+RENDER_STATS = getattr(settings, 'APPMAIL_RENDER_STATS', False)
+# render statistics are written to the database this often (in seconds)
+RENDER_STATS_FLUSH_INTERVAL = getattr(settings, 'APPMAIL_RENDER_STATS_FLUSH_INTERVAL', 60)
+# number of recent render times per template part used for the p95
+RENDER_STATS_SAMPLES = getattr(settings, 'APPMAIL_RENDER_STATS_SAMPLES', 1000)
+# warn in the admin when a template's estimated cost score (see appmail.analysis) exceeds this
+COMPLEXITY_WARN = getattr(settings, 'APPMAIL_COMPLEXITY_WARN', None)
+# reject templates in the admin whose estimated cost score exceeds this
+COMPLEXITY_MAX = getattr(settings, 'APPMAIL_COMPLEXITY_MAX', None)
+# if True, cache EmailTemplate.objects.current() / version() lookups per process
+TEMPLATE_CACHE = getattr(settings, 'APPMAIL_TEMPLATE_CACHE', False)
+# check the template change log for invalidations at most this often (in seconds)
+TEMPLATE_CACHE_CHECK_INTERVAL = getattr(settings, 'APPMAIL_TEMPLATE_CACHE_CHECK_INTERVAL', 5)
+# clear the whole cache if the change log has not been checked for this long (in seconds)
+TEMPLATE_CACHE_MAX_IDLE = getattr(settings, 'APPMAIL_TEMPLATE_CACHE_MAX_IDLE', 3600)
+# number of template lookups cached per process
+TEMPLATE_CACHE_SIZE = getattr(settings, 'APPMAIL_TEMPLATE_CACHE_SIZE', 1000)
+# database alias that appmail reads are routed to by appmail.routers.AppmailReplicaRouter
+READ_REPLICA = getattr(settings, 'APPMAIL_READ_REPLICA', None)
+# after a write, a client's reads are pinned to the primary for this long (in seconds)...
+READ_REPLICA_PIN_SECONDS = getattr(settings, 'APPMAIL_READ_REPLICA_PIN_SECONDS', 15)
+# ...using this cookie (set by appmail.middleware.ReplicaPinningMiddleware)
+READ_REPLICA_PIN_COOKIE = getattr(settings, 'APPMAIL_READ_REPLICA_PIN_COOKIE', 'appmail_pin')
+# fraction (0.0 - 1.0) of renders that are profiled and logged - see appmail.profiler
+PROFILE_SAMPLE_RATE = getattr(settings, 'APPMAIL_PROFILE_SAMPLE_RATE', 0.0)
+# if True, create_message evaluates each context lookup once for all parts - see appmail.memo
+MEMOIZE_CONTEXT = getattr(settings, 'APPMAIL_MEMOIZE_CONTEXT', False)
+# if True, create_message removes SuppressedAddress recipients - see appmail.suppression
+SUPPRESSION_LIST = getattr(settings, 'APPMAIL_SUPPRESSION_LIST', False)
+# fetch newly suppressed addresses at most this often (in seconds)
+SUPPRESSION_CHECK_INTERVAL = getattr(settings, 'APPMAIL_SUPPRESSION_CHECK_INTERVAL', 60)
+# reload the whole suppression list (dropping removed addresses) this often (in seconds)
+SUPPRESSION_REBUILD_INTERVAL = getattr(settings, 'APPMAIL_SUPPRESSION_REBUILD_INTERVAL', 3600)
+# number of recipient domains whose validation result is cached per process - see appmail.recipients
+RECIPIENT_DOMAIN_CACHE_SIZE = getattr(settings, 'APPMAIL_RECIPIENT_DOMAIN_CACHE_SIZE', 10000)
@@ -0,0 +1,198 @@
+"""
+Per-template render statistics.
+
+When APPMAIL_RENDER_STATS is True, create_message times the rendering of
+each part (subject, plain text and HTML body) and records the time and
+output size here. Samples are aggregated in memory, per template / part,
+and written to the RenderStats table every APPMAIL_RENDER_STATS_FLUSH_INTERVAL
+seconds (from a background thread) as a single additive UPDATE per row - so
+the cost per message is a dict lookup and a few additions.
+
+Statistics are kept per template content: if a template is edited the
+existing stats for the changed part are replaced rather than mixed with the
+new samples.
+
+"""
+import atexit
+import collections
+import hashlib
+import logging
+import math
+import threading
+
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .settings import (
+    RENDER_STATS,
+    RENDER_STATS_FLUSH_INTERVAL,
+    RENDER_STATS_SAMPLES,
+)
+
+logger = logging.getLogger(__name__)
+
+PARTS = ('subject', 'body_text', 'body_html')
+
+
+def percentile(samples, p):
+    """Return the p-th percentile of a list of numbers (None if empty)."""
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return samples[max(0, math.ceil(p / 100 * len(samples)) - 1)]
+
+
+class Aggregate(object):
+
+    """Render samples for a single template part since the last flush."""
+
+    __slots__ = ('count', 'total_time', 'total_size', 'samples')
+
+    def __init__(self, max_samples):
+        self.count = 0
+        self.total_time = 0.0
+        self.total_size = 0
+        # the most recent render times, for the p95
+        self.samples = collections.deque(maxlen=max_samples)
+
+    def add(self, elapsed, size):
+        self.count += 1
+        self.total_time += elapsed
+        self.total_size += size
+        self.samples.append(elapsed)
+
+
+class StatsCollector(object):
+
+    """
+    Thread-safe, in-process aggregation of render statistics.
+
+    Kwargs:
+        flush_interval: write to the database at least this often (in
+            seconds), from a background thread. None disables the timer.
+        max_samples: number of recent render times kept per template part
+            to calculate the p95.
+
+    """
+
+    def __init__(self, flush_interval=RENDER_STATS_FLUSH_INTERVAL, max_samples=RENDER_STATS_SAMPLES):
+        self.flush_interval = flush_interval
+        self.max_samples = max_samples
+        self._aggregates = {}
+        self._lock = threading.Lock()
+        self._timer = None
+        self._stopped = threading.Event()
+
+    def __len__(self):
+        return len(self._aggregates)
+
+    def record(self, template_id, part, digest, elapsed, size):
+        """Record a single render of a template part."""
+        key = (template_id, part, digest)
+        with self._lock:
+            aggregate = self._aggregates.get(key)
+            if aggregate is None:
+                aggregate = self._aggregates[key] = Aggregate(self.max_samples)
+            aggregate.add(elapsed, size)
+        if self._timer is None and self.flush_interval:
+            self._start_timer()
+
+    def flush(self):
+        """Write the aggregated stats to the database; return the number of rows."""
+        with self._lock:
+            aggregates, self._aggregates = self._aggregates, {}
+        for (template_id, part, digest), aggregate in aggregates.items():
+            try:
+                self._write(template_id, part, digest, aggregate)
+            except Exception:
+                # stats must never break sending - this window is lost.
+                logger.exception("Error writing render stats for template %s", template_id)
+        return len(aggregates)
+
+    def _write(self, template_id, part, digest, aggregate):
+        from .models import EmailTemplate, RenderStats
+        p95 = percentile(aggregate.samples, 95)
+        updated = RenderStats.objects.filter(
+            template_id=template_id,
+            part=part,
+            digest=digest
+        ).update(
+            count=F('count') + aggregate.count,
+            total_time=F('total_time') + aggregate.total_time,
+            total_size=F('total_size') + aggregate.total_size,
+            p95_time=p95,
+            updated_at=timezone.now()
+        )
+        if updated:
+            return
+        # first stats for this content - replace any for previous content
+        if not EmailTemplate.objects.filter(pk=template_id).exists():
+            # deleted since it was rendered
+            return
+        values = {
+            'digest': digest,
+            'count': aggregate.count,
+            'total_time': aggregate.total_time,
+            'total_size': aggregate.total_size,
+            'p95_time': p95,
+        }
+        try:
+            with transaction.atomic():
+                RenderStats.objects.update_or_create(
+                    template_id=template_id,
+                    part=part,
+                    defaults=values
+                )
+        except IntegrityError:
+            # a concurrent insert by another process - this window is lost
+            logger.debug("Unable to write render stats for template %s", template_id)
+
+    def _start_timer(self):
+        with self._lock:
+            if self._timer is None:
+                self._timer = threading.Thread(
+                    target=self._run,
+                    name='appmail-stats',
+                    daemon=True
+                )
+                self._timer.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            if self._aggregates:
+                close_old_connections()
+                self.flush()
+
+    def stop(self):
+        """Stop the background thread and flush any pending stats."""
+        self._stopped.set()
+        self.flush()
+
+
+collector = StatsCollector()
+atexit.register(collector.stop)
+
+
+def record(template, renders):
+    """
+    Record the renders of a template's parts, if stats are enabled.
+
+    Args:
+        template: the (saved) EmailTemplate that was rendered.
+        renders: list of (part, elapsed seconds, output) tuples, where part
+            is one of PARTS.
+
+    """
+    if not RENDER_STATS or template.pk is None:
+        return
+    for part, elapsed, output in renders:
+        collector.record(template.pk, part, digest(template, part), elapsed, len(output))
+
+
+def digest(template, part):
+    """Return the digest of the content of a template part."""
+    if part == 'subject':
+        return hashlib.sha256(template.subject.encode('utf-8')).hexdigest()
+    # bodies are content-addressed already
+    return getattr(template, '{}_blob_id'.format(part))
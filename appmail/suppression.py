@@ -0,0 +1,191 @@
+"""
+Suppression list - addresses that must not be sent to.
+
+Addresses that have bounced, complained or unsubscribed are stored in the
+SuppressedAddress table. With APPMAIL_SUPPRESSION_LIST set to True,
+create_message (and so the bulk sending paths, which use it) strips them
+from the to / cc / bcc recipients of every message.
+
+The table may hold millions of rows, so each process keeps a compact copy
+of it in memory: a sorted array of the 64-bit BLAKE2b hashes of the
+addresses (8 bytes per address), searched with a binary search. A miss
+means that the address is not suppressed, with no query. A hit is only
+probable - hashes can collide, and the address may since have been removed
+- so hits are confirmed against the table, in a single query per message.
+
+The array is refreshed incrementally: at most every
+APPMAIL_SUPPRESSION_CHECK_INTERVAL seconds (on the next lookup) the rows
+added since the last refresh are fetched and merged in. Removed addresses
+are only dropped when the array is rebuilt, every
+APPMAIL_SUPPRESSION_REBUILD_INTERVAL seconds - until then they cost a
+confirmation query, but are not suppressed. A rebuild loads a new array,
+and lookups use the current one until it is complete.
+
+Ids can commit out of order - a transaction that took a lower id may commit
+after one with a higher id has been fetched - so the missing ids below the
+highest id fetched (within the last MAX_GAPS) are recorded as gaps, and
+fetched again on each refresh, until they turn up or GAP_TIMEOUT seconds
+have passed (an id may never commit, if its transaction rolled back).
+
+"""
+import array
+import bisect
+import hashlib
+import heapq
+import threading
+import time
+from email.utils import parseaddr
+
+from django.db.models import Q
+
+from .settings import (
+    SUPPRESSION_CHECK_INTERVAL,
+    SUPPRESSION_REBUILD_INTERVAL,
+)
+
+ADDRESS_FIELDS = ('to', 'cc', 'bcc')
+
+# if more ids than this are missing, rebuild the array instead
+MAX_GAPS = 1000
+
+# stop looking for a missing id after this long (seconds)
+GAP_TIMEOUT = 600
+
+
+def normalize(address):
+    """Return the bare, lower case address from e.g. 'Fred <Fred@example.com>'."""
+    return parseaddr(address)[1].strip().lower()
+
+
+def address_hash(address):
+    """Return the signed 64-bit hash of a normalized address."""
+    digest = hashlib.blake2b(address.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+class SuppressionList(object):
+
+    """
+    In-memory membership test for the SuppressedAddress table.
+
+    Kwargs:
+        check_interval: fetch new rows at most this often (seconds).
+        rebuild_interval: reload every row this often (seconds).
+
+    """
+
+    def __init__(
+        self,
+        check_interval=SUPPRESSION_CHECK_INTERVAL,
+        rebuild_interval=SUPPRESSION_REBUILD_INTERVAL
+    ):
+        self.check_interval = check_interval
+        self.rebuild_interval = rebuild_interval
+        self.last_id = None
+        self.checked = None
+        self.built = None
+        self._hashes = array.array('q')
+        # {missing id: when it was first missed}
+        self._gaps = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def refresh(self, force=False):
+        """Fetch the rows added since the last refresh, or all of them, if due."""
+        from .models import SuppressedAddress
+        now = time.monotonic()
+        with self._lock:
+            if not force and self.checked is not None and now - self.checked < self.check_interval:
+                return
+            rows = SuppressedAddress.objects.order_by().values_list('id', 'address_hash')
+            built = self.built
+            state = None
+            if built is not None and now - built <= self.rebuild_interval:
+                state = self._merge(
+                    (self._hashes, dict(self._gaps), self.last_id),
+                    rows.filter(Q(id__gt=self.last_id) | Q(id__in=list(self._gaps))),
+                    now
+                )
+                hashes, gaps, last_id = state
+                gaps = {pk: missed for pk, missed in gaps.items() if now - missed <= GAP_TIMEOUT}
+                state = (hashes, gaps, last_id) if len(gaps) <= MAX_GAPS else None
+            if state is None:
+                # rebuilt alongside the current array, which is used until then
+                state = self._merge((array.array('q'), {}, 0), rows, now)
+                built = now
+            # the array is replaced, not modified, so readers need no lock -
+            # and if the load fails, the current array is kept (and retried)
+            self._hashes, self._gaps, self.last_id = state
+            self.built = built
+            self.checked = now
+
+    def _merge(self, state, rows, now):
+        # return (hashes, gaps, last_id) with the rows merged into state,
+        # recording any new gaps
+        hashes, gaps, last_id = state
+        ids, new = array.array('q'), []
+        for pk, digest in rows.iterator():
+            ids.append(pk)
+            new.append(digest)
+        for pk in ids:
+            gaps.pop(pk, None)
+        top = max(ids, default=0)
+        if top > last_id:
+            ids = {pk for pk in ids if pk > top - MAX_GAPS}
+            for pk in range(max(last_id + 1, top - MAX_GAPS), top):
+                if pk not in ids:
+                    gaps[pk] = now
+            last_id = top
+        if new:
+            hashes = array.array('q', heapq.merge(hashes, sorted(new)))
+        return hashes, gaps, last_id
+
+    def might_contain(self, address):
+        """Return True if the normalized address is probably suppressed."""
+        hashes = self._hashes
+        digest = address_hash(address)
+        i = bisect.bisect_left(hashes, digest)
+        return i < len(hashes) and hashes[i] == digest
+
+    def suppressed(self, addresses):
+        """Return the set of (normalized) addresses that are suppressed."""
+        from .models import SuppressedAddress
+        self.refresh()
+        candidates = {
+            address for address in map(normalize, addresses)
+            if address and self.might_contain(address)
+        }
+        if not candidates:
+            return set()
+        return set(
+            SuppressedAddress.objects
+            .filter(address__in=candidates)
+            .values_list('address', flat=True)
+        )
+
+    def strip(self, email_kwargs):
+        """
+        Remove suppressed addresses from the to / cc / bcc kwargs, in place.
+
+        Returns the list of addresses that were removed.
+
+        """
+        addresses = [a for f in ADDRESS_FIELDS for a in email_kwargs.get(f) or []]
+        if not addresses:
+            return []
+        suppressed = self.suppressed(addresses)
+        if not suppressed:
+            return []
+        removed = []
+        for field in ADDRESS_FIELDS:
+            if email_kwargs.get(field):
+                kept = []
+                for address in email_kwargs[field]:
+                    (removed if normalize(address) in suppressed else kept).append(address)
+                email_kwargs[field] = kept
+        return removed
+
+
+suppression_list = SuppressionList()
@@ -0,0 +1,224 @@
+"""
+Per-process cache of template lookups, kept coherent across processes.
+
+EmailTemplate.objects.current() and version() hit the database on every
+call. With APPMAIL_TEMPLATE_CACHE set to True the results are cached in
+each process, keyed by (name, language, version) - and every write to a
+template (save, delete, and bulk QuerySet update / delete) appends a row to
+the TemplateChange log, whose auto-incrementing id is a global generation
+stamp.
+
+Each process remembers the last generation it has seen, and at most every
+APPMAIL_TEMPLATE_CACHE_CHECK_INTERVAL seconds (on the next lookup) fetches
+the changes since then in a single query, dropping only the cached entries
+for the (name, language) pairs that changed. Writes in the current process
+invalidate its own cache immediately.
+
+Ids are allocated when a row is inserted, not when it is committed, so a
+change may become visible after changes with higher ids. The ids missing
+below the generation (within the last MAX_CHANGES) are remembered as gaps,
+and fetched again by every check until they appear - or until they are
+older than the max idle time, as the ids of rolled back transactions are
+never filled.
+
+A process that has not checked for APPMAIL_TEMPLATE_CACHE_MAX_IDLE seconds
+clears its cache entirely, so the change log can be pruned with
+TemplateChange.objects.prune(max_age) - max_age must be longer than the
+max idle time.
+
+"""
+import collections
+import copy
+import threading
+import time
+
+from django.db import transaction
+from django.db.models import Q
+
+from .settings import (
+    TEMPLATE_CACHE_CHECK_INTERVAL,
+    TEMPLATE_CACHE_MAX_IDLE,
+    TEMPLATE_CACHE_SIZE,
+)
+
+# (name, language) recorded for changes that may affect any template, such
+# as a bulk update of the name or language fields.
+ALL = ('', '')
+
+# if more changes than this are pending, clear everything instead
+MAX_CHANGES = 1000
+
+
+class TemplateCache(object):
+
+    """
+    LRU cache of template lookups, invalidated from the TemplateChange log.
+
+    Kwargs:
+        check_interval: check the change log at most this often (seconds).
+        max_idle: clear everything if the log has not been checked for
+            this long (seconds).
+        max_size: maximum number of cached lookups.
+
+    """
+
+    def __init__(
+        self,
+        check_interval=TEMPLATE_CACHE_CHECK_INTERVAL,
+        max_idle=TEMPLATE_CACHE_MAX_IDLE,
+        max_size=TEMPLATE_CACHE_SIZE
+    ):
+        self.check_interval = check_interval
+        self.max_idle = max_idle
+        self.max_size = max_size
+        self.generation = None
+        self.checked = None
+        # id: time first missed, of the ids below the generation not yet seen
+        self._gaps = {}
+        self._entries = collections.OrderedDict()
+        # incremented on every invalidation, to detect racing loads
+        self._invalidations = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, loader):
+        """
+        Return a copy of the cached value for key, calling loader() on a miss.
+
+        key is a (name, language, version) tuple. The value is copied so
+        that callers can modify it (e.g. clone()) without affecting the cache.
+
+        """
+        return self.get_many([key], lambda keys: {key: loader()})[key]
+
+    def get_many(self, keys, loader):
+        """
+        Return a dict of key: copy of the cached value for each key.
+
+        The keys that are not cached are loaded with a single call to
+        loader(missing_keys), which must return a dict with every one of
+        them.
+
+        """
+        self.check()
+        values = {}
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    values[key] = self._entries[key]
+            invalidations = self._invalidations
+        missing = [key for key in dict.fromkeys(keys) if key not in values]
+        if missing:
+            loaded = loader(missing)
+            with self._lock:
+                # don't cache values that may have been loaded before an invalidation
+                if invalidations == self._invalidations:
+                    for key in missing:
+                        self._entries[key] = loaded[key]
+                    while len(self._entries) > self.max_size:
+                        self._entries.popitem(last=False)
+            values.update(loaded)
+        return {key: copy.copy(values[key]) for key in keys}
+
+    def invalidate(self, pairs):
+        """Drop the cached entries for (name, language) pairs."""
+        pairs = set(pairs)
+        with self._lock:
+            self._invalidations += 1
+            if ALL in pairs:
+                self._entries.clear()
+            else:
+                for key in [k for k in self._entries if k[:2] in pairs]:
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._invalidations += 1
+            self._entries.clear()
+            self.generation = None
+            self.checked = None
+            self._gaps = {}
+
+    def check(self, force=False):
+        """Apply changes from the TemplateChange log, if due."""
+        from .models import TemplateChange
+        now = time.monotonic()
+        with self._lock:
+            if not force and self.checked is not None and now - self.checked < self.check_interval:
+                return
+            if self.checked is not None and now - self.checked > self.max_idle:
+                # changes may have been pruned from the log since
+                self.generation = None
+            self.checked = now
+            if self.generation is None:
+                self._reset(now)
+                return
+            changes = list(
+                TemplateChange.objects
+                .filter(Q(id__gt=self.generation) | Q(id__in=list(self._gaps)))
+                .order_by('id')
+                .values_list('id', 'name', 'language')[:MAX_CHANGES + 1]
+            )
+            if len(changes) > MAX_CHANGES:
+                self._reset(now)
+                return
+            ids = [pk for pk, _name, _language in changes]
+            for pk in ids:
+                self._gaps.pop(pk, None)
+            self._add_gaps(ids, now)
+            self._gaps = {
+                pk: missed for pk, missed in self._gaps.items() if now - missed <= self.max_idle
+            }
+            if len(self._gaps) > MAX_CHANGES:
+                self._reset(now)
+            elif changes:
+                self.invalidate((name, language) for _id, name, language in changes)
+
+    def _reset(self, now):
+        # clear everything, and start from the latest changes
+        from .models import TemplateChange
+        self._invalidations += 1
+        self._entries.clear()
+        self.generation = 0
+        self._gaps = {}
+        self._add_gaps(
+            TemplateChange.objects.order_by('-id').values_list('id', flat=True)[:MAX_CHANGES],
+            now
+        )
+
+    def _add_gaps(self, ids, now):
+        # advance the generation to the highest id, recording the missing ids
+        # below it (within the last MAX_CHANGES) as gaps
+        ids = set(ids)
+        top = max(ids, default=0)
+        if top <= self.generation:
+            return
+        for pk in range(max(self.generation + 1, top - MAX_CHANGES), top):
+            if pk not in ids:
+                self._gaps[pk] = now
+        self.generation = top
+
+
+cache = TemplateCache()
+
+
+def record_changes(pairs):
+    """
+    Record changes to templates with the (name, language) pairs.
+
+    Appends to the TemplateChange log (in the current transaction), and
+    invalidates this process's cache now and when the transaction commits.
+
+    """
+    from .models import TemplateChange
+    pairs = set(pairs)
+    if not pairs:
+        return
+    TemplateChange.objects.bulk_create([
+        TemplateChange(name=name, language=language) for name, language in pairs
+    ])
+    cache.invalidate(pairs)
+    transaction.on_commit(lambda: cache.invalidate(pairs))
@@ -0,0 +1,57 @@
+from django.contrib.admin.sites import AdminSite
+from django.test import RequestFactory, TestCase
+
+from ..admin import EmailTemplateAdmin, ValidTemplateListFilter
+from ..models import EmailTemplate
+
+
+class EmailTemplateAdminTests(TestCase):
+
+    """appmail.admin.EmailTemplateAdmin tests."""
+
+    def setUp(self):
+        self.admin = EmailTemplateAdmin(EmailTemplate, AdminSite())
+        self.request = RequestFactory().get('/')
+
+    def test_get_search_results(self):
+        template = EmailTemplate(name='test', body_text='{{ user.first_name }}').save()
+        EmailTemplate(name='other').save()
+        queryset = EmailTemplate.objects.all()
+        self.assertEqual(
+            self.admin.get_search_results(self.request, queryset, ''),
+            (queryset, False)
+        )
+        qs, distinct = self.admin.get_search_results(self.request, queryset, 'first_name')
+        self.assertEqual(list(qs), [template])
+        self.assertFalse(distinct)
+
+
+class ValidTemplateListFilterTests(TestCase):
+
+    """appmail.admin.ValidTemplateListFilter tests."""
+
+    def setUp(self):
+        self.admin = EmailTemplateAdmin(EmailTemplate, AdminSite())
+        self.valid = EmailTemplate(name='valid', subject='{{ x }}').save()
+        self.invalid = EmailTemplate(name='invalid', subject='{% if %}').save(validate=False)
+
+    def get_filter(self, params):
+        request = RequestFactory().get('/', params)
+        return ValidTemplateListFilter(request, dict(params), EmailTemplate, self.admin)
+
+    def test_queryset(self):
+        queryset = EmailTemplate.objects.all()
+        self.assertEqual(
+            list(self.get_filter({'valid': '1'}).queryset(None, queryset)),
+            [self.valid]
+        )
+        self.assertEqual(
+            list(self.get_filter({'valid': '0'}).queryset(None, queryset)),
+            [self.invalid]
+        )
+
+    def test_queryset_unfiltered(self):
+        # templates are only validated if the filter is in use
+        queryset = EmailTemplate.objects.all()
+        with self.assertNumQueries(0):
+            self.assertIs(self.get_filter({}).queryset(None, queryset), queryset)
@@ -0,0 +1,162 @@
+import io
+from unittest import mock
+
+from django.contrib import admin
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase
+from django.template import Template
+
+from .. import analysis, engines
+from ..admin import EmailTemplateAdmin
+from ..forms import EmailTemplateForm
+from ..models import EmailTemplate, TemplateChange
+
+NESTED = (
+    "{% for order in orders %}{{ order.id }}"
+    "{% for line in order.lines %}{{ line.name|upper }}: {{ line.price|floatformat:2 }}"
+    "{% empty %}none{% endfor %}{% endfor %}"
+)
+
+
+class DjangoAnalysisTests(TestCase):
+
+    """appmail.analysis.analyze_django tests."""
+
+    def test_flat(self):
+        result = analysis.analyze_django(Template("Hello {{ name|title }}"), 20)
+        self.assertEqual(result.node_count, 2)
+        self.assertEqual(result.loop_depth, 0)
+        self.assertEqual(result.filters, {'title'})
+        self.assertEqual(result.cost, 2)
+
+    def test_nested_loops(self):
+        result = analysis.analyze_django(Template(NESTED))
+        self.assertEqual(result.loop_depth, 2)
+        self.assertEqual(result.filters, {'upper', 'floatformat'})
+        # 1 outer loop, 2 nodes in it, 3 in the inner loop, 1 in {% empty %}
+        self.assertEqual(result.node_count, 7)
+        self.assertEqual(result.cost, 1 + 2 * 10 + 3 * 100 + 10)
+
+    def test_includes(self):
+        result = analysis.analyze_django(Template("{% if x %}{% include 'foo.html' %}{% endif %}"))
+        self.assertEqual(result.includes, 1)
+        self.assertEqual(result.cost, 2 + analysis.INCLUDE_COST)
+
+    def test_add(self):
+        combined = (
+            analysis.analyze_django(Template("{{ a|upper }}"), 1000) +
+            analysis.analyze_django(Template(NESTED))
+        )
+        self.assertEqual(combined.node_count, 8)
+        self.assertEqual(combined.loop_depth, 2)
+        self.assertEqual(combined.filters, {'upper', 'floatformat'})
+        self.assertEqual(combined.size, 1000)
+        self.assertIn('loop depth 2', str(combined))
+
+
+class Jinja2AnalysisTests(TestCase):
+
+    """appmail.analysis.analyze_jinja2 tests."""
+
+    def setUp(self):
+        self.engine = engines.get_engine('jinja2')
+
+    def test_nested_loops(self):
+        source = (
+            "{% for order in orders %}{% for line in order.lines %}"
+            "{{ line.name|upper }}{% include 'x.html' %}{% endfor %}{% endfor %}"
+        )
+        result = self.engine.analyze(self.engine.compile(source), source)
+        self.assertEqual(result.loop_depth, 2)
+        self.assertEqual(result.filters, {'upper'})
+        self.assertEqual(result.includes, 1)
+        self.assertEqual(result.size, len(source))
+
+
+class EmailTemplateAnalysisTests(TestCase):
+
+    """EmailTemplate cost score and admin form thresholds."""
+
+    def form(self, **data):
+        data = dict(
+            {
+                'name': 'test',
+                'language': 'en-us',
+                'version': 0,
+                'subject': 'Hello',
+                'body_text': NESTED,
+                'body_html': '<p>Hello</p>',
+                'is_active': True,
+                'from_email': 'test@example.com',
+                'reply_to': 'test@example.com',
+                'test_context': '{}',
+            },
+            **data
+        )
+        return EmailTemplateForm(data=data)
+
+    def test_cost_score_on_save(self):
+        template = EmailTemplate(name='test', subject='Hello', body_text=NESTED).save()
+        self.assertEqual(template.cost_score, template.analyze().cost)
+        self.assertEqual(template.cost_score, 1 + 331)
+
+    def test_cost_score_invalid(self):
+        template = EmailTemplate(name='test', subject='{% if %}').save(validate=False)
+        self.assertIsNone(template.cost_score)
+
+    def test_analyze_command(self):
+        template = EmailTemplate(name='test', subject='Hello', body_text=NESTED).save()
+        invalid = EmailTemplate(name='invalid', subject='{% if %}').save(validate=False)
+        # e.g. saved before the cost score was added
+        EmailTemplate.objects.filter(pk=template.pk).update(cost_score=None)
+        out, err = io.StringIO(), io.StringIO()
+        call_command('appmail_analyze', stdout=out, stderr=err)
+        self.assertEqual(out.getvalue(), "1 templates scored, 1 could not be analysed.\n")
+        self.assertIn("Unable to analyse template", err.getvalue())
+        template.refresh_from_db()
+        self.assertEqual(template.cost_score, 1 + 331)
+        invalid.refresh_from_db()
+        self.assertIsNone(invalid.cost_score)
+        # only templates without a score, unless --all
+        out = io.StringIO()
+        call_command('appmail_analyze', stdout=out, stderr=io.StringIO())
+        self.assertTrue(out.getvalue().startswith("0 templates scored"))
+        out = io.StringIO()
+        call_command('appmail_analyze', all=True, stdout=out, stderr=io.StringIO())
+        self.assertTrue(out.getvalue().startswith("1 templates scored"))
+
+    def test_analyze_command_records_no_changes(self):
+        template = EmailTemplate(name='test', subject='Hello', body_text=NESTED).save()
+        EmailTemplate.objects.filter(pk=template.pk).update(cost_score=None)
+        changes = TemplateChange.objects.count()
+        call_command('appmail_analyze', stdout=io.StringIO(), stderr=io.StringIO())
+        template.refresh_from_db()
+        self.assertIsNotNone(template.cost_score)
+        self.assertEqual(TemplateChange.objects.count(), changes)
+
+    def test_form_max(self):
+        with mock.patch('appmail.forms.COMPLEXITY_MAX', 100):
+            form = self.form()
+            self.assertFalse(form.is_valid())
+            self.assertIn('Template is too complex', str(form.non_field_errors()))
+        with mock.patch('appmail.forms.COMPLEXITY_MAX', 1000):
+            self.assertTrue(self.form().is_valid())
+
+    def test_form_warn(self):
+        form = self.form()
+        self.assertTrue(form.is_valid())
+        self.assertIsNone(form.complexity_warning)
+        with mock.patch('appmail.forms.COMPLEXITY_WARN', 100):
+            self.assertIn('may be slow to render', form.complexity_warning)
+
+    @mock.patch('appmail.forms.COMPLEXITY_WARN', 100)
+    def test_admin_warning(self):
+        form = self.form()
+        self.assertTrue(form.is_valid())
+        request = RequestFactory().post('/')
+        model_admin = EmailTemplateAdmin(EmailTemplate, admin.site)
+        with mock.patch('appmail.admin.messages') as mock_messages:
+            model_admin.save_model(request, form.instance, form, False)
+        mock_messages.warning.assert_called_once_with(request, form.complexity_warning)
+        self.assertEqual(form.instance.cost_score, 333)
+        self.assertIn('cost 333', model_admin.complexity(form.instance))
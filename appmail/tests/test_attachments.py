@@ -0,0 +1,151 @@
+import base64
+import email
+import os
+import pathlib
+import shutil
+import tempfile
+from unittest import mock
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.db.models.fields.files import FieldFile
+from django.test import TestCase
+
+from .. import attachments
+from ..attachments import (
+    FileAttachment,
+    PayloadCache,
+    StorageAttachment,
+    encode_chunks,
+    to_mime,
+)
+from ..models import EmailTemplate
+
+CONTENT = os.urandom(200 * 1024)
+
+
+class AttachmentTestCase(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.storage = FileSystemStorage(location=self.tmpdir)
+        self.storage.save('terms.pdf', ContentFile(CONTENT))
+        self.path = os.path.join(self.tmpdir, 'terms.pdf')
+        attachments.cache.clear()
+
+
+class EncodeChunksTests(TestCase):
+
+    def test_encode_chunks(self):
+        # chunk boundaries that are not multiples of 57 are handled.
+        chunks = [CONTENT[:1000], CONTENT[1000:1001], CONTENT[1001:]]
+        digest, payload = encode_chunks(chunks)
+        self.assertEqual(payload, base64.encodebytes(CONTENT).decode('ascii'))
+        self.assertEqual(encode_chunks([CONTENT])[0], digest)
+        self.assertEqual(encode_chunks([]), encode_chunks([b'']))
+
+
+class PayloadCacheTests(TestCase):
+
+    def test_lru(self):
+        cache = PayloadCache(max_size=10)
+        cache.set('sig1', 'a', 'x' * 5)
+        cache.set('sig2', 'b', 'y' * 5)
+        self.assertEqual(cache.get('sig1'), 'x' * 5)
+        cache.set('sig3', 'c', 'z' * 5)
+        # b was least recently used
+        self.assertIsNone(cache.get('sig2'))
+        self.assertEqual(cache.get('sig1'), 'x' * 5)
+        self.assertEqual(len(cache), 2)
+
+    def test_dedupe(self):
+        cache = PayloadCache(max_size=10)
+        payload = cache.set('sig1', 'a', 'x' * 5)
+        self.assertIs(cache.set('sig2', 'a', 'x' * 5), payload)
+        self.assertEqual(cache.size, 5)
+        self.assertIsNone(cache.get(None))
+
+    def test_too_large(self):
+        cache = PayloadCache(max_size=10)
+        self.assertEqual(cache.set('sig', 'a', 'x' * 11), 'x' * 11)
+        self.assertEqual(len(cache), 0)
+
+
+class AttachmentTests(AttachmentTestCase):
+
+    def assertAttachment(self, part):
+        self.assertEqual(part.get_content_type(), 'application/pdf')
+        self.assertEqual(part.get_filename(), 'terms.pdf')
+        self.assertEqual(part.get_payload(decode=True), CONTENT)
+
+    def test_storage_attachment(self):
+        attachment = StorageAttachment('terms.pdf', storage=self.storage)
+        self.assertAttachment(attachment)
+        self.assertIsNotNone(attachment.signature)
+
+    def test_file_attachment(self):
+        attachment = FileAttachment(self.path)
+        self.assertAttachment(attachment)
+        empty = os.path.join(self.tmpdir, 'empty.txt')
+        open(empty, 'w').close()
+        self.assertEqual(FileAttachment(empty).get_payload(decode=True), b'')
+
+    def test_encoded_once(self):
+        with mock.patch.object(FileAttachment, 'chunks', autospec=True) as mock_chunks:
+            mock_chunks.return_value = [CONTENT]
+            for _ in range(3):
+                FileAttachment(self.path).get_payload()
+        self.assertEqual(mock_chunks.call_count, 1)
+
+    def test_loaded_once_per_message(self):
+        # larger than the cache, so only the attachment keeps the payload
+        self.addCleanup(setattr, attachments.cache, 'max_size', attachments.cache.max_size)
+        attachments.cache.max_size = 1024
+        template = EmailTemplate(subject='Hi', body_text='Hello')
+        with mock.patch.object(FileAttachment, 'chunks', autospec=True) as mock_chunks:
+            mock_chunks.return_value = [CONTENT]
+            with mock.patch.object(
+                FileAttachment, 'signature', new_callable=mock.PropertyMock
+            ) as mock_signature:
+                mock_signature.return_value = ('terms.pdf', 1)
+                message = template.create_message(
+                    {}, to=['fred@example.com'], attachments=[pathlib.Path(self.path)]
+                )
+                message.message().as_bytes()
+        self.assertEqual(mock_chunks.call_count, 1)
+        self.assertEqual(mock_signature.call_count, 1)
+
+    def test_no_signature(self):
+        # e.g. a storage without get_modified_time - the file is read, but
+        # the cached payload is found by its digest
+        with mock.patch.object(
+            StorageAttachment, 'signature', new_callable=mock.PropertyMock, return_value=None
+        ):
+            with mock.patch('appmail.attachments.encode_chunks', wraps=encode_chunks) as mock_encode:
+                for _ in range(3):
+                    attachment = StorageAttachment('terms.pdf', storage=self.storage)
+                    self.assertEqual(attachment.get_payload(decode=True), CONTENT)
+        self.assertEqual(mock_encode.call_count, 1)
+        self.assertEqual(len(attachments.cache), 1)
+
+    def test_to_mime(self):
+        self.assertIsInstance(to_mime(pathlib.Path(self.path)), FileAttachment)
+        field = mock.Mock(storage=self.storage)
+        attachment = to_mime(FieldFile(None, field, 'terms.pdf'))
+        self.assertIsInstance(attachment, StorageAttachment)
+        self.assertIs(attachment.storage, self.storage)
+        value = ('foo.txt', 'bar', 'text/plain')
+        self.assertIs(to_mime(value), value)
+
+    def test_create_message(self):
+        template = EmailTemplate(subject='Hi', body_text='Hello', body_html='<p>Hello</p>')
+        message = template.create_message(
+            {},
+            to=['fred@example.com'],
+            attachments=[pathlib.Path(self.path), ('foo.txt', 'bar', 'text/plain')]
+        )
+        parsed = email.message_from_bytes(message.message().as_bytes())
+        parts = [p for p in parsed.walk() if p.get_filename()]
+        self.assertEqual([p.get_filename() for p in parts], ['terms.pdf', 'foo.txt'])
+        self.assertEqual(parts[0].get_payload(decode=True), CONTENT)
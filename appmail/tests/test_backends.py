@@ -0,0 +1,248 @@
+import mailbox
+import os
+import smtplib
+import tempfile
+import threading
+from unittest import mock
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail import EmailMessage
+from django.test import TestCase
+
+from .. import backends
+from ..backends import (
+    ConnectionPool,
+    MailboxEmailBackend,
+    PooledConnection,
+    PooledEmailBackend,
+    PoolTimeout,
+)
+from ..models import EmailTemplate
+
+
+class FakeSMTP(object):
+
+    """Minimal stand-in for smtplib.SMTP that records what it is sent."""
+
+    instances = []
+
+    def __init__(self, *args, **kwargs):
+        self.sent = []
+        self.alive = True
+        self.closed = False
+        FakeSMTP.instances.append(self)
+
+    def noop(self):
+        if not self.alive:
+            raise smtplib.SMTPServerDisconnected()
+        return (250, b'OK')
+
+    def sendmail(self, from_email, recipients, message):
+        self.sent.append((from_email, recipients, message))
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTests(TestCase):
+
+    """appmail.backends.ConnectionPool tests."""
+
+    def test_acquire_release(self):
+        pool = ConnectionPool(size=2, max_messages=0, idle_timeout=0)
+        pooled = pool.acquire(FakeSMTP)
+        self.assertIsInstance(pooled, PooledConnection)
+        self.assertEqual(len(pool), 1)
+        pool.release(pooled)
+        self.assertEqual(len(pool), 1)
+        # the same connection is reused
+        self.assertIs(pool.acquire(FakeSMTP), pooled)
+
+    def test_health_check(self):
+        pool = ConnectionPool(size=1, max_messages=0, idle_timeout=0)
+        pooled = pool.acquire(FakeSMTP)
+        pool.release(pooled)
+        pooled.connection.alive = False
+        fresh = pool.acquire(FakeSMTP)
+        self.assertIsNot(fresh, pooled)
+        self.assertTrue(pooled.connection.closed)
+
+    def test_recycle_max_messages(self):
+        pool = ConnectionPool(size=1, max_messages=2, idle_timeout=0)
+        pooled = pool.acquire(FakeSMTP)
+        pooled.sent = 2
+        pool.release(pooled)
+        self.assertTrue(pooled.connection.closed)
+        self.assertEqual(len(pool), 0)
+
+    def test_recycle_idle_timeout(self):
+        pool = ConnectionPool(size=1, max_messages=0, idle_timeout=10)
+        pooled = pool.acquire(FakeSMTP)
+        pool.release(pooled)
+        pooled.last_used -= 11
+        self.assertIsNot(pool.acquire(FakeSMTP), pooled)
+        self.assertTrue(pooled.connection.closed)
+
+    def test_bounded(self):
+        pool = ConnectionPool(size=1, max_messages=0, idle_timeout=0, timeout=0.01)
+        pooled = pool.acquire(FakeSMTP)
+        self.assertRaises(PoolTimeout, pool.acquire, FakeSMTP)
+        # releasing from another thread wakes up a waiting acquire
+        pool.timeout = 5
+        timer = threading.Timer(0.05, pool.release, args=[pooled])
+        timer.start()
+        self.assertIs(pool.acquire(FakeSMTP), pooled)
+        timer.join()
+
+    def test_connect_error(self):
+        pool = ConnectionPool(size=1)
+
+        def connect():
+            raise OSError()
+
+        self.assertRaises(OSError, pool.acquire, connect)
+        # the reserved slot is released
+        self.assertEqual(len(pool), 0)
+        pool.acquire(FakeSMTP)
+
+
+@mock.patch('smtplib.SMTP', FakeSMTP)
+class PooledEmailBackendTests(TestCase):
+
+    """appmail.backends.PooledEmailBackend tests."""
+
+    def setUp(self):
+        FakeSMTP.instances = []
+        patcher = mock.patch.object(backends, '_pools', {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def message(self):
+        return EmailMessage('subject', 'body', 'from@example.com', ['to@example.com'])
+
+    def test_send_messages_reuses_connection(self):
+        for _ in range(3):
+            self.assertEqual(PooledEmailBackend().send_messages([self.message()]), 1)
+        self.assertEqual(len(FakeSMTP.instances), 1)
+        self.assertEqual(len(FakeSMTP.instances[0].sent), 3)
+        self.assertFalse(FakeSMTP.instances[0].closed)
+
+    def test_context_manager(self):
+        with PooledEmailBackend() as backend:
+            backend.send_messages([self.message(), self.message()])
+            self.assertEqual(backend.pooled.sent, 2)
+        self.assertIsNone(backend.connection)
+        self.assertEqual(len(backend.pool), 1)
+
+    def test_broken_connection_discarded(self):
+        backend = PooledEmailBackend()
+        backend.open()
+        backend.connection.sendmail = mock.Mock(side_effect=smtplib.SMTPServerDisconnected())
+        connection = backend.connection
+        self.assertRaises(smtplib.SMTPServerDisconnected, backend.send_messages, [self.message()])
+        backend.close()
+        self.assertTrue(connection.closed)
+        self.assertEqual(len(backend.pool), 0)
+
+    def test_separate_pools(self):
+        backend1 = PooledEmailBackend(host='smtp1.example.com')
+        backend2 = PooledEmailBackend(host='smtp2.example.com')
+        self.assertIsNot(backend1.pool, backend2.pool)
+        self.assertIs(backend1.pool, PooledEmailBackend(host='smtp1.example.com').pool)
+
+    def test_close_pools(self):
+        PooledEmailBackend().send_messages([self.message()])
+        backends.close_pools()
+        self.assertTrue(FakeSMTP.instances[0].closed)
+
+
+class MailboxEmailBackendTests(TestCase):
+
+    """appmail.backends.MailboxEmailBackend tests."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.addCleanup(backends.close_mailboxes)
+        self.template = EmailTemplate(
+            name='test',
+            subject='Hello {{ first_name }}',
+            body_text='Hi {{ first_name }}',
+            body_html='<p>Hi {{ first_name }}</p>'
+        ).save()
+
+    def message(self, first_name='Fred'):
+        return self.template.create_message({'first_name': first_name}, to=['fred@example.com'])
+
+    def test_invalid_config(self):
+        self.assertRaises(ImproperlyConfigured, MailboxEmailBackend)
+        self.assertRaises(ImproperlyConfigured, MailboxEmailBackend, path=self.tmp.name, format='pst')
+
+    def test_maildir(self):
+        path = os.path.join(self.tmp.name, 'maildir')
+        backend = MailboxEmailBackend(path=path)
+        self.assertEqual(backend.send_messages([self.message(), self.message('Ginger')]), 2)
+        self.assertIsNone(backend.mailbox)
+        subjects = sorted(m['Subject'] for m in mailbox.Maildir(path, factory=None))
+        self.assertEqual(subjects, ['Hello Fred', 'Hello Ginger'])
+
+    def test_mbox_batches(self):
+        path = os.path.join(self.tmp.name, 'out', 'messages.mbox')
+        with MailboxEmailBackend(path=path, format='mbox', batch_size=2) as backend:
+            backend.send_messages([self.message()])
+            self.assertEqual(len(backend._buffer), 1)
+            self.assertEqual(len(mailbox.mbox(path)), 0)
+            backend.send_messages([self.message('Ginger')])
+            self.assertEqual(len(backend._buffer), 0)
+            self.assertEqual(len(mailbox.mbox(path)), 2)
+            backend.send_messages([self.message('Bob')])
+        # the remainder is written on close
+        self.assertEqual(
+            [m['Subject'] for m in mailbox.mbox(path)],
+            ['Hello Fred', 'Hello Ginger', 'Hello Bob']
+        )
+
+    def test_send(self):
+        path = os.path.join(self.tmp.name, 'maildir')
+        with self.settings(EMAIL_BACKEND='appmail.backends.MailboxEmailBackend'):
+            with mock.patch('appmail.backends.MAILBOX_PATH', path):
+                self.message().send()
+        self.assertEqual(len(mailbox.Maildir(path, factory=None)), 1)
+
+    def test_mailbox_kept_open(self):
+        path = os.path.join(self.tmp.name, 'messages.mbox')
+        with mock.patch('appmail.backends.mailbox.mbox', wraps=mailbox.mbox) as mock_mbox:
+            for first_name in ('Fred', 'Ginger', 'Bob'):
+                MailboxEmailBackend(path=path, format='mbox').send_messages([self.message(first_name)])
+        mock_mbox.assert_called_once_with(path, create=True)
+        self.assertEqual(
+            [m['Subject'] for m in mailbox.mbox(path)],
+            ['Hello Fred', 'Hello Ginger', 'Hello Bob']
+        )
+        # ...until the process closes them
+        shared = backends.get_mailbox(path, 'mbox')
+        backends.close_mailboxes()
+        self.assertIsNot(backends.get_mailbox(path, 'mbox'), shared)
+
+    def test_shard(self):
+        backend = MailboxEmailBackend(path=self.tmp.name, shard=True)
+        self.assertEqual(
+            backend.get_path(),
+            os.path.join(self.tmp.name, 'worker-{}'.format(os.getpid()))
+        )
+        backend = MailboxEmailBackend(path='out.mbox', format='mbox', shard=True)
+        self.assertEqual(backend.get_path(), 'out.mbox.{}'.format(os.getpid()))
+
+    def test_normalize(self):
+        backend = MailboxEmailBackend(path='out.mbox', format='mbox', normalize=True)
+        data = backend.serialize(self.message())
+        self.assertEqual(data, backend.serialize(self.message()))
+        self.assertTrue(data.startswith(backends.NORMALIZED_FROM_LINE))
+        self.assertNotIn(b'Message-ID', data)
+        self.assertNotIn(b'Date:', data)
+        # without normalization every message differs
+        backend.normalize = False
+        self.assertNotEqual(backend.serialize(self.message()), backend.serialize(self.message()))
@@ -0,0 +1,246 @@
+import io
+import json
+import os
+import pickle
+import tempfile
+from unittest import mock
+
+from django.core import mail
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+
+from .. import campaign
+from ..models import EmailTemplate
+
+
+class RecordTests(TestCase):
+
+    """appmail.campaign record parsing tests."""
+
+    def test_read_records_jsonl(self):
+        stream = io.StringIO('{"to": "a@example.com"}\n\n{"to": "b@example.com"}\n')
+        self.assertEqual(
+            list(campaign.read_records(stream)),
+            [{'to': 'a@example.com'}, {'to': 'b@example.com'}]
+        )
+
+    def test_read_records_csv(self):
+        stream = io.StringIO('email,first_name\na@example.com,Fred\n')
+        self.assertEqual(
+            list(campaign.read_records(stream, 'csv')),
+            [{'email': 'a@example.com', 'first_name': 'Fred'}]
+        )
+
+    def test_guess_format(self):
+        self.assertEqual(campaign.guess_format('foo.CSV'), 'csv')
+        self.assertEqual(campaign.guess_format('foo.jsonl'), 'jsonl')
+        self.assertEqual(campaign.guess_format('-'), 'jsonl')
+
+    def test_parse_record(self):
+        self.assertEqual(
+            campaign.parse_record({
+                'email': 'a@example.com, b@example.com',
+                'cc': ['c@example.com'],
+                'first_name': 'Fred',
+                'context': {'last_name': 'Astaire'}
+            }),
+            (
+                {'first_name': 'Fred', 'last_name': 'Astaire'},
+                {'to': ['a@example.com', 'b@example.com'], 'cc': ['c@example.com'], 'bcc': []}
+            )
+        )
+        self.assertRaises(ValueError, campaign.parse_record, {'first_name': 'Fred'})
+
+    def test_parse_record_json_context(self):
+        # a CSV context column is a JSON string
+        self.assertEqual(
+            campaign.parse_record({'email': 'a@example.com', 'context': '{"first_name": "Fred"}'}),
+            ({'first_name': 'Fred'}, {'to': ['a@example.com'], 'cc': [], 'bcc': []})
+        )
+        self.assertEqual(
+            campaign.parse_record({'email': 'a@example.com', 'context': ''}),
+            ({}, {'to': ['a@example.com'], 'cc': [], 'bcc': []})
+        )
+        for context in ('{"first_name": ', '[1, 2]'):
+            with self.assertRaises(ValueError) as ex:
+                campaign.parse_record({'email': 'a@example.com', 'context': context})
+            self.assertIn("Record 'context'", str(ex.exception))
+
+    def test_batches(self):
+        records = iter(range(7))
+        self.assertEqual(
+            list(campaign.batches(records, 3, start=2)),
+            [(2, [2, 3, 4]), (5, [5, 6])]
+        )
+
+
+class RunTests(TestCase):
+
+    """appmail.campaign.run tests."""
+
+    def setUp(self):
+        self.template = EmailTemplate(
+            name='campaign',
+            subject='Hello {{ first_name }}',
+            body_text='Hi {{ first_name }}'
+        ).save()
+        self.records = [
+            {'to': 'fred@example.com', 'first_name': 'Fred'},
+            {'to': 'ginger@example.com', 'first_name': 'Ginger'},
+            {'first_name': 'Nobody'},
+        ]
+
+    def test_run(self):
+        failures = []
+        stats = campaign.run(
+            self.template,
+            iter(self.records),
+            workers=0,
+            batch_size=2,
+            on_batch=lambda stats, failed: failures.extend(failed),
+            from_email='campaign@example.com'
+        )
+        self.assertEqual((stats.processed, stats.sent, stats.failed), (3, 2, 1))
+        self.assertEqual([m.subject for m in mail.outbox], ['Hello Fred', 'Hello Ginger'])
+        self.assertEqual(mail.outbox[0].from_email, 'campaign@example.com')
+        self.assertEqual(failures, [(self.records[2], "Record has no 'to' address.")])
+
+    def test_recipients(self):
+        failures = []
+        records = [
+            {'to': 'Fred@example.com', 'cc': 'fred@example.com, bad', 'first_name': 'Fred'},
+            {'to': 'fred@example.com', 'first_name': 'Fred again'},
+            {'to': 'bad', 'first_name': 'Bad'},
+        ]
+        stats = campaign.run(
+            self.template,
+            iter(records),
+            workers=0,
+            on_batch=lambda stats, failed: failures.extend(failed),
+        )
+        self.assertEqual((stats.processed, stats.sent, stats.failed), (3, 1, 1))
+        self.assertEqual(mail.outbox[0].to, ['Fred@example.com'])
+        self.assertEqual(mail.outbox[0].cc, [])
+        self.assertEqual(failures, [(records[2], "Record has no valid 'to' address.")])
+        self.assertEqual(stats.rejected.counts, {'duplicate': 2, 'invalid': 2})
+        self.assertIn('addresses rejected: 2 duplicate', str(stats))
+
+    def test_single_connection(self):
+        connection = mock.MagicMock()
+        with mock.patch('appmail.campaign.get_connection', return_value=connection):
+            campaign.run(self.template, iter(self.records[:2]), workers=0, batch_size=1)
+        connection.open.assert_called_once_with()
+        connection.close.assert_called_once_with()
+        self.assertEqual(connection.send_messages.call_count, 2)
+
+    def test_connection_error(self):
+        connection = mock.MagicMock()
+        connection.open.side_effect = OSError("refused")
+        with mock.patch('appmail.campaign.get_connection', return_value=connection):
+            stats = campaign.run(self.template, iter(self.records), workers=0)
+        self.assertEqual((stats.sent, stats.failed), (0, 3))
+        connection.send_messages.assert_not_called()
+
+    def test_checkpoint(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            checkpoint = campaign.Checkpoint(os.path.join(tmp, 'checkpoint.json'))
+            checkpoint.save(1)
+            self.assertEqual(checkpoint.load(), 1)
+            saved = []
+            with mock.patch.object(checkpoint, 'save', side_effect=saved.append):
+                stats = campaign.run(
+                    self.template,
+                    iter(self.records),
+                    workers=0,
+                    batch_size=1,
+                    checkpoint=checkpoint
+                )
+            # the first record is skipped
+            self.assertEqual([m.to for m in mail.outbox], [['ginger@example.com']])
+            self.assertEqual(saved, [2, 3])
+            self.assertEqual((stats.start, stats.processed), (1, 3))
+            # cleared on completion
+            self.assertFalse(os.path.exists(checkpoint.path))
+            self.assertEqual(checkpoint.load(), 0)
+
+    @mock.patch('appmail.campaign.connections')
+    def test_run_workers(self, mock_connections):
+        # messages are sent from the worker processes, so cannot be checked
+        # in mail.outbox - but the stats are returned to the parent.
+        stats = campaign.run(self.template, iter(self.records), workers=2, batch_size=1)
+        self.assertEqual((stats.processed, stats.sent, stats.failed), (3, 2, 1))
+        mock_connections.close_all.assert_called_once_with()
+
+    @mock.patch('appmail.campaign.init_worker')
+    @mock.patch('appmail.campaign.django.setup')
+    def test_start_worker(self, mock_setup, mock_init_worker):
+        state = pickle.dumps((self.template, {'from_email': 'fred@example.com'}))
+        campaign.start_worker(state)
+        mock_setup.assert_not_called()
+        mock_init_worker.assert_called_once_with(self.template, {'from_email': 'fred@example.com'})
+        # a spawned worker sets Django up before unpickling the template
+        with mock.patch.object(campaign.apps, 'ready', False):
+            campaign.start_worker(state)
+        mock_setup.assert_called_once_with()
+
+
+class SendCommandTests(TestCase):
+
+    """appmail_send management command tests."""
+
+    def setUp(self):
+        EmailTemplate(name='campaign', subject='Hello {{ first_name }}').save()
+        EmailTemplate(name='campaign', version=1, subject='Hi {{ first_name }}').save()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def write(self, filename, content):
+        path = os.path.join(self.tmp.name, filename)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_send_csv(self):
+        path = self.write('recipients.csv', 'email,first_name\nfred@example.com,Fred\n')
+        out = io.StringIO()
+        call_command('appmail_send', 'campaign', input=path, workers=0, stdout=out)
+        self.assertIn('1 sent', out.getvalue())
+        self.assertEqual(mail.outbox[0].subject, 'Hi Fred')
+
+    def test_send_version(self):
+        path = self.write('recipients.jsonl', '{"to": "fred@example.com", "first_name": "Fred"}\n')
+        call_command(
+            'appmail_send',
+            'campaign',
+            input=path,
+            workers=0,
+            template_version=0,
+            stdout=io.StringIO()
+        )
+        self.assertEqual(mail.outbox[0].subject, 'Hello Fred')
+
+    def test_failures(self):
+        path = self.write('recipients.jsonl', '{"first_name": "Nobody"}\n')
+        failures = os.path.join(self.tmp.name, 'failures.jsonl')
+        call_command(
+            'appmail_send',
+            'campaign',
+            input=path,
+            workers=0,
+            failures=failures,
+            stdout=io.StringIO(),
+            stderr=io.StringIO()
+        )
+        with open(failures) as f:
+            self.assertEqual(json.loads(f.read())['first_name'], 'Nobody')
+
+    def test_template_not_found(self):
+        self.assertRaises(CommandError, call_command, 'appmail_send', 'missing', workers=0)
+        self.assertRaises(
+            CommandError,
+            call_command,
+            'appmail_send',
+            'campaign',
+            template_version=2,
+            workers=0
+        )
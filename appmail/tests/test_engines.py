@@ -0,0 +1,169 @@
+import io
+import time
+from unittest import mock, skipIf
+
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.management import call_command
+from django.template import TemplateDoesNotExist, TemplateSyntaxError
+from django.test import TestCase
+
+from .. import engines, limits
+from ..limits import RenderLimitExceeded
+from ..models import EmailTemplate
+
+
+class DjangoEngineTests(TestCase):
+
+    """appmail.engines.DjangoEngine tests."""
+
+    def setUp(self):
+        self.engine = engines.DjangoEngine()
+
+    def test_render(self):
+        compiled = self.engine.compile('Hello {{ user.first_name }}')
+        self.assertEqual(
+            self.engine.render(compiled, {'user': {'first_name': 'Fred'}}),
+            'Hello Fred'
+        )
+
+    def test_compile_error(self):
+        self.assertRaises(TemplateSyntaxError, self.engine.compile, '{% if %}')
+
+
+@skipIf(engines.jinja2 is None, "Jinja2 is not installed.")
+class Jinja2EngineTests(TestCase):
+
+    """appmail.engines.Jinja2Engine tests."""
+
+    def setUp(self):
+        self.engine = engines.Jinja2Engine()
+
+    def test_render(self):
+        compiled = self.engine.compile('Hello {{ user.first_name }}')
+        self.assertEqual(
+            self.engine.render(compiled, {'user': {'first_name': 'Fred'}}),
+            'Hello Fred'
+        )
+
+    def test_autoescape(self):
+        compiled = self.engine.compile('{{ name }}')
+        self.assertEqual(self.engine.render(compiled, {'name': '<b>'}), '&lt;b&gt;')
+
+    def test_compile_error(self):
+        self.assertRaises(TemplateSyntaxError, self.engine.compile, '{% if %}')
+
+    def test_render_errors(self):
+        compiled = self.engine.compile('{% include "missing.html" %}')
+        self.assertRaises(TemplateDoesNotExist, self.engine.render, compiled, {})
+        compiled = self.engine.compile('{{ foo() }}')
+        self.assertRaises(TemplateSyntaxError, self.engine.render, compiled, {})
+
+    @mock.patch('appmail.limits.RENDER_MAX_OPERATIONS', 10)
+    def test_render_limits(self):
+        compiled = self.engine.compile('{% for x in items %}{{ x.y }}{% endfor %}')
+        # items, and each iteration and lookup of y
+        items = [{'y': 1}] * 4
+        self.assertEqual(self.engine.render(compiled, {'items': items}), '1111')
+        items = [{'y': 1}] * 5
+        self.assertRaises(RenderLimitExceeded, self.engine.render, compiled, {'items': items})
+        # the budget is not left behind after the render
+        self.assertIsNone(self.engine.environment.budget)
+
+    @mock.patch('appmail.limits.RENDER_MAX_OPERATIONS', 1000)
+    @mock.patch('appmail.limits.RENDER_TIMEOUT', 0.05)
+    def test_long_loop_aborted(self):
+        compiled = self.engine.compile('{% for i in range(3000000) %}{{ i }}{% endfor %}')
+        with mock.patch.object(
+            limits.RenderBudget, 'tick', autospec=True, side_effect=limits.RenderBudget.tick
+        ) as mock_tick:
+            self.assertRaises(RenderLimitExceeded, self.engine.render, compiled, {})
+        # stopped as soon as the budget ran out, not after the loop
+        self.assertEqual(mock_tick.call_count, 1001)
+
+    @mock.patch('appmail.limits.RENDER_TIMEOUT', 0.05)
+    def test_long_loop_timeout(self):
+        compiled = self.engine.compile('{% for i in range(3000000) %}{{ i }}{% endfor %}')
+        started = time.monotonic()
+        self.assertRaises(RenderLimitExceeded, self.engine.render, compiled, {})
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_loop_not_charged_without_limits(self):
+        compiled = self.engine.compile(
+            '{% for x in items %}{{ loop.index }}{{ x }}{% endfor %}{{ items|length }}'
+        )
+        self.assertEqual(self.engine.render(compiled, {'items': 'ab'}), '1a2b2')
+
+    @mock.patch('appmail.limits.RENDER_MAX_SIZE', 3)
+    def test_render_max_size(self):
+        compiled = self.engine.compile('{{ x }}')
+        self.assertRaises(RenderLimitExceeded, self.engine.render, compiled, {'x': 'abcd'})
+
+    def test_email_template(self):
+        template = EmailTemplate(
+            engine='jinja2',
+            subject='Hello {{ user.first_name|upper }}',
+            body_text='{% for x in items %}{{ loop.index }}{% endfor %}',
+            body_html='<p>{{ user.first_name }}</p>'
+        ).save()
+        context = {'user': {'first_name': 'Fred'}, 'items': 'abc'}
+        self.assertEqual(template.render_subject(context), 'Hello FRED')
+        self.assertEqual(template.render_body(context), '123')
+        message = template.create_message(context, to=['fred@example.com'])
+        self.assertEqual(message.alternatives[0][0], '<p>Fred</p>')
+
+    def test_email_template_clean(self):
+        template = EmailTemplate(engine='jinja2', subject='{% if %}')
+        with self.assertRaises(ValidationError) as cm:
+            template.clean()
+        self.assertIn('subject', cm.exception.message_dict)
+        # valid Django syntax is not valid jinja2
+        template = EmailTemplate(engine='jinja2', subject='{{ x|default:"y" }}')
+        self.assertRaises(ValidationError, template.clean)
+        template.engine = 'django'
+        template.clean()
+
+
+class GetEngineTests(TestCase):
+
+    """appmail.engines.get_engine tests."""
+
+    def test_get_engine(self):
+        self.assertIsInstance(engines.get_engine('django'), engines.DjangoEngine)
+        self.assertIs(engines.get_engine('django'), engines.get_engine('django'))
+
+    @mock.patch('appmail.engines.TEMPLATE_ENGINE', 'django')
+    def test_default(self):
+        self.assertIs(engines.get_engine(), engines.get_engine('django'))
+        self.assertEqual(EmailTemplate().engine_name, 'django')
+        self.assertEqual(EmailTemplate(engine='jinja2').engine_name, 'jinja2')
+
+    def test_unknown(self):
+        self.assertRaises(ImproperlyConfigured, engines.get_engine, 'mako')
+        template = EmailTemplate(engine='mako')
+        with self.assertRaises(ValidationError) as cm:
+            template.clean()
+        self.assertIn('engine', cm.exception.message_dict)
+
+    @mock.patch('appmail.engines.jinja2', None)
+    def test_jinja2_not_installed(self):
+        self.assertRaises(ImproperlyConfigured, engines.Jinja2Engine)
+
+
+class BenchmarkCommandTests(TestCase):
+
+    """appmail_benchmark management command tests."""
+
+    def test_digest(self):
+        out = io.StringIO()
+        call_command('appmail_benchmark', iterations=1, orders=1, stdout=out)
+        self.assertIn('digest', out.getvalue())
+        self.assertIn('django', out.getvalue())
+
+    def test_template(self):
+        EmailTemplate(name='test', subject='{{ x|default:"y" }}').save()
+        out = io.StringIO()
+        call_command('appmail_benchmark', template='test', iterations=1, stdout=out)
+        self.assertIn('subject', out.getvalue())
+        if engines.jinja2 is not None:
+            # Django filter syntax is not supported by jinja2
+            self.assertIn('jinja2     error', out.getvalue())
@@ -1,12 +1,11 @@
 from unittest import mock
 
 from django.core.exceptions import ValidationError
-from django.core.mail import EmailMultiAlternatives
 from django.forms import Textarea
-from django.http import HttpRequest
 from django.test import TestCase
 
 from ..forms import (
+    EmailTemplateForm,
     EmailTestForm,
     JSONWidget,
     MultiEmailField,
@@ -34,6 +33,44 @@ class JSONWidgetTests(TestCase):
             )
 
 
+class EmailTemplateFormTests(TestCase):
+
+    def data(self, **kwargs):
+        data = {
+            'name': 'test',
+            'description': '',
+            'language': 'en-us',
+            'version': 0,
+            'subject': 'Hello',
+            'body_text': 'Hello {{ first_name }}',
+            'body_html': '<p>Hello {{ first_name }}</p>',
+            'test_context': '{}',
+            'is_active': True,
+            'from_email': 'fred@example.com',
+            'reply_to': 'fred@example.com',
+        }
+        data.update(kwargs)
+        return data
+
+    def test_save(self):
+        form = EmailTemplateForm(data=self.data())
+        self.assertTrue(form.is_valid(), form.errors)
+        template = EmailTemplate.objects.get(id=form.save().id)
+        self.assertEqual(template.body_text, 'Hello {{ first_name }}')
+        self.assertEqual(template.body_html, '<p>Hello {{ first_name }}</p>')
+
+    def test_initial(self):
+        template = EmailTemplate(name='test', body_text='text', body_html='html').save()
+        form = EmailTemplateForm(instance=template)
+        self.assertEqual(form.initial['body_text'], 'text')
+        self.assertEqual(form.initial['body_html'], 'html')
+
+    def test_validation(self):
+        form = EmailTemplateForm(data=self.data(body_html='{% if %}'))
+        self.assertFalse(form.is_valid())
+        self.assertIn('body_html', form.errors)
+
+
 class MultiEmailFieldTests(TestCase):
 
     def test_to_python(self):
@@ -57,18 +94,34 @@ class MultiEmailFieldTests(TestCase):
         # single email address fails validation - must be a list
         self.assertRaises(ValidationError, form.validate, 'fred@example.com')
 
+    def test_validate_reports_all(self):
+        form = MultiEmailField()
+        with self.assertRaises(ValidationError) as context:
+            form.validate(['fred', 'ginger@example.com', 'bob@'])
+        self.assertEqual(
+            context.exception.messages,
+            ['Enter valid email addresses (2 invalid): fred, bob@']
+        )
+
+    def test_clean(self):
+        form = MultiEmailField()
+        self.assertEqual(
+            form.clean('Fred@Example.com, ginger@example.com, fred@example.com'),
+            ['Fred@Example.com', 'ginger@example.com', 'fred@example.com']
+        )
+
 
 class MultiEmailTemplateFieldTests(TestCase):
 
-    @mock.patch.object(EmailTemplate.objects, 'filter')
-    def test_to_python(self, mock_filter):
+    @mock.patch.object(EmailTemplate.objects, 'with_bodies')
+    def test_to_python(self, mock_with_bodies):
         form = MultiEmailTemplateField()
         self.assertEqual(list(form.to_python(None)), list(EmailTemplate.objects.none()))
         self.assertEqual(list(form.to_python('')), list(EmailTemplate.objects.none()))
         qs = EmailTemplate.objects.none()
         self.assertEqual(form.to_python(qs), qs)
         form.to_python('1, 2')
-        mock_filter.assert_called_once_with(pk__in=[1, 2])
+        mock_with_bodies.return_value.filter.assert_called_once_with(pk__in=[1, 2])
 
 
 class EmailTestFormTests(TestCase):
@@ -80,7 +133,7 @@ class EmailTestFormTests(TestCase):
         form.cleaned_data['context'] = True
         self.assertRaises(ValidationError, form.clean_context)
 
-    def test__create_message(self):
+    def test__email_kwargs(self):
         form = EmailTestForm()
         form.cleaned_data = {
             'context': {'foo': 'bar'},
@@ -89,16 +142,18 @@ class EmailTestFormTests(TestCase):
             'bcc': [],
             'from_email': 'donotreply@example.com'
         }
-        template = EmailTemplate()
-        email = form._create_message(template)
-        self.assertEqual(email.from_email, 'donotreply@example.com')
-        self.assertEqual(email.to, ['fred@example.com'])
-        self.assertEqual(email.cc, [])
-        self.assertEqual(email.bcc, [])
-
-    @mock.patch('appmail.forms.messages')
-    @mock.patch.object(EmailMultiAlternatives, 'send')
-    def test_send_emails(self, mock_send, mock_messages):
+        self.assertEqual(
+            form._email_kwargs(),
+            {
+                'from_email': 'donotreply@example.com',
+                'to': ['fred@example.com'],
+                'cc': [],
+                'bcc': [],
+            }
+        )
+
+    @mock.patch('appmail.forms.jobs.submit_test_emails')
+    def test_submit_job(self, mock_submit):
         template = EmailTemplate()
         form = EmailTestForm()
         form.cleaned_data = {
@@ -109,12 +164,13 @@ class EmailTestFormTests(TestCase):
             'from_email': 'donotreply@example.com',
             'templates': [template]
         }
-        request = HttpRequest()
-        form.send_emails(request)
-        mock_send.assert_called_once()
-        mock_messages.success.assert_called_once()
-
-        # test email failure
-        mock_send.side_effect = Exception()
-        form.send_emails(request)
-        mock_messages.error.assert_called_once()
+        mock_submit.return_value = 'abc'
+        self.assertEqual(form.submit_job(), 'abc')
+        mock_submit.assert_called_once_with(
+            [template],
+            {'foo': 'bar'},
+            from_email='donotreply@example.com',
+            to=['fred@example.com'],
+            cc=[],
+            bcc=[]
+        )
@@ -108,3 +108,14 @@ class HelperTests(TestCase):
             helpers.patch_context(foo, [cp1, cp2]),
             helpers.merge_dicts(foo, bar, baz)
         )
+
+    def test_content_hash(self):
+        self.assertEqual(
+            helpers.content_hash('foo', {'a': 1, 'b': 2}),
+            helpers.content_hash('foo', {'b': 2, 'a': 1})
+        )
+        self.assertNotEqual(
+            helpers.content_hash('foo', 'bar'),
+            helpers.content_hash('foobar')
+        )
+        self.assertEqual(len(helpers.content_hash('')), 64)
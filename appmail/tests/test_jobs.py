@@ -0,0 +1,84 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from django.core import mail
+from django.test import TestCase
+
+from .. import jobs
+from ..models import EmailTemplate
+
+
+@mock.patch('appmail.jobs.JOB_EXECUTOR', 'appmail.jobs.synchronous_executor')
+class JobTests(TestCase):
+
+    """appmail.jobs module tests."""
+
+    def setUp(self):
+        self.template1 = EmailTemplate(name='one', subject='One', body_text='1').save()
+        self.template2 = EmailTemplate(name='two', subject='Two', body_text='2').save()
+
+    def test_submit_test_emails(self):
+        job_id = jobs.submit_test_emails(
+            [self.template1, self.template2],
+            {},
+            to=['fred@example.com']
+        )
+        job = jobs.get_job(job_id)
+        self.assertEqual(job['status'], jobs.STATUS_COMPLETE)
+        self.assertEqual(job['total'], 2)
+        self.assertEqual(
+            [(r['name'], r['status'], r['detail']) for r in job['results']],
+            [
+                ('one', jobs.RESULT_SENT, 'fred@example.com'),
+                ('two', jobs.RESULT_SENT, 'fred@example.com'),
+            ]
+        )
+        self.assertEqual([m.subject for m in mail.outbox], ['One', 'Two'])
+
+    def test_single_connection(self):
+        connection = mock.MagicMock()
+        with mock.patch('appmail.jobs.get_connection', return_value=connection):
+            jobs.submit_test_emails([self.template1, self.template2], {}, to=['a@example.com'])
+        connection.open.assert_called_once_with()
+        connection.close.assert_called_once_with()
+        self.assertEqual(connection.send_messages.call_count, 2)
+        for message in [c[0][0][0] for c in connection.send_messages.call_args_list]:
+            self.assertIs(message.connection, connection)
+
+    def test_send_error(self):
+        with mock.patch.object(EmailTemplate, 'create_message', side_effect=Exception("boom")):
+            job_id = jobs.submit_test_emails([self.template1], {}, to=['a@example.com'])
+        job = jobs.get_job(job_id)
+        self.assertEqual(job['status'], jobs.STATUS_COMPLETE)
+        self.assertEqual(job['results'][0]['status'], jobs.RESULT_ERROR)
+        self.assertEqual(job['results'][0]['detail'], 'boom')
+
+    def test_connection_error(self):
+        connection = mock.MagicMock()
+        connection.open.side_effect = OSError("refused")
+        with mock.patch('appmail.jobs.get_connection', return_value=connection):
+            job_id = jobs.submit_test_emails([self.template1], {}, to=['a@example.com'])
+        job = jobs.get_job(job_id)
+        self.assertEqual(job['status'], jobs.STATUS_COMPLETE)
+        self.assertEqual(job['error'], 'refused')
+        self.assertEqual(job['results'], [])
+
+    def test_get_job(self):
+        self.assertIsNone(jobs.get_job('missing'))
+
+    def test_thread_pool_executor(self):
+        self.assertIs(jobs.thread_pool_executor(), jobs.thread_pool_executor())
+
+    def test_worker_closes_connections(self):
+        executor = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(executor.shutdown)
+        job = mock.Mock(side_effect=Exception("boom"))
+        with mock.patch('appmail.jobs.connections') as mock_connections:
+            # in the calling thread, the connections are left open
+            self.assertRaises(Exception, jobs.run_job, threading.get_ident(), job)
+            mock_connections.close_all.assert_not_called()
+            future = executor.submit(jobs.run_job, threading.get_ident(), job, 1)
+            self.assertRaises(Exception, future.result)
+        job.assert_called_with(1)
+        mock_connections.close_all.assert_called_once_with()
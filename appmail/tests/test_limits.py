@@ -0,0 +1,85 @@
+from unittest import mock
+
+from django.core.exceptions import ValidationError
+from django.template import Context, Template
+from django.test import TestCase
+
+from ..limits import BudgetContext, RenderBudget, RenderLimitExceeded, render
+from ..models import EmailTemplate
+
+LOOP = '{% for x in items %}{% for y in items %}{{ x }}{{ y }}{% endfor %}{% endfor %}'
+
+
+class RenderBudgetTests(TestCase):
+
+    """appmail.limits.RenderBudget tests."""
+
+    def test_is_limited(self):
+        self.assertFalse(RenderBudget().is_limited)
+        self.assertTrue(RenderBudget(max_operations=1).is_limited)
+        self.assertTrue(RenderBudget(timeout=1).is_limited)
+        self.assertTrue(RenderBudget(max_size=1).is_limited)
+
+    def test_tick(self):
+        budget = RenderBudget(max_operations=2)
+        budget.tick()
+        budget.tick()
+        self.assertRaises(RenderLimitExceeded, budget.tick)
+
+    def test_timeout(self):
+        budget = RenderBudget(timeout=1)
+        budget.started -= 2
+        # only checked every CLOCK_INTERVAL operations
+        budget.tick()
+        self.assertRaises(RenderLimitExceeded, budget.check_time)
+        self.assertRaises(RenderLimitExceeded, budget.check_output, '')
+
+    def test_check_output(self):
+        budget = RenderBudget(max_size=3)
+        self.assertEqual(budget.check_output('foo'), 'foo')
+        self.assertRaises(RenderLimitExceeded, budget.check_output, 'fooo')
+
+
+class BudgetContextTests(TestCase):
+
+    """appmail.limits.BudgetContext tests."""
+
+    def test_loop_operations(self):
+        template = Template(LOOP)
+        items = list(range(10))
+        budget = RenderBudget(max_operations=10000)
+        output = template.render(BudgetContext({'items': items}, budget=budget))
+        self.assertEqual(output, template.render(Context({'items': items})))
+        # at least one lookup per variable per inner iteration
+        self.assertGreater(budget.operations, 200)
+        budget = RenderBudget(max_operations=100)
+        self.assertRaises(
+            RenderLimitExceeded,
+            template.render,
+            BudgetContext({'items': items}, budget=budget)
+        )
+
+    def test_render(self):
+        template = Template(LOOP)
+        self.assertEqual(render(template, {'items': [1]}), '11')
+        with mock.patch('appmail.limits.RENDER_MAX_SIZE', 10):
+            self.assertRaises(RenderLimitExceeded, render, template, {'items': list(range(10))})
+        with mock.patch('appmail.limits.RENDER_MAX_OPERATIONS', 10):
+            self.assertRaises(RenderLimitExceeded, render, template, {'items': list(range(10))})
+
+
+class EmailTemplateLimitTests(TestCase):
+
+    """Render limits are surfaced as validation errors."""
+
+    @mock.patch('appmail.limits.RENDER_MAX_SIZE', 10)
+    def test_clean(self):
+        template = EmailTemplate(
+            subject='Hello',
+            body_text='x' * 11,
+            body_html='y' * 11
+        )
+        with self.assertRaises(ValidationError) as ctx:
+            template.clean()
+        self.assertEqual(set(ctx.exception.message_dict), {'body_text', 'body_html'})
+        self.assertRaises(RenderLimitExceeded, template.render_body, {})
@@ -0,0 +1,126 @@
+import io
+import json
+import smtplib
+from unittest import mock, skipIf
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+
+from .. import loadtest
+from ..models import EmailTemplate
+
+
+class SinkTests(TestCase):
+
+    """appmail.loadtest SMTP sink tests."""
+
+    def test_threaded_sink(self):
+        with loadtest.ThreadedSMTPSink() as sink:
+            smtp = smtplib.SMTP(sink.host, sink.port)
+            smtp.noop()
+            smtp.sendmail('from@example.com', ['to@example.com'], 'Subject: test\r\n\r\nHello')
+            smtp.sendmail('from@example.com', ['to@example.com'], 'Subject: test\r\n\r\nAgain')
+            self.assertEqual(smtp.docmd('VRFY')[0], 502)
+            smtp.quit()
+        self.assertEqual(sink.received, 2)
+
+    @skipIf(loadtest.Controller is not None, "aiosmtpd is installed.")
+    def test_aiosmtpd_not_installed(self):
+        self.assertRaises(ImportError, loadtest.AiosmtpdSink().start)
+
+
+class SeedTemplatesTests(TestCase):
+
+    """appmail.loadtest.seed_templates tests."""
+
+    def test_seed_templates(self):
+        EmailTemplate(name='appmail-loadtest-x').save()
+        templates = loadtest.seed_templates(count=3, size=2000)
+        self.assertEqual(
+            sorted(EmailTemplate.objects.values_list('name', flat=True)),
+            ['appmail-loadtest-0', 'appmail-loadtest-1', 'appmail-loadtest-2', 'appmail-loadtest-x']
+        )
+        self.assertGreaterEqual(len(templates[0].body_text), 2000)
+        templates[0].clean()
+
+    def test_seed_templates_existing(self):
+        existing = EmailTemplate(name='appmail-loadtest-1').save()
+        self.assertRaises(ValueError, loadtest.seed_templates, count=3)
+        self.assertEqual(list(EmailTemplate.objects.all()), [existing])
+        loadtest.seed_templates(count=3, replace=True)
+        self.assertFalse(EmailTemplate.objects.filter(pk=existing.pk).exists())
+        self.assertEqual(EmailTemplate.objects.count(), 3)
+
+
+class RunTests(TestCase):
+
+    """appmail.loadtest.run tests."""
+
+    def setUp(self):
+        self.templates = loadtest.seed_templates(count=2, size=100)
+
+    def run_mode(self, mode):
+        with loadtest.ThreadedSMTPSink() as sink:
+            report = loadtest.run(
+                self.templates,
+                messages=10,
+                concurrency=2,
+                mode=mode,
+                host=sink.host,
+                port=sink.port
+            )
+        self.assertEqual(report.messages, 10)
+        self.assertEqual(sink.received, 10)
+        return report
+
+    def test_threads(self):
+        report = self.run_mode('threads')
+        self.assertGreater(report.throughput, 0)
+
+    @mock.patch('appmail.loadtest.connections')
+    def test_processes(self, mock_connections):
+        self.run_mode('processes')
+        mock_connections.close_all.assert_called_once_with()
+
+    def test_invalid_mode(self):
+        self.assertRaises(ValueError, loadtest.run, self.templates, mode='fibers')
+
+
+class ReportTests(TestCase):
+
+    """appmail.loadtest.Report tests."""
+
+    def test_report(self):
+        report = loadtest.Report('threads', 2, [0.004, 0.001, 0.003, 0.002], 2.0, memory=1024 * 1024)
+        self.assertEqual(report.messages, 4)
+        self.assertEqual(report.throughput, 2)
+        self.assertEqual(report.percentile(50), 0.002)
+        self.assertEqual(report.percentile(99), 0.004)
+        self.assertEqual(report.percentile(100), 0.004)
+        self.assertIn('peak memory: 1.0MB', str(report))
+        self.assertEqual(report.as_dict()['p50'], 0.002)
+
+    def test_empty(self):
+        report = loadtest.Report('threads', 1, [], 0)
+        self.assertEqual(report.throughput, 0)
+        self.assertEqual(report.percentile(50), 0)
+
+
+class LoadTestCommandTests(TestCase):
+
+    """appmail_loadtest management command tests."""
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command('appmail_loadtest', templates=2, messages=5, concurrency=1, json=True, stdout=out)
+        self.assertEqual(json.loads(out.getvalue())['messages'], 5)
+        # seeded templates are removed
+        self.assertFalse(EmailTemplate.objects.exists())
+
+    def test_command_existing(self):
+        EmailTemplate(name='appmail-loadtest-0').save()
+        with self.assertRaises(CommandError):
+            call_command('appmail_loadtest', templates=1, messages=1, stdout=io.StringIO())
+        out = io.StringIO()
+        call_command('appmail_loadtest', templates=1, messages=1, replace=True, stdout=out)
+        self.assertIn('1 messages', out.getvalue())
@@ -0,0 +1,197 @@
+import collections
+import datetime
+from unittest import mock
+
+from django.test import TestCase
+from django.utils.html import conditional_escape
+
+from .. import settings
+from ..memo import Memo, MemoCallableProxy, MemoProxy, memoize, unwrap
+from ..models import EmailTemplate, RenderStats
+
+
+class Counter(object):
+
+    def __init__(self):
+        self.calls = 0
+        self.items = {'a': 1}
+
+    @property
+    def value(self):
+        self.calls += 1
+        return self.calls
+
+    def method(self):
+        self.calls += 1
+        return [self.calls]
+
+    def add(self, x):
+        return x + 1
+
+    def __html__(self):
+        return '<b>counter</b>'
+
+
+class MemoTests(TestCase):
+
+    """appmail.memo tests."""
+
+    def setUp(self):
+        self.counter = Counter()
+        self.context = memoize({
+            'counter': self.counter,
+            'name': 'Fred',
+            'when': datetime.date(2020, 1, 1),
+            'items': [Counter(), Counter()],
+        })
+
+    def test_leaf_values_not_wrapped(self):
+        self.assertEqual(type(self.context['name']), str)
+        self.assertEqual(type(self.context['when']), datetime.date)
+        self.assertIsInstance(self.context['counter'], MemoProxy)
+        self.assertIs(unwrap(self.context['counter']), self.counter)
+
+    def test_attribute(self):
+        counter = self.context['counter']
+        self.assertEqual(counter.value, 1)
+        self.assertEqual(counter.value, 1)
+        self.assertEqual(self.counter.calls, 1)
+        self.assertEqual(counter.items['a'], 1)
+
+    def test_call(self):
+        counter = self.context['counter']
+        self.assertIsInstance(counter.method, MemoCallableProxy)
+        self.assertEqual(counter.method(), [1])
+        self.assertEqual(counter.method(), [1])
+        # calls with arguments are not memoized
+        self.assertEqual(counter.add(1), 2)
+
+    def test_shared_objects(self):
+        memo = Memo()
+        context = memoize({'a': self.counter, 'b': {'c': self.counter}}, memo=memo)
+        context['a'].value
+        self.assertEqual(context['b']['c'].value, 1)
+        self.assertEqual(memo.hits, 1)
+
+    def test_container(self):
+        items = self.context['items']
+        self.assertEqual(len(items), 2)
+        self.assertTrue(items)
+        self.assertEqual([item.value for item in items], [1, 1])
+        self.assertEqual([item.value for item in reversed(items)], [1, 1])
+        self.assertIn(items[0], items)
+        self.assertIsInstance(items[0], MemoProxy)
+
+    def test_containers_not_proxied(self):
+        memo = Memo()
+        value = {'a': [1, (self.counter,)], 'b': {2}, 'c': collections.OrderedDict()}
+        wrapped = memo.wrap(value)
+        self.assertEqual(type(wrapped), dict)
+        self.assertEqual(type(wrapped['a']), list)
+        self.assertEqual(type(wrapped['a'][1]), tuple)
+        self.assertIsInstance(wrapped['a'][1][0], MemoProxy)
+        self.assertIs(wrapped['b'], value['b'])
+        self.assertIs(wrapped['c'], value['c'])
+        # the same container is copied once
+        self.assertIs(memo.wrap(value), wrapped)
+
+    def test_recursive_container(self):
+        value = [self.counter]
+        value.append(value)
+        wrapped = Memo().wrap(value)
+        self.assertIs(wrapped[1], wrapped)
+        self.assertIsInstance(wrapped[0], MemoProxy)
+
+    def test_django_render(self):
+        template = EmailTemplate(
+            subject='{{ counter.value }}',
+            body_text=(
+                '{{ counter.value }} {{ counter.method.0 }} {{ counter.method.0 }} '
+                '{{ counter.add }}{% for item in items %}{{ item.value }}{% endfor %} {{ when|date:"Y" }}'
+            ),
+            body_html='{{ counter.items.a }} {{ name }}',
+        )
+        self.assertEqual(template.render_subject(self.context), '1')
+        self.assertEqual(template.render_body(self.context), '1 2 2 11 2020')
+        self.assertEqual(template.render_body(self.context, 'text/html'), '1 Fred')
+        self.assertEqual(self.counter.calls, 2)
+
+    def test_jinja2_render(self):
+        template = EmailTemplate(
+            subject='{{ counter.value }} {{ counter.value }} {{ counter.method()[0] }}',
+            engine='jinja2'
+        )
+        self.assertEqual(template.render_subject(self.context), '1 1 2')
+
+    def test_protocols(self):
+        # e.g. __html__, used by conditional_escape
+        self.assertEqual(conditional_escape(self.context['counter']), '<b>counter</b>')
+
+
+@mock.patch('appmail.models.MEMOIZE_CONTEXT', True)
+class CreateMessageMemoTests(TestCase):
+
+    """EmailTemplate.create_message context memoization."""
+
+    def setUp(self):
+        source = '{{ obj.is_live }}{% for stats in obj.render_stats.all %} {{ stats.part }}{% endfor %}'
+        self.template = EmailTemplate(
+            subject='{{ obj.is_live }}', body_text=source, body_html=source
+        ).save()
+        RenderStats.objects.create(template=self.template, part='subject', digest='x')
+        self.obj = EmailTemplate.objects.get(pk=self.template.pk)
+
+    def create_message(self):
+        return self.template.create_message({'obj': self.obj}, to=['fred@example.com'])
+
+    def test_queries(self):
+        # is_live and render_stats.all, once each
+        with self.assertNumQueries(2):
+            message = self.create_message()
+        self.assertEqual(message.subject, 'True')
+        self.assertEqual(message.body, 'True subject')
+
+    def test_queries_not_memoized(self):
+        # is_live for each part, and render_stats.all for each body
+        with mock.patch('appmail.models.MEMOIZE_CONTEXT', False), self.assertNumQueries(5):
+            message = self.create_message()
+        self.assertEqual(message.body, 'True subject')
+
+    def test_off_by_default(self):
+        self.assertFalse(settings.MEMOIZE_CONTEXT)
+        # templates (and their tags / filters) see the context values themselves
+        with mock.patch('appmail.models.MEMOIZE_CONTEXT', settings.MEMOIZE_CONTEXT):
+            with mock.patch('appmail.models.memo.memoize') as mock_memoize:
+                message = self.template.create_message(
+                    {'obj': self.obj}, to=['fred@example.com']
+                )
+        mock_memoize.assert_not_called()
+        self.assertEqual(message.subject, 'True')
+
+    def test_container_filters(self):
+        context = {'d': {'a': 1, 'b': [1, 2]}, 'l': [{'n': 2, 'v': 'y'}, {'n': 1, 'v': 'x'}]}
+        template = EmailTemplate(
+            subject='{{ l|dictsort:"n"|first|length }}',
+            body_text='{{ d|json_script:"d" }}',
+            body_html='{% for item in l|dictsort:"n" %}{{ item.v }}{% endfor %}',
+        )
+        message = template.create_message(context, to=['fred@example.com'])
+        self.assertEqual(message.subject, '2')
+        self.assertEqual(
+            message.body,
+            '<script id="d" type="application/json">{"a": 1, "b": [1, 2]}</script>'
+        )
+        self.assertEqual(message.alternatives[0][0], 'xy')
+
+    def test_jinja2_container_filters(self):
+        context = {'d': {'a': 1, 'b': [1, 2]}}
+        template = EmailTemplate(
+            subject='{{ d is mapping }}',
+            body_text='{{ d|tojson }}',
+            body_html='{% for k, v in d|dictsort %}{{ k }}{% endfor %}',
+            engine='jinja2'
+        )
+        message = template.create_message(context, to=['fred@example.com'])
+        self.assertEqual(message.subject, 'True')
+        self.assertEqual(message.body, '{"a": 1, "b": [1, 2]}')
+        self.assertEqual(message.alternatives[0][0], 'ab')
@@ -6,7 +6,13 @@ from django.core.mail import EmailMultiAlternatives
 from django.template import TemplateDoesNotExist, TemplateSyntaxError
 from django.test import TestCase
 
-from ..models import EmailTemplate
+from ..models import (
+    EmailTemplate,
+    LiveTemplate,
+    TemplateBlob,
+    TemplateBlobQuerySet,
+    compile_template,
+)
 
 
 class EmailTemplateQuerySetTests(TestCase):
@@ -26,12 +32,53 @@ class EmailTemplateQuerySetTests(TestCase):
         self.assertEqual(EmailTemplate.objects.current('test'), template1)
         self.assertEqual(EmailTemplate.objects.current('test', language='klingon'), None)
 
+    def test_current_many(self):
+        welcome = EmailTemplate(name='welcome', language='en', body_text='Hi').save()
+        EmailTemplate(name='welcome', language='en', version=1, is_active=False).save()
+        welcome_fr = EmailTemplate(name='welcome', language='fr', body_text='Salut').save()
+        goodbye = EmailTemplate(name='goodbye', language='en', body_text='Bye').save()
+        pairs = [
+            ('welcome', 'en'),
+            ('welcome', 'fr'),
+            ('goodbye', 'en'),
+            ('goodbye', 'fr'),
+            ('welcome', 'en'),
+        ]
+        TemplateBlobQuerySet._cache.clear()
+        # the templates, with their bodies
+        with self.assertNumQueries(1):
+            templates = EmailTemplate.objects.current_many(pairs)
+            self.assertEqual([t.body_text for t in templates.values() if t], ['Hi', 'Salut', 'Bye'])
+        self.assertEqual(templates, {
+            ('welcome', 'en'): welcome,
+            ('welcome', 'fr'): welcome_fr,
+            ('goodbye', 'en'): goodbye,
+            ('goodbye', 'fr'): None,
+        })
+        with self.assertNumQueries(0):
+            self.assertEqual(EmailTemplate.objects.current_many([]), {})
+
     def test_version(self):
         template1 = EmailTemplate(name='test', language='en-us', version=1).save()
         template2 = EmailTemplate(name='test', language='en-us', version=0).save()
         self.assertEqual(EmailTemplate.objects.version('test', 1), template1)
         self.assertEqual(EmailTemplate.objects.version('test', 0), template2)
 
+    def test_search(self):
+        template1 = EmailTemplate(
+            name='welcome', subject='Welcome', body_text='Hi {{ user.first_name }}'
+        ).save()
+        template2 = EmailTemplate(
+            name='goodbye', subject='Goodbye', body_html='<a href="https://example.com/bye">'
+        ).save()
+        search = EmailTemplate.objects.search
+        self.assertEqual(list(search('WELCOME')), [template1])
+        self.assertEqual(list(search('"{{ user.first_name }}"')), [template1])
+        self.assertEqual(list(search('example.com/bye')), [template2])
+        self.assertEqual(list(search('welcome user.first_name')), [template1])
+        self.assertEqual(list(search('welcome goodbye')), [])
+        self.assertEqual(search('').count(), 2)
+
 
 class EmailTemplateTests(TestCase):
 
@@ -177,6 +224,19 @@ class EmailTemplateTests(TestCase):
         self.assertRaises(AssertionError, template.create_message, {}, body='foo')
         self.assertRaises(AssertionError, template.create_message, {}, alternatives='foo')
 
+    @mock.patch('appmail.models.EMAIL_BACKEND', 'django.core.mail.backends.locmem.EmailBackend')
+    def test_create_message_connection(self):
+        template = EmailTemplate(subject='Welcome message')
+        message = template.create_message({})
+        self.assertEqual(
+            message.connection.__class__.__module__,
+            'django.core.mail.backends.locmem'
+        )
+        # an explicit connection is not overridden
+        connection = mock.Mock()
+        message = template.create_message({}, connection=connection)
+        self.assertIs(message.connection, connection)
+
     def test_clone_template(self):
         template = EmailTemplate(
             name='Test template',
@@ -190,3 +250,227 @@ class EmailTemplateTests(TestCase):
         self.assertEqual(clone.language, template.language)
         self.assertEqual(clone.version, 1)
         self.assertNotEqual(clone.id, template.id)
+
+
+class TemplateBlobTests(TestCase):
+
+    """appmail.models.TemplateBlob tests."""
+
+    def test_store(self):
+        digest = TemplateBlob.objects.store('foo')
+        self.assertEqual(digest, TemplateBlob.make_digest('foo'))
+        self.assertEqual(TemplateBlob.objects.store('foo'), digest)
+        self.assertEqual(TemplateBlob.objects.get().content, 'foo')
+
+    def test_get_contents(self):
+        digest1 = TemplateBlob.objects.create(digest=TemplateBlob.make_digest('a'), content='a').digest
+        digest2 = TemplateBlob.objects.create(digest=TemplateBlob.make_digest('b'), content='b').digest
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                TemplateBlob.objects.get_contents([digest1, digest2]),
+                {digest1: 'a', digest2: 'b'}
+            )
+        # now cached
+        with self.assertNumQueries(0):
+            self.assertEqual(TemplateBlob.objects.get_content(digest1), 'a')
+
+    def test_deduplication(self):
+        template = EmailTemplate(name='test', body_text='text', body_html='html').save()
+        clone = EmailTemplate.objects.get(id=template.id).clone()
+        EmailTemplate(name='test', language='fr', body_text='text', body_html='le html').save()
+        self.assertEqual(clone.body_text_blob_id, template.body_text_blob_id)
+        self.assertEqual(clone.body_html_blob_id, template.body_html_blob_id)
+        self.assertEqual(TemplateBlob.objects.count(), 3)
+
+    def test_unreferenced(self):
+        template = EmailTemplate(name='test', body_text='text', body_html='html').save()
+        template.body_text = 'new text'
+        template.save()
+        self.assertEqual(
+            list(TemplateBlob.objects.unreferenced().values_list('content', flat=True)),
+            ['text']
+        )
+
+
+class EmailTemplateBodyTests(TestCase):
+
+    """Tests for content-addressed EmailTemplate bodies."""
+
+    def test_bodies(self):
+        template = EmailTemplate(body_text='text', body_html='html')
+        self.assertEqual(template.body_text, 'text')
+        self.assertIsNone(template.body_text_blob_id)
+        template.save()
+        template = EmailTemplate.objects.get(id=template.id)
+        self.assertEqual(template.body_text, 'text')
+        self.assertEqual(template.body_html, 'html')
+        self.assertEqual(EmailTemplate().body_text, '')
+
+    def test_has_body(self):
+        template = EmailTemplate(body_text='text')
+        self.assertTrue(template.has_body_text)
+        self.assertFalse(template.has_body_html)
+        template.save()
+        template = EmailTemplate.objects.get(id=template.id)
+        with self.assertNumQueries(0):
+            self.assertTrue(template.has_body_text)
+            self.assertFalse(template.has_body_html)
+
+    def test_save_unchanged(self):
+        template = EmailTemplate(body_text='text', body_html='html').save()
+        template = EmailTemplate.objects.get(id=template.id)
+        with mock.patch.object(
+            TemplateBlob.objects, 'store', wraps=TemplateBlob.objects.store
+        ) as mock_store:
+            template.save()
+            self.assertEqual(mock_store.call_count, 0)
+            template.body_text = 'changed'
+            template.save()
+            mock_store.assert_called_once_with('changed')
+
+    def test_refresh_from_db(self):
+        template = EmailTemplate(body_text='text', body_html='html').save()
+        template.body_text = 'changed'
+        template.refresh_from_db()
+        self.assertEqual(template.body_text, 'text')
+
+    def test_bodies_loaded_in_one_query(self):
+        for i in range(5):
+            EmailTemplate(name='test', version=i, body_text='text %s' % i, body_html='html').save()
+        TemplateBlobQuerySet._cache.clear()
+        with self.assertNumQueries(1):
+            templates = list(EmailTemplate.objects.with_bodies())
+            self.assertEqual(
+                [t.body_text for t in templates],
+                ['text %s' % i for i in range(5)]
+            )
+            self.assertEqual({t.body_html for t in templates}, {'html'})
+
+    def test_bodies_not_loaded(self):
+        EmailTemplate(name='test', body_text='text', body_html='').save()
+        TemplateBlobQuerySet._cache.clear()
+        # templates fetched without with_bodies() only load them when used
+        with self.assertNumQueries(1):
+            template = EmailTemplate.objects.get()
+            self.assertTrue(template.has_body_text)
+            self.assertFalse(template.has_body_html)
+        with self.assertNumQueries(1):
+            self.assertEqual(template.body_text, 'text')
+
+    def test_compile_template(self):
+        self.assertIs(compile_template('{{ foo }}'), compile_template('{{ foo }}'))
+
+
+class LiveTemplateTests(TestCase):
+
+    """appmail.models.LiveTemplate tests."""
+
+    def setUp(self):
+        self.v0 = EmailTemplate(name='test', language='en', subject='v0').save()
+
+    def clone(self):
+        # clone() updates the instance in place
+        return EmailTemplate.objects.get(pk=self.v0.pk).clone()
+
+    def live(self):
+        return EmailTemplate.objects.current('test', language='en')
+
+    def test_current_single_query(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.live(), self.v0)
+        self.assertTrue(self.v0.is_live)
+
+    def test_clone_is_live(self):
+        v1 = self.clone()
+        self.assertEqual(self.live(), v1)
+        self.assertEqual(LiveTemplate.objects.get().template, v1)
+
+    def test_older_version_is_not_live(self):
+        EmailTemplate(name='test', language='en', version=2, subject='v2').save()
+        v1 = EmailTemplate(name='test', language='en', version=1, subject='v1').save()
+        self.assertEqual(self.live().version, 2)
+        self.assertFalse(v1.is_live)
+
+    def test_deactivate(self):
+        v1 = self.clone()
+        v1.is_active = False
+        v1.save()
+        self.assertEqual(self.live().version, 0)
+        EmailTemplate.objects.filter(name='test').update(is_active=False)
+        self.assertIsNone(self.live())
+        self.assertFalse(LiveTemplate.objects.exists())
+
+    def test_bulk_activate(self):
+        EmailTemplate(name='test', language='en', version=1, is_active=False).save()
+        self.assertEqual(self.live().version, 0)
+        EmailTemplate.objects.filter(name='test').update(is_active=True)
+        self.assertEqual(self.live().version, 1)
+
+    def test_delete(self):
+        v1 = self.clone()
+        v1.delete()
+        self.assertEqual(self.live(), self.v0)
+        EmailTemplate.objects.all().delete()
+        self.assertFalse(LiveTemplate.objects.exists())
+
+    def test_rename(self):
+        v1 = self.clone()
+        v1.name = 'renamed'
+        v1.save()
+        self.assertEqual(self.live(), self.v0)
+        self.assertEqual(EmailTemplate.objects.current('renamed', language='en'), v1)
+
+    def test_bulk_rename(self):
+        EmailTemplate.objects.filter(name='test').update(name='renamed')
+        self.assertIsNone(self.live())
+        self.assertEqual(EmailTemplate.objects.current('renamed', language='en'), self.v0)
+
+    def test_bulk_rename_keeps_other_pins(self):
+        other = EmailTemplate(name='other', language='en').save()
+        other_v1 = EmailTemplate.objects.get(pk=other.pk).clone()
+        self.clone()
+        LiveTemplate.objects.promote('test', 0, language='en')
+        LiveTemplate.objects.promote('other', 0, language='en')
+        EmailTemplate.objects.filter(pk=other_v1.pk).update(name='renamed')
+        # the rolled back 'test' template is not touched
+        self.assertEqual(self.live(), self.v0)
+        self.assertEqual(EmailTemplate.objects.current('other', language='en'), other)
+        self.assertEqual(EmailTemplate.objects.current('renamed', language='en'), other_v1)
+
+    def test_save_unloaded_instance(self):
+        # an instance that was not loaded from the db, e.g. from a form
+        template = EmailTemplate(
+            pk=self.v0.pk, name='test', language='en', version=0, subject='edited'
+        )
+        template.save()
+        self.assertEqual(self.live().subject, 'edited')
+
+    def test_promote_rollback(self):
+        v1 = self.clone()
+        LiveTemplate.objects.promote('test', 0, language='en')
+        self.assertEqual(self.live(), self.v0)
+        # an unrelated edit to the newer version does not undo the rollback
+        v1.subject = 'edited'
+        v1.save()
+        self.assertEqual(self.live(), self.v0)
+        # ...but a new version does
+        v2 = EmailTemplate.objects.get(pk=v1.pk).clone()
+        self.assertEqual(self.live(), v2)
+
+    def test_promote_inactive(self):
+        v1 = self.clone()
+        v1.is_active = False
+        v1.save()
+        v1.promote()
+        v1.refresh_from_db()
+        self.assertTrue(v1.is_active)
+        self.assertEqual(self.live(), v1)
+
+    def test_promote_missing(self):
+        self.assertRaises(EmailTemplate.DoesNotExist, LiveTemplate.objects.promote, 'test', 5)
+
+    def test_rebuild(self):
+        self.clone()
+        LiveTemplate.objects.all().delete()
+        LiveTemplate.objects.rebuild()
+        self.assertEqual(self.live().version, 1)
@@ -0,0 +1,171 @@
+"""
+Query count and latency regression tests.
+
+Each scenario is run over a range of template counts and body sizes, and
+the number of queries must not depend on either - an N+1 regression will
+fail here before it's noticed in production. The timing budgets are very
+generous (they must pass on a slow CI box) and are only intended to catch
+pathological regressions, such as rendering every template on every page.
+
+"""
+import contextlib
+import time
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core import mail
+from django.test import TestCase
+from django.urls import reverse
+
+from ..models import EmailTemplate, TemplateBlobQuerySet, compile_template
+
+# (number of templates, approximate body size in characters)
+SCENARIOS = [(1, 100), (10, 100), (10, 50000), (50, 1000)]
+
+# maximum seconds for any single request / call
+TIME_BUDGET = 2.0
+
+# per-request queries for the session and user lookup
+AUTH_QUERIES = 2
+
+
+def make_body(size):
+    """Return a template body of approximately `size` characters."""
+    line = "Hello {{ user.first_name }}, this is line {{ forloop.counter }}.\n"
+    return (
+        "{% for i in items %}" + line * max(1, size // len(line)) + "{% endfor %}"
+    )
+
+
+@mock.patch('appmail.jobs.JOB_EXECUTOR', 'appmail.jobs.synchronous_executor')
+class PerformanceTests(TestCase):
+
+    """Query count and timing tests for views, admin and create_message."""
+
+    def setUp(self):
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.force_login(self.user)
+
+    def create_templates(self, count, size):
+        body = make_body(size)
+        return [
+            EmailTemplate(
+                name='template_{}'.format(i),
+                subject='Hello {{ user.first_name }}',
+                body_text=body,
+                body_html='<p>{}</p>'.format(body),
+                test_context={'items': [1, 2], 'user': {'first_name': 'Fred'}}
+            ).save()
+            for i in range(count)
+        ]
+
+    def clear_caches(self):
+        # measure the worst case - nothing cached in process.
+        TemplateBlobQuerySet._cache.clear()
+        compile_template.cache_clear()
+
+    @contextlib.contextmanager
+    def assertBudget(self, num_queries, seconds=TIME_BUDGET, cold=True):
+        if cold:
+            self.clear_caches()
+        start = time.perf_counter()
+        with self.assertNumQueries(num_queries):
+            yield
+        elapsed = time.perf_counter() - start
+        self.assertLess(elapsed, seconds, "Took {:.3f}s".format(elapsed))
+
+    def run_scenarios(self, test):
+        """Call test(templates) for each of the SCENARIOS."""
+        for count, size in SCENARIOS:
+            with self.subTest(count=count, size=size):
+                try:
+                    test(self.create_templates(count, size))
+                finally:
+                    EmailTemplate.objects.all().delete()
+
+    def test_render_template_subject(self):
+        def test(templates):
+            url = reverse(
+                'appmail:render_template_subject',
+                kwargs={'template_id': templates[-1].id}
+            )
+            # template (the subject needs no bodies)
+            with self.assertBudget(AUTH_QUERIES + 1):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+        self.run_scenarios(test)
+
+    def test_render_template_body(self):
+        def test(templates):
+            for name in ('appmail:render_template_body_text', 'appmail:render_template_body_html'):
+                url = reverse(name, kwargs={'template_id': templates[-1].id})
+                # template, blobs
+                with self.assertBudget(AUTH_QUERIES + 2):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+        self.run_scenarios(test)
+
+    def test_send_test_email_get(self):
+        def test(templates):
+            url = '{}?templates={}'.format(
+                reverse('appmail:send_test_email'),
+                ','.join(str(t.id) for t in templates)
+            )
+            # templates, with their bodies
+            with self.assertBudget(AUTH_QUERIES + 1):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+        self.run_scenarios(test)
+
+    def test_send_test_email_post(self):
+        def test(templates):
+            ids = ','.join(str(t.id) for t in templates)
+            url = '{}?templates={}'.format(reverse('appmail:send_test_email'), ids)
+            data = {
+                'from_email': 'fred@example.com',
+                'reply_to': 'fred@example.com',
+                'to': 'ginger@example.com',
+                'context': '{"items": [1, 2]}',
+                'templates': ids,
+            }
+            mail.outbox = []
+            # templates with bodies (view and form)
+            with self.assertBudget(AUTH_QUERIES + 2):
+                response = self.client.post(url, data)
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(len(mail.outbox), len(templates))
+        self.run_scenarios(test)
+
+    def test_admin_changelist(self):
+        url = reverse('admin:appmail_emailtemplate_changelist')
+
+        def test(templates):
+            # count, total count, templates with bodies, language / version filters
+            with self.assertBudget(AUTH_QUERIES + 5):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+        self.run_scenarios(test)
+
+    def test_admin_changelist_valid_filter(self):
+        url = '{}?valid=1'.format(reverse('admin:appmail_emailtemplate_changelist'))
+
+        def test(templates):
+            # as above, plus all templates (with bodies) for the filter
+            with self.assertBudget(AUTH_QUERIES + 6):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.context['cl'].result_count, len(templates))
+        self.run_scenarios(test)
+
+    def test_create_message(self):
+        context = {'items': [1, 2], 'user': {'first_name': 'Fred'}}
+
+        def test(templates):
+            self.clear_caches()
+            # bodies are fetched with the templates...
+            templates = list(EmailTemplate.objects.with_bodies())
+            # ...so rendering (and compiling) must not touch the database.
+            with self.assertBudget(0, seconds=TIME_BUDGET / 10 * len(templates), cold=False):
+                for template in templates:
+                    template.create_message(context, to=['fred@example.com']).message()
+        self.run_scenarios(test)
@@ -0,0 +1,110 @@
+from django.test import TestCase
+from django.utils import timezone
+
+from .. import analysis, prefetch
+from ..engines import get_engine
+from ..models import EmailTemplate, LiveTemplate, RenderStats, SentMessage, compile_template
+
+
+def django_paths(source):
+    return analysis.variable_paths_django(compile_template(source))
+
+
+def jinja2_paths(source):
+    return analysis.variable_paths_jinja2(get_engine('jinja2').environment, source)
+
+
+class VariablePathTests(TestCase):
+
+    """appmail.analysis variable path tests."""
+
+    def test_django(self):
+        paths = django_paths(
+            "{{ order.customer.name|default:order.fallback }}"
+            "{% for line in order.lines.all %}{{ line.product.name }}{% endfor %}"
+            "{% for k, v in order.data.items %}{{ v.x }}{% endfor %}"
+            "{% with c=order.customer %}{{ c.address.city }}{% endwith %}"
+            "{% if order.paid and user.is_staff %}{{ forloop }}{% endif %}"
+        )
+        self.assertEqual(paths, {
+            ('order', 'customer', 'name'),
+            ('order', 'fallback'),
+            ('order', 'lines', 'all'),
+            ('order', 'lines', 'all', 'product', 'name'),
+            ('order', 'data', 'items'),
+            ('order', 'customer'),
+            ('order', 'customer', 'address', 'city'),
+            ('order', 'paid'),
+            ('user', 'is_staff'),
+            ('forloop',),
+        })
+
+    def test_jinja2(self):
+        paths = jinja2_paths(
+            "{{ order.customer.name }}"
+            "{% for line in order.lines.all() %}{{ line.product['name'] }}{% endfor %}"
+            "{% for k, v in order.data.items() %}{{ v.x }}{% endfor %}"
+            "{% set c = order.customer %}{{ c.address.city }}"
+        )
+        self.assertIn(('order', 'customer', 'name'), paths)
+        self.assertIn(('order', 'lines', 'all', 'product', 'name'), paths)
+        self.assertIn(('order', 'customer', 'address', 'city'), paths)
+        self.assertNotIn(('v', 'x'), paths)
+
+    def test_template(self):
+        template = EmailTemplate(
+            subject='{{ a.b }}', body_text='{{ c }}', body_html='{{ a.d }}'
+        )
+        self.assertEqual(template.variable_paths(), {('a', 'b'), ('c',), ('a', 'd')})
+
+
+class PrefetchTests(TestCase):
+
+    """appmail.prefetch tests."""
+
+    def test_plan(self):
+        select, prefetch_ = prefetch.plan(SentMessage, [
+            ('template', 'name'),
+            ('template', 'live', 'name'),
+            ('template', 'render_stats', 'all', 'template', 'live'),
+            ('template', 'render_stats', 'count'),
+            ('template', 'sent_messages', 'all'),
+            ('template', 'body_text'),
+            ('recipient', 'upper'),
+        ])
+        self.assertEqual(select, ['template__live'])
+        self.assertEqual(prefetch_, [
+            'template__render_stats__template__live',
+            'template__sent_messages',
+        ])
+
+    def test_plan_unknown(self):
+        self.assertEqual(prefetch.plan(SentMessage, [('missing', 'x'), ('sentmessage',)]), ([], []))
+
+    def test_paths_for(self):
+        paths = {('message', 'template', 'name'), ('message',), ('other', 'x')}
+        self.assertEqual(prefetch.paths_for(paths, 'message'), {('template', 'name')})
+
+    def test_bulk_render(self):
+        template = EmailTemplate(
+            name='summary',
+            subject='{{ message.template.name }}',
+            body_text=(
+                '{% for stats in message.template.render_stats.all %}'
+                '{{ stats.part }} {% endfor %}{{ message.template.live.id }}'
+            ),
+        ).save()
+        for i in range(3):
+            t = EmailTemplate(name='t{}'.format(i)).save()
+            RenderStats.objects.create(template=t, part='subject', digest='x')
+            SentMessage.objects.create(template=t, recipient='fred@example.com', message_id=str(i), sent_at=timezone.now())
+        queryset = SentMessage.objects.order_by('id')
+
+        def render(messages):
+            return [template.render_body({'message': message}) for message in messages]
+
+        with self.assertNumQueries(1 + 3 * 3):
+            expected = render(queryset.all())
+        with self.assertNumQueries(2):
+            self.assertEqual(render(template.prefetch(queryset.all(), 'message')), expected)
+        self.assertEqual(expected[0], 'subject {}'.format(LiveTemplate.objects.get(name='t0').id))
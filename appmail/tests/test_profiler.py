@@ -0,0 +1,101 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+
+from .. import profiler
+from ..models import EmailTemplate, compile_template
+
+BODY = """Hello {{ name }},
+{% for item in items %}
+  {{ item.title|upper }}
+{% endfor %}
+{% if name == 'Bob' %}Hi Bob{% endif %}"""
+
+
+class Item(object):
+
+    def __init__(self, title):
+        self.title = title
+
+
+class ProfilerTests(TestCase):
+
+    """appmail.profiler tests."""
+
+    def setUp(self):
+        self.template = EmailTemplate(subject='Hi {{ name }}', body_text=BODY).save()
+        self.context = {'name': 'Bob', 'items': [Item('a'), Item('b'), Item('c')]}
+
+    def profile(self):
+        with profiler.profiling() as profiles:
+            output = self.template.render_body(self.context)
+        self.assertEqual(len(profiles), 1)
+        return output, profiles[0]
+
+    def test_output(self):
+        output, profile = self.profile()
+        self.assertEqual(output, self.template.render_body(self.context))
+        self.assertEqual(profile.part, 'body_text')
+        self.assertTrue(profile.supported)
+
+    def test_rows(self):
+        _output, profile = self.profile()
+        rows = {row.lineno: row for row in profile.rows()}
+        self.assertEqual(sorted(rows), [1, 2, 3, 4, 5])
+        # the text and variable nodes on the first line
+        self.assertEqual(rows[1].calls, 3)
+        self.assertEqual(rows[1].resolves, 1)
+        self.assertEqual(rows[1].source, 'Hello {{ name }},')
+        # the loop body (a variable and a text node) is rendered once per item
+        self.assertEqual(rows[3].calls, 6)
+        self.assertEqual(rows[3].resolves, 3)
+        self.assertEqual(rows[3].depth, 1)
+        self.assertEqual(rows[2].depth, 0)
+        # the {% if %} condition, and the text node within it
+        self.assertEqual(rows[5].calls, 2)
+        self.assertEqual(rows[5].resolves, 2)
+        # the loop includes its body, but its self time does not
+        self.assertGreaterEqual(rows[2].total_time, rows[3].total_time)
+        self.assertLess(rows[2].self_time, rows[2].total_time)
+        self.assertLessEqual(sum(row.self_time for row in rows.values()), profile.total_time)
+        self.assertEqual(rows[2].percent, 100 * rows[2].total_time / profile.total_time)
+        self.assertIn('{% for item in items %}', str(profile))
+
+    def test_cached_template_untouched(self):
+        self.profile()
+        compiled = compile_template(BODY)
+        self.assertNotIn('render_annotated', vars(compiled.nodelist[0]))
+
+    def test_not_profiling(self):
+        with mock.patch('appmail.profiler.render') as render:
+            self.template.render_subject(self.context)
+        render.assert_not_called()
+
+    def test_engine_not_supported(self):
+        template = EmailTemplate(name='jinja2', subject='Hi {{ name }}', engine='jinja2').save()
+        with profiler.profiling() as profiles:
+            self.assertEqual(template.render_subject(self.context), 'Hi Bob')
+        self.assertFalse(profiles[0].supported)
+        self.assertGreater(profiles[0].total_time, 0)
+        self.assertEqual(profiles[0].rows(), [])
+
+    @mock.patch('appmail.profiler.PROFILE_SAMPLE_RATE', 1.0)
+    def test_sampled(self):
+        with self.assertLogs('appmail.profiler', 'INFO') as logs:
+            self.template.create_message(self.context, to=['fred@example.com'])
+        self.assertEqual(len(logs.records), 3)
+        self.assertEqual(logs.records[1].profile.part, 'body_text')
+
+    def test_profile_view(self):
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.force_login(user)
+        url = reverse('appmail:profile_template', kwargs={'template_id': self.template.id})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [profile.part for profile in response.context['profiles']],
+            ['subject', 'body_text', 'body_html']
+        )
+        self.assertContains(response, '{% for item in items %}')
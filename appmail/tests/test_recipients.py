@@ -0,0 +1,98 @@
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.test import TestCase
+
+from .. import recipients
+
+
+class NormalizeTests(TestCase):
+
+    """appmail.recipients.normalize tests."""
+
+    def test_normalize(self):
+        self.assertEqual(recipients.normalize(' Fred@Example.COM '), 'Fred@example.com')
+        self.assertEqual(recipients.normalize('fred@bücher.example'), 'fred@xn--bcher-kva.example')
+        self.assertEqual(recipients.normalize('"fred@smith"@example.com'), '"fred@smith"@example.com')
+        self.assertEqual(recipients.normalize('fred@localhost'), 'fred@localhost')
+        self.assertEqual(recipients.normalize('fred@[127.0.0.1]'), 'fred@[127.0.0.1]')
+
+    def test_invalid(self):
+        for address in (
+            '',
+            'fred',
+            'fred@',
+            '@example.com',
+            'fred..smith@example.com',
+            'fred@example',
+            'fred@-example.com',
+            'Fred <fred@example.com>',
+            'fred@{}.com'.format('x' * 320),
+        ):
+            self.assertIsNone(recipients.normalize(address), address)
+
+    def test_matches_validate_email(self):
+        for address in (
+            'fred@example.com',
+            'fred+tag@sub.example.co.uk',
+            'fred@example',
+            'fred.@example.com',
+            'fred@exam_ple.com',
+            'fred@bücher.example',
+            '"fred@smith"@example.com',
+            '"fred smith"@example.com',
+        ):
+            try:
+                validate_email(address)
+                valid = True
+            except ValidationError:
+                valid = False
+            self.assertEqual(recipients.normalize(address) is not None, valid, address)
+
+    def test_domain_cache(self):
+        recipients.normalize_domain.cache_clear()
+        for i in range(5):
+            recipients.normalize('user{}@example.com'.format(i))
+        info = recipients.normalize_domain.cache_info()
+        self.assertEqual((info.hits, info.misses), (4, 1))
+
+
+class RecipientProcessorTests(TestCase):
+
+    """appmail.recipients.RecipientProcessor tests."""
+
+    def test_process(self):
+        processor = recipients.RecipientProcessor()
+        self.assertEqual(
+            processor.process(
+                to=['fred@example.com', 'FRED@example.com', 'bad'],
+                cc=['ginger@example.com', 'fred@example.com'],
+                bcc=None
+            ),
+            {'to': ['fred@example.com'], 'cc': ['ginger@example.com'], 'bcc': []}
+        )
+        # the case of the first address seen is kept
+        self.assertEqual(
+            recipients.clean(['Fred@Example.com', 'fred@example.COM'])[0],
+            ['Fred@example.com']
+        )
+        # across the batch
+        self.assertEqual(
+            processor.process(to=['Ginger@example.com', 'bob@example.com']),
+            {'to': ['bob@example.com'], 'cc': [], 'bcc': []}
+        )
+        self.assertEqual(processor.rejections.counts, {'duplicate': 3, 'invalid': 1})
+        self.assertEqual(
+            str(processor.rejections),
+            "3 duplicate (FRED@example.com, fred@example.com, Ginger@example.com), 1 invalid (bad)"
+        )
+
+    def test_rejections(self):
+        rejections = recipients.Rejections()
+        other = recipients.Rejections()
+        for i in range(12):
+            other.add(recipients.INVALID, str(i))
+        rejections.add(recipients.INVALID, 'x')
+        rejections.update(other)
+        self.assertEqual(len(rejections), 13)
+        self.assertEqual(len(rejections.samples[recipients.INVALID]), 10)
+        self.assertTrue(str(rejections).endswith(', ...)'))
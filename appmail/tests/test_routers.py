@@ -0,0 +1,232 @@
+from unittest import mock
+
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.db import connections
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+
+from .. import routers
+from ..admin import EmailTemplateAdmin
+from ..middleware import ReplicaPinningMiddleware
+from ..models import (
+    EmailTemplate,
+    LiveTemplate,
+    LiveTemplateQuerySet,
+    SentMessage,
+    SuppressedAddress,
+    SuppressedAddressQuerySet,
+    TemplateChange,
+)
+
+ROUTERS = ['appmail.routers.AppmailReplicaRouter']
+
+
+@override_settings(DATABASE_ROUTERS=ROUTERS)
+@mock.patch('appmail.routers.READ_REPLICA', 'replica')
+class AppmailReplicaRouterTests(TestCase):
+
+    """
+    appmail.routers.AppmailReplicaRouter tests.
+
+    The 'replica' test database is separate from 'default', and nothing is
+    replicated to it - i.e. it lags forever.
+
+    """
+
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        routers.unpin()
+        self.addCleanup(routers.unpin)
+
+    def test_reads_use_replica(self):
+        self.assertEqual(EmailTemplate.objects.all().db, 'replica')
+        self.assertEqual(SentMessage.objects.all().db, 'replica')
+        # other apps are not routed
+        self.assertEqual(User.objects.all().db, 'default')
+        with self.assertNumQueries(1, using='replica'):
+            EmailTemplate.objects.current('missing')
+
+    def test_writes_pin_to_primary(self):
+        self.assertFalse(routers.is_pinned())
+        template = EmailTemplate(name='test', subject='Hello').save()
+        self.assertTrue(routers.is_pinned())
+        self.assertTrue(routers.has_written())
+        self.assertEqual(EmailTemplate.objects.all().db, 'default')
+        self.assertEqual(EmailTemplate.objects.current('test'), template)
+        # the replica hasn't caught up
+        routers.unpin()
+        self.assertIsNone(EmailTemplate.objects.current('test'))
+
+    def test_db_for_write_does_not_pin(self):
+        # Django asks for the write alias without writing, e.g. for the
+        # transaction around the admin change page
+        router = routers.AppmailReplicaRouter()
+        self.assertEqual(router.db_for_write(EmailTemplate), 'default')
+        self.assertFalse(routers.is_pinned())
+        self.assertFalse(routers.has_written())
+
+    def test_bulk_writes_pin_to_primary(self):
+        EmailTemplate.objects.filter(name='missing').update(subject='Hi')
+        self.assertTrue(routers.has_written())
+        routers.unpin()
+        EmailTemplate.objects.filter(name='missing').delete()
+        self.assertTrue(routers.has_written())
+
+    def test_bulk_update_reads_primary(self):
+        template = EmailTemplate(name='test', subject='Hello').save()
+        routers.unpin()
+        changes = TemplateChange.objects.using('default').count()
+        # the replica has none of the templates
+        EmailTemplate.objects.filter(name='test').update(is_active=False)
+        self.assertEqual(TemplateChange.objects.using('default').count(), changes + 1)
+        self.assertFalse(LiveTemplate.objects.using('default').exists())
+        self.assertIsNone(EmailTemplate.objects.current('test'))
+        routers.unpin()
+        EmailTemplate.objects.filter(pk=template.pk).delete()
+        self.assertEqual(TemplateChange.objects.using('default').count(), changes + 2)
+        self.assertFalse(EmailTemplate.objects.using('default').exists())
+
+    def test_bulk_writes_use_primary_transaction(self):
+        EmailTemplate(name='test', subject='Hello').save()
+        routers.unpin()
+        savepoints = len(connections['default'].savepoint_ids)
+        depths = []
+
+        def record_depth(*args, **kwargs):
+            depths.append(len(connections['default'].savepoint_ids) - savepoints)
+            return mock.DEFAULT
+
+        with mock.patch.object(LiveTemplateQuerySet, '_set', side_effect=record_depth):
+            LiveTemplate.objects.promote('test', 0)
+        with mock.patch.object(
+            LiveTemplateQuerySet, 'bulk_create', autospec=True, side_effect=record_depth
+        ):
+            LiveTemplate.objects.rebuild()
+        with mock.patch.object(
+            SuppressedAddressQuerySet, 'bulk_create', autospec=True, side_effect=record_depth
+        ):
+            SuppressedAddress.objects.add(['fred@example.com'], 'manual')
+        # each write ran within a transaction (savepoint) on the primary
+        self.assertEqual(depths, [1, 1, 1])
+        self.assertTrue(routers.has_written())
+
+    def test_use_primary(self):
+        with routers.use_primary():
+            self.assertEqual(EmailTemplate.objects.all().db, 'default')
+        self.assertEqual(EmailTemplate.objects.all().db, 'replica')
+
+    def test_no_replica(self):
+        with mock.patch('appmail.routers.READ_REPLICA', None):
+            self.assertEqual(EmailTemplate.objects.all().db, 'default')
+            EmailTemplate(name='test', subject='Hello').save()
+        self.assertFalse(routers.is_pinned())
+
+    def test_allow_migrate(self):
+        router = routers.AppmailReplicaRouter()
+        self.assertFalse(router.allow_migrate('replica', 'appmail'))
+        self.assertIsNone(router.allow_migrate('default', 'appmail'))
+        self.assertIsNone(router.allow_migrate('replica', 'auth'))
+
+
+@override_settings(DATABASE_ROUTERS=ROUTERS)
+@mock.patch('appmail.routers.READ_REPLICA', 'replica')
+class ReplicaPinningMiddlewareTests(TestCase):
+
+    """appmail.middleware.ReplicaPinningMiddleware tests."""
+
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.addCleanup(routers.unpin)
+
+    def middleware(self, view):
+        def get_response(request):
+            view(request)
+            return HttpResponse()
+        return ReplicaPinningMiddleware(get_response)
+
+    def test_write_sets_cookie(self):
+        pinned = []
+
+        def view(request):
+            EmailTemplate(name='test', subject='Hello').save()
+            pinned.append(routers.is_pinned())
+
+        response = self.middleware(view)(self.factory.post('/'))
+        self.assertEqual(pinned, [True])
+        self.assertIn('appmail_pin', response.cookies)
+        # cleared at the end of the request
+        self.assertFalse(routers.is_pinned())
+
+    def test_read_does_not_set_cookie(self):
+        response = self.middleware(lambda request: EmailTemplate.objects.count())(
+            self.factory.get('/')
+        )
+        self.assertNotIn('appmail_pin', response.cookies)
+
+    def test_cookie_pins_request(self):
+        pinned = []
+        request = self.factory.get('/')
+        request.COOKIES['appmail_pin'] = '1'
+        response = self.middleware(lambda request: pinned.append(routers.is_pinned()))(request)
+        self.assertEqual(pinned, [True])
+        # the pin is not extended by reads
+        self.assertNotIn('appmail_pin', response.cookies)
+
+
+@override_settings(
+    DATABASE_ROUTERS=ROUTERS,
+    MIDDLEWARE=['appmail.middleware.ReplicaPinningMiddleware'] + [
+        'django.contrib.sessions.middleware.SessionMiddleware',
+        'django.middleware.common.CommonMiddleware',
+        'django.middleware.csrf.CsrfViewMiddleware',
+        'django.contrib.auth.middleware.AuthenticationMiddleware',
+        'django.contrib.messages.middleware.MessageMiddleware',
+    ]
+)
+@mock.patch('appmail.routers.READ_REPLICA', 'replica')
+class ReplicaPreviewTests(TestCase):
+
+    """Admin previews read from the replica, unless pinned by a write."""
+
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.force_login(self.user)
+        self.template = EmailTemplate(name='test', subject='Hello {{ name }}').save()
+        routers.unpin()
+        self.addCleanup(routers.unpin)
+        self.url = reverse(
+            'appmail:render_template_subject',
+            kwargs={'template_id': self.template.id}
+        )
+
+    def test_preview_uses_replica(self):
+        # the template has not been replicated yet
+        with self.assertNumQueries(1, using='replica'):
+            self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_admin_change_page_does_not_pin(self):
+        # the change view runs in a transaction on the write database
+        model_admin = EmailTemplateAdmin(EmailTemplate, admin.site)
+        request = RequestFactory().get('/')
+        request.user = self.user
+        # (pinned, as the template has not been replicated)
+        request.COOKIES['appmail_pin'] = '1'
+        middleware = ReplicaPinningMiddleware(
+            lambda request: model_admin.changeform_view(request, str(self.template.id))
+        )
+        response = middleware(request)
+        self.assertEqual(response.status_code, 200)
+        # the pin is not extended, as nothing was written
+        self.assertNotIn('appmail_pin', response.cookies)
+
+    def test_preview_after_write_uses_primary(self):
+        self.client.cookies['appmail_pin'] = '1'
+        with self.assertNumQueries(0, using='replica'):
+            self.assertEqual(self.client.get(self.url).status_code, 200)
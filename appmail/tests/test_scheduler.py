@@ -0,0 +1,139 @@
+from unittest import mock
+
+from django.core import mail
+from django.core.mail import EmailMessage
+from django.test import TestCase
+
+from ..scheduler import DomainScheduler, TokenBucket, get_domain, parse_rate
+
+
+class FakeClock(object):
+
+    """Deterministic clock whose sleep() advances time."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def message(*to):
+    return EmailMessage('subject', 'body', 'from@example.com', list(to))
+
+
+class TokenBucketTests(TestCase):
+
+    """appmail.scheduler.TokenBucket tests."""
+
+    def test_consume(self):
+        clock = FakeClock()
+        bucket = TokenBucket(2, clock=clock)
+        self.assertTrue(bucket.consume())
+        self.assertTrue(bucket.consume())
+        self.assertFalse(bucket.consume())
+        self.assertEqual(bucket.delay(), 0.5)
+        clock.sleep(0.5)
+        self.assertTrue(bucket.consume())
+
+    def test_capacity(self):
+        clock = FakeClock()
+        bucket = TokenBucket(1, capacity=3, clock=clock)
+        clock.sleep(100)
+        for _ in range(3):
+            self.assertTrue(bucket.consume())
+        self.assertFalse(bucket.consume())
+
+    def test_invalid_capacity(self):
+        # a bucket that can never hold a token would block forever
+        self.assertRaises(ValueError, TokenBucket, 1, capacity=0)
+        self.assertRaises(ValueError, TokenBucket, 1, capacity=0.5)
+        self.assertRaises(ValueError, parse_rate, (5, 0))
+        self.assertEqual(TokenBucket(0.5).capacity, 1)
+
+    def test_parse_rate(self):
+        self.assertIsNone(parse_rate(None))
+        self.assertEqual(parse_rate(5).rate, 5)
+        bucket = parse_rate((5, 10))
+        self.assertEqual((bucket.rate, bucket.capacity), (5, 10))
+
+
+class DomainSchedulerTests(TestCase):
+
+    """appmail.scheduler.DomainScheduler tests."""
+
+    def scheduler(self, **kwargs):
+        self.clock = FakeClock()
+        kwargs.setdefault('domain_rates', {})
+        kwargs.setdefault('default_rate', None)
+        kwargs.setdefault('global_rate', None)
+        return DomainScheduler(clock=self.clock, sleep=self.clock.sleep, **kwargs)
+
+    def test_get_domain(self):
+        self.assertEqual(get_domain('fred@Example.COM'), 'example.com')
+        self.assertEqual(get_domain('Fred <fred@example.com>'), 'example.com')
+
+    def test_interleaves_domains(self):
+        scheduler = self.scheduler()
+        for _ in range(3):
+            scheduler.add(message('a@gmail.com'))
+        for _ in range(2):
+            scheduler.add(message('b@yahoo.com'))
+        self.assertEqual(len(scheduler), 5)
+        order = [get_domain(m.to[0]) for m in scheduler]
+        self.assertEqual(
+            order,
+            ['gmail.com', 'yahoo.com', 'gmail.com', 'yahoo.com', 'gmail.com']
+        )
+        self.assertEqual(len(scheduler), 0)
+        self.assertEqual(self.clock.now, 0)
+
+    def test_throttled_domain_does_not_block_others(self):
+        scheduler = self.scheduler(domain_rates={'gmail.com': 1})
+        for _ in range(3):
+            scheduler.add(message('a@gmail.com'))
+        for _ in range(3):
+            scheduler.add(message('b@yahoo.com'))
+        order = [(get_domain(m.to[0]), self.clock.now) for m in scheduler]
+        # yahoo is unthrottled, so is sent while gmail waits for tokens
+        self.assertEqual(
+            order,
+            [
+                ('gmail.com', 0), ('yahoo.com', 0), ('yahoo.com', 0),
+                ('yahoo.com', 0), ('gmail.com', 1), ('gmail.com', 2)
+            ]
+        )
+
+    def test_global_rate(self):
+        scheduler = self.scheduler(global_rate=2)
+        for i in range(4):
+            scheduler.add(message('user%i@example%i.com' % (i, i)))
+        times = [self.clock.now for _ in scheduler]
+        self.assertEqual(times, [0, 0, 0.5, 1.0])
+
+    def test_multiple_domains_per_message(self):
+        scheduler = self.scheduler(domain_rates={'yahoo.com': 1})
+        scheduler.add(message('a@gmail.com', 'b@yahoo.com'))
+        scheduler.add(message('c@yahoo.com'))
+        times = [self.clock.now for _ in scheduler]
+        self.assertEqual(times, [0, 1])
+
+    def test_send(self):
+        scheduler = self.scheduler()
+        scheduler.add(message('a@gmail.com'))
+        scheduler.add(message('b@yahoo.com'))
+        self.assertEqual(scheduler.send(), 2)
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_send_connection(self):
+        scheduler = self.scheduler()
+        scheduler.add(message('a@gmail.com'))
+        scheduler.add(message('b@yahoo.com'))
+        connection = mock.MagicMock()
+        connection.send_messages.return_value = 1
+        self.assertEqual(scheduler.send(connection=connection), 2)
+        self.assertEqual(connection.send_messages.call_count, 2)
+        connection.__enter__.assert_called_once()
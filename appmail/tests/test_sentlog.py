@@ -0,0 +1,140 @@
+import datetime
+from unittest import mock
+
+from django.core import mail
+from django.test import TestCase
+from django.utils import timezone
+
+from .. import sentlog
+from ..models import AppmailMessage, EmailTemplate, SentMessage
+
+
+class WriteBehindBufferTests(TestCase):
+
+    """appmail.sentlog.WriteBehindBuffer tests."""
+
+    def setUp(self):
+        self.template = EmailTemplate(name='test', subject='Hello').save()
+        self.buffer = sentlog.WriteBehindBuffer(batch_size=3, flush_interval=None)
+
+    def row(self, recipient='fred@example.com'):
+        return SentMessage(
+            template=self.template,
+            recipient=recipient,
+            sent_at=timezone.now()
+        )
+
+    def test_add_buffers_rows(self):
+        with self.assertNumQueries(0):
+            self.buffer.add([self.row(), self.row()])
+        self.assertEqual(len(self.buffer), 2)
+        self.assertEqual(SentMessage.objects.count(), 0)
+
+    def test_add_flushes_on_batch_size(self):
+        with self.assertNumQueries(1):
+            self.buffer.add([self.row(), self.row(), self.row()])
+        self.assertEqual(len(self.buffer), 0)
+        self.assertEqual(SentMessage.objects.count(), 3)
+
+    def test_flush(self):
+        self.assertEqual(self.buffer.flush(), 0)
+        self.buffer.add([self.row('a@example.com'), self.row('b@example.com')])
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(
+            sorted(SentMessage.objects.values_list('recipient', flat=True)),
+            ['a@example.com', 'b@example.com']
+        )
+
+    def test_flush_error(self):
+        self.buffer.add([self.row()])
+        with mock.patch.object(SentMessage.objects, 'bulk_create', side_effect=Exception("boom")):
+            self.assertEqual(self.buffer.flush(), 0)
+        # rows are dropped rather than retried
+        self.assertEqual(len(self.buffer), 0)
+
+    def test_no_timer(self):
+        self.buffer.add([self.row()])
+        self.assertIsNone(self.buffer._timer)
+
+    def test_stop(self):
+        self.buffer.add([self.row()])
+        self.buffer.stop()
+        self.assertEqual(SentMessage.objects.count(), 1)
+
+
+class RecordTests(TestCase):
+
+    """appmail.sentlog.record tests."""
+
+    def setUp(self):
+        self.template = EmailTemplate(name='test', subject='Hello').save()
+        self.buffer = sentlog.WriteBehindBuffer(flush_interval=None)
+        patcher = mock.patch('appmail.sentlog.buffer', self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @mock.patch('appmail.sentlog.LOG_SENT_MESSAGES', False)
+    def test_disabled(self):
+        self.template.create_message({}, to=['fred@example.com']).send()
+        self.assertEqual(len(self.buffer), 0)
+
+    @mock.patch('appmail.sentlog.LOG_SENT_MESSAGES', True)
+    def test_send(self):
+        message = self.template.create_message(
+            {},
+            to=['fred@example.com'],
+            cc=['ginger@example.com']
+        )
+        self.assertIsInstance(message, AppmailMessage)
+        self.assertIs(message.template, self.template)
+        message.send()
+        self.assertEqual(self.buffer.flush(), 2)
+        rows = SentMessage.objects.order_by('recipient')
+        self.assertEqual(
+            [(r.template, r.recipient) for r in rows],
+            [(self.template, 'fred@example.com'), (self.template, 'ginger@example.com')]
+        )
+        # the logged Message-ID matches the one that was sent
+        self.assertEqual(rows[0].message_id, mail.outbox[0].message()['Message-ID'])
+
+    def test_message_id_not_shared(self):
+        # the Message-ID must not leak into a headers dict shared between messages
+        headers = {'X-Campaign': 'spring'}
+        message_ids = {
+            self.template.create_message({}, to=['fred@example.com'], headers=headers)
+            .message()['Message-ID']
+            for _ in range(3)
+        }
+        self.assertEqual(len(message_ids), 3)
+        self.assertEqual(headers, {'X-Campaign': 'spring'})
+
+    @mock.patch('appmail.sentlog.LOG_SENT_MESSAGES', True)
+    def test_send_failure(self):
+        message = self.template.create_message({}, to=['fred@example.com'])
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', return_value=0):
+            message.send()
+        self.assertEqual(len(self.buffer), 0)
+
+    @mock.patch('appmail.sentlog.LOG_SENT_MESSAGES', True)
+    def test_template_deleted(self):
+        self.template.create_message({}, to=['fred@example.com']).send()
+        self.buffer.flush()
+        self.template.delete()
+        self.assertIsNone(SentMessage.objects.get().template)
+
+
+class SentMessageQuerySetTests(TestCase):
+
+    """appmail.models.SentMessageQuerySet tests."""
+
+    def test_prune(self):
+        now = timezone.now()
+        SentMessage.objects.bulk_create([
+            SentMessage(recipient='old@example.com', sent_at=now - datetime.timedelta(days=31)),
+            SentMessage(recipient='new@example.com', sent_at=now - datetime.timedelta(days=1)),
+        ])
+        SentMessage.objects.prune(datetime.timedelta(days=30))
+        self.assertEqual(
+            list(SentMessage.objects.values_list('recipient', flat=True)),
+            ['new@example.com']
+        )
@@ -0,0 +1,150 @@
+from unittest import mock
+
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.test import TestCase
+from django.urls import reverse
+
+from .. import stats
+from ..admin import EmailTemplateAdmin
+from ..models import EmailTemplate, RenderStats
+
+
+class StatsCollectorTests(TestCase):
+
+    """appmail.stats.StatsCollector tests."""
+
+    def setUp(self):
+        self.template = EmailTemplate(name='test', subject='Hello', body_text='Hi').save()
+        self.collector = stats.StatsCollector(flush_interval=None, max_samples=100)
+
+    def test_percentile(self):
+        self.assertIsNone(stats.percentile([], 95))
+        self.assertEqual(stats.percentile(list(range(1, 101)), 95), 95)
+        self.assertEqual(stats.percentile([3, 1, 2], 50), 2)
+
+    def test_record_is_in_memory(self):
+        with self.assertNumQueries(0):
+            self.collector.record(self.template.pk, 'subject', 'abc', 0.1, 10)
+            self.collector.record(self.template.pk, 'subject', 'abc', 0.3, 20)
+        self.assertEqual(len(self.collector), 1)
+        self.assertIsNone(self.collector._timer)
+
+    def test_flush(self):
+        self.collector.record(self.template.pk, 'subject', 'abc', 0.1, 10)
+        self.collector.record(self.template.pk, 'subject', 'abc', 0.3, 20)
+        self.assertEqual(self.collector.flush(), 1)
+        self.assertEqual(len(self.collector), 0)
+        row = RenderStats.objects.get()
+        self.assertEqual((row.part, row.digest, row.count, row.total_size), ('subject', 'abc', 2, 30))
+        self.assertAlmostEqual(row.mean_time, 0.2)
+        self.assertEqual(row.p95_time, 0.3)
+        self.assertEqual(row.mean_size, 15)
+
+    def test_flush_is_additive(self):
+        self.collector.record(self.template.pk, 'subject', 'abc', 0.1, 10)
+        self.collector.flush()
+        self.collector.record(self.template.pk, 'subject', 'abc', 0.2, 30)
+        with self.assertNumQueries(1):
+            self.collector.flush()
+        row = RenderStats.objects.get()
+        self.assertEqual((row.count, row.total_size), (2, 40))
+        self.assertAlmostEqual(row.total_time, 0.3)
+
+    def test_flush_resets_on_content_change(self):
+        self.collector.record(self.template.pk, 'subject', 'abc', 0.1, 10)
+        self.collector.flush()
+        self.collector.record(self.template.pk, 'subject', 'def', 1.0, 100)
+        self.collector.flush()
+        row = RenderStats.objects.get()
+        self.assertEqual((row.digest, row.count, row.total_size), ('def', 1, 100))
+
+    def test_flush_deleted_template(self):
+        self.collector.record(self.template.pk + 1, 'subject', 'abc', 0.1, 10)
+        self.assertEqual(self.collector.flush(), 1)
+        self.assertFalse(RenderStats.objects.exists())
+
+
+class RecordTests(TestCase):
+
+    """appmail.stats.record and create_message tests."""
+
+    def setUp(self):
+        self.template = EmailTemplate(
+            name='test',
+            subject='Hello {{ name }}',
+            body_text='Hi {{ name }}',
+            body_html='<p>Hi {{ name }}</p>'
+        ).save()
+        self.collector = stats.StatsCollector(flush_interval=None)
+        patcher = mock.patch('appmail.stats.collector', self.collector)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_disabled(self):
+        with mock.patch('appmail.stats.RENDER_STATS', False):
+            self.template.create_message({'name': 'Fred'})
+        self.assertEqual(len(self.collector), 0)
+
+    @mock.patch('appmail.stats.RENDER_STATS', True)
+    def test_create_message(self):
+        self.template.create_message({'name': 'Fred'})
+        self.template.create_message({'name': 'Ginger'})
+        self.collector.flush()
+        rows = {r.part: r for r in self.template.render_stats.all()}
+        self.assertEqual(set(rows), set(stats.PARTS))
+        self.assertEqual(rows['subject'].count, 2)
+        self.assertEqual(rows['subject'].total_size, len('Hello Fred') + len('Hello Ginger'))
+        self.assertEqual(rows['body_html'].digest, self.template.body_html_blob_id)
+        self.assertEqual(rows['subject'].digest, stats.digest(self.template, 'subject'))
+
+    @mock.patch('appmail.stats.RENDER_STATS', True)
+    def test_unsaved_template(self):
+        EmailTemplate(subject='Hello').create_message({})
+        self.assertEqual(len(self.collector), 0)
+
+
+class RenderStatsAdminTests(TestCase):
+
+    """EmailTemplateAdmin render stats columns."""
+
+    def setUp(self):
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(self.user)
+        self.fast = EmailTemplate(name='fast', subject='Fast').save()
+        self.slow = EmailTemplate(name='slow', subject='Slow').save()
+        self.new = EmailTemplate(name='new', subject='New').save()
+        for template, elapsed in ((self.fast, 0.001), (self.slow, 0.01)):
+            for part in stats.PARTS:
+                RenderStats.objects.create(
+                    template=template,
+                    part=part,
+                    digest='abc',
+                    count=10,
+                    total_time=elapsed * 10,
+                    total_size=1000,
+                    p95_time=elapsed * 2
+                )
+
+    def test_annotations(self):
+        model_admin = EmailTemplateAdmin(EmailTemplate, admin.site)
+        obj = model_admin.get_queryset(None).get(pk=self.slow.pk)
+        self.assertEqual(obj.stats_count, 10)
+        self.assertAlmostEqual(obj.stats_mean_time, 0.03)
+        self.assertAlmostEqual(obj.stats_p95_time, 0.02)
+        self.assertAlmostEqual(obj.stats_mean_size, 300)
+
+    def test_changelist_sort(self):
+        url = reverse('admin:appmail_emailtemplate_changelist')
+        # columns: 1 name, 2 subject, ... 10 mean render time
+        response = self.client.get(url, {'o': '-10'})
+        self.assertEqual(response.status_code, 200)
+        names = [t.name for t in response.context['cl'].result_list]
+        self.assertEqual(names[:2], ['slow', 'fast'])
+        self.assertContains(response, '30.00ms')
+
+    def test_render_statistics(self):
+        model_admin = EmailTemplateAdmin(EmailTemplate, admin.site)
+        html = model_admin.render_statistics(self.slow)
+        self.assertIn('<td>Plain text</td><td>10</td><td>10.00ms</td><td>20.00ms</td>', html)
+        self.assertIn('No render statistics recorded', model_admin.render_statistics(self.new))
@@ -0,0 +1,211 @@
+from unittest import mock
+
+from django.db import DatabaseError
+from django.test import TestCase
+
+from .. import campaign, suppression
+from ..models import EmailTemplate, SuppressedAddress, SuppressedAddressQuerySet
+
+
+class SuppressionListTests(TestCase):
+
+    """appmail.suppression tests."""
+
+    def setUp(self):
+        self.list = suppression.SuppressionList(check_interval=60, rebuild_interval=3600)
+        SuppressedAddress.objects.add(['Bounced@Example.com', 'gone@example.com'], SuppressedAddress.REASON_BOUNCE)
+
+    def test_normalize(self):
+        self.assertEqual(suppression.normalize('Fred <Fred@Example.COM> '), 'fred@example.com')
+        self.assertEqual(suppression.normalize(''), '')
+
+    def test_save_normalizes(self):
+        address = SuppressedAddress(address='Fred <FRED@example.com>').save()
+        self.assertEqual(address.address, 'fred@example.com')
+        self.assertEqual(address.address_hash, suppression.address_hash('fred@example.com'))
+
+    def test_add_ignores_duplicates(self):
+        created = SuppressedAddress.objects.add(['bounced@example.com', 'new@example.com'], 'manual')
+        self.assertEqual([row.address for row in created], ['new@example.com'])
+        self.assertEqual(SuppressedAddress.objects.count(), 3)
+
+    def test_add_concurrent_duplicate(self):
+        # added by another process between the check and the insert
+        real_values_list = SuppressedAddressQuerySet.values_list
+
+        def values_list(queryset, *args, **kwargs):
+            existing = list(real_values_list(queryset, *args, **kwargs))
+            SuppressedAddress.objects.bulk_create([
+                SuppressedAddress(address='new@example.com', address_hash=0)
+            ])
+            return existing
+
+        with mock.patch.object(SuppressedAddressQuerySet, 'values_list', values_list):
+            created = SuppressedAddress.objects.add(['new@example.com', 'other@example.com'], 'manual')
+        self.assertEqual([row.address for row in created], ['other@example.com'])
+        self.assertEqual(SuppressedAddress.objects.count(), 4)
+
+    def test_miss_needs_no_query(self):
+        self.list.refresh()
+        self.assertEqual(len(self.list), 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.list.suppressed(['fred@example.com', 'bob@example.com']), set())
+
+    def test_hit_is_confirmed(self):
+        self.list.refresh()
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                self.list.suppressed(['fred@example.com', 'BOUNCED@example.com', 'Gone <gone@example.com>']),
+                {'bounced@example.com', 'gone@example.com'}
+            )
+        # removed, but not yet rebuilt - a probable hit that isn't confirmed
+        SuppressedAddress.objects.filter(address='gone@example.com').delete()
+        self.assertTrue(self.list.might_contain('gone@example.com'))
+        self.assertEqual(self.list.suppressed(['gone@example.com']), set())
+
+    def test_incremental_refresh(self):
+        self.list.refresh()
+        SuppressedAddress.objects.add(['new@example.com', 'aaa@example.com'], 'manual')
+        self.assertFalse(self.list.might_contain('new@example.com'))
+        with self.assertNumQueries(1):
+            self.list.refresh(force=True)
+        self.assertTrue(self.list.might_contain('new@example.com'))
+        self.assertEqual(list(self.list._hashes), sorted(self.list._hashes))
+        self.assertEqual(len(self.list), 4)
+
+    def test_committed_out_of_order(self):
+        first = SuppressedAddress(address='first@example.com').save()
+        second = SuppressedAddress(address='second@example.com').save()
+        # first's transaction hadn't committed when the list was refreshed
+        with mock.patch.object(SuppressedAddress.objects, 'order_by', self.exclude(first)):
+            self.list.refresh(force=True)
+        self.assertTrue(self.list.might_contain('second@example.com'))
+        self.assertFalse(self.list.might_contain('first@example.com'))
+        self.assertIn(first.pk, self.list._gaps)
+        self.list.refresh(force=True)
+        self.assertTrue(self.list.might_contain('first@example.com'))
+        self.assertEqual(self.list._gaps, {})
+        self.assertEqual(len(self.list), 4)
+
+    def test_gaps_expire(self):
+        self.list.refresh()
+        pk = SuppressedAddress(address='rolled-back@example.com').save().pk
+        SuppressedAddress.objects.filter(pk=pk).delete()
+        SuppressedAddress(address='new@example.com').save()
+        self.list.refresh(force=True)
+        self.assertEqual(list(self.list._gaps), [pk])
+        self.list._gaps[pk] -= suppression.GAP_TIMEOUT + 1
+        self.list.refresh(force=True)
+        self.assertEqual(self.list._gaps, {})
+
+    def test_too_many_gaps(self):
+        self.list.refresh()
+        self.list.built -= 1
+        SuppressedAddress.objects.create(
+            id=self.list.last_id + suppression.MAX_GAPS + 10,
+            address='far@example.com',
+            address_hash=suppression.address_hash('far@example.com')
+        )
+        # gaps within the last MAX_GAPS ids only
+        self.list.refresh(force=True)
+        self.assertTrue(self.list.might_contain('far@example.com'))
+        self.assertEqual(len(self.list._gaps), suppression.MAX_GAPS)
+        self.assertNotEqual(self.list.built, self.list.checked)
+        # ...and more than that rebuilds the array
+        SuppressedAddress.objects.create(
+            id=self.list.last_id + 10,
+            address='farther@example.com',
+            address_hash=suppression.address_hash('farther@example.com')
+        )
+        self.list.refresh(force=True)
+        self.assertEqual(self.list.built, self.list.checked)
+        self.assertEqual(len(self.list), 4)
+
+    def test_rebuild_keeps_current_array(self):
+        self.list.refresh()
+        self.list.built -= 7200
+        seen = []
+        real_merge = self.list._merge
+
+        def merge(*args):
+            # e.g. a lookup in another thread, while the rows are loaded
+            seen.append(self.list.might_contain('bounced@example.com'))
+            return real_merge(*args)
+
+        with mock.patch.object(self.list, '_merge', merge):
+            self.list.refresh(force=True)
+        self.assertEqual(seen, [True])
+        self.assertTrue(self.list.might_contain('bounced@example.com'))
+
+    def test_failed_rebuild(self):
+        self.list.refresh()
+        checked = self.list.checked
+        self.list.built -= 7200
+        with mock.patch.object(SuppressedAddress.objects, 'order_by', side_effect=DatabaseError("gone")):
+            self.assertRaises(DatabaseError, self.list.refresh, force=True)
+        # the current array is kept, and the refresh is retried next time
+        self.assertTrue(self.list.might_contain('bounced@example.com'))
+        self.assertEqual(self.list.checked, checked)
+        self.list.checked -= 120
+        with self.assertNumQueries(1):
+            self.list.refresh()
+        self.assertEqual(len(self.list), 2)
+
+    def exclude(self, row):
+        real_order_by = SuppressedAddress.objects.order_by
+        return lambda *args: real_order_by(*args).exclude(pk=row.pk)
+
+    def test_rebuild(self):
+        self.list.refresh()
+        SuppressedAddress.objects.filter(address='gone@example.com').delete()
+        self.list.built -= 7200
+        self.list.refresh(force=True)
+        self.assertEqual(len(self.list), 1)
+        self.assertFalse(self.list.might_contain('gone@example.com'))
+
+    def test_strip(self):
+        email_kwargs = {
+            'to': ['fred@example.com', 'Bounced <bounced@example.com>'],
+            'cc': ['gone@example.com'],
+            'bcc': None,
+        }
+        removed = self.list.strip(email_kwargs)
+        self.assertEqual(removed, ['Bounced <bounced@example.com>', 'gone@example.com'])
+        self.assertEqual(email_kwargs, {'to': ['fred@example.com'], 'cc': [], 'bcc': None})
+
+
+@mock.patch('appmail.models.SUPPRESSION_LIST', True)
+class CreateMessageSuppressionTests(TestCase):
+
+    """EmailTemplate.create_message suppression."""
+
+    def setUp(self):
+        patcher = mock.patch('appmail.suppression.suppression_list', suppression.SuppressionList())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.template = EmailTemplate(subject='Hi', body_text='Hello').save()
+        SuppressedAddress.objects.add(['bounced@example.com'], SuppressedAddress.REASON_BOUNCE)
+
+    def test_create_message(self):
+        message = self.template.create_message(
+            {}, to=['fred@example.com', 'bounced@example.com'], bcc=['Bounced@example.com']
+        )
+        self.assertEqual(message.to, ['fred@example.com'])
+        self.assertEqual(message.bcc, [])
+        self.assertEqual(message.suppressed, ['bounced@example.com', 'Bounced@example.com'])
+
+    def test_disabled(self):
+        with mock.patch('appmail.models.SUPPRESSION_LIST', False):
+            message = self.template.create_message({}, to=['bounced@example.com'])
+        self.assertEqual(message.to, ['bounced@example.com'])
+        self.assertEqual(message.suppressed, [])
+
+    def test_campaign(self):
+        connection = mock.Mock()
+        connection.send_messages.return_value = 1
+        campaign._worker.update(template=self.template, email_kwargs={}, connection=connection, error=None)
+        self.addCleanup(campaign._worker.clear)
+        records = [{'email': 'fred@example.com'}, {'email': 'bounced@example.com'}]
+        offset, count, sent, failures, rejections = campaign.send_batch((0, records))
+        self.assertEqual((count, sent), (2, 1))
+        self.assertEqual(failures, [(records[1], "All recipients are suppressed.")])
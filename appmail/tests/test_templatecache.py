@@ -0,0 +1,192 @@
+import datetime
+from unittest import mock
+
+from django.db.models.query import QuerySet
+from django.test import TestCase
+from django.utils import timezone
+
+from .. import templatecache
+from ..models import EmailTemplate, TemplateChange
+
+
+def update_elsewhere(queryset, **kwargs):
+    """Simulate an update made by another process."""
+    pairs = set(queryset.values_list('name', 'language'))
+    QuerySet.update(queryset, **kwargs)
+    TemplateChange.objects.bulk_create([TemplateChange(name=name, language=language) for name, language in pairs])
+
+
+@mock.patch('appmail.models.TEMPLATE_CACHE', True)
+class TemplateCacheTests(TestCase):
+
+    """appmail.templatecache tests."""
+
+    def setUp(self):
+        self.cache = templatecache.TemplateCache(check_interval=60, max_idle=3600, max_size=10)
+        patcher = mock.patch('appmail.templatecache.cache', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.welcome = EmailTemplate(name='welcome', language='en', subject='Hello').save()
+        self.goodbye = EmailTemplate(name='goodbye', language='en', subject='Bye').save()
+
+    def current(self, name='welcome'):
+        return EmailTemplate.objects.current(name, language='en')
+
+    def test_current_is_cached(self):
+        with self.assertNumQueries(2):
+            # the generation, and the template (bodies are in the blob cache)
+            self.assertEqual(self.current(), self.welcome)
+        with self.assertNumQueries(0):
+            template = self.current()
+            self.assertEqual(template.body_text, '')
+
+    def test_cached_value_is_copied(self):
+        template = self.current()
+        template.subject = 'Changed'
+        self.assertEqual(self.current().subject, 'Hello')
+
+    def test_version(self):
+        self.assertEqual(EmailTemplate.objects.version('welcome', 0, language='en'), self.welcome)
+        with self.assertNumQueries(0):
+            EmailTemplate.objects.version('welcome', 0, language='en')
+        self.assertRaises(
+            EmailTemplate.DoesNotExist,
+            EmailTemplate.objects.version, 'welcome', 1, language='en'
+        )
+        with self.assertNumQueries(0):
+            self.assertRaises(
+                EmailTemplate.DoesNotExist,
+                EmailTemplate.objects.version, 'welcome', 1, language='en'
+            )
+
+    def test_current_many(self):
+        pairs = [('welcome', 'en'), ('missing', 'en')]
+        self.current('goodbye')
+        # a single query for the two uncached templates
+        with self.assertNumQueries(1):
+            templates = EmailTemplate.objects.current_many(pairs + [('goodbye', 'en')])
+        self.assertEqual(templates, {
+            ('welcome', 'en'): self.welcome,
+            ('missing', 'en'): None,
+            ('goodbye', 'en'): self.goodbye,
+        })
+        with self.assertNumQueries(0):
+            self.assertEqual(EmailTemplate.objects.current_many(pairs)[('welcome', 'en')], self.welcome)
+            self.assertEqual(self.current(), self.welcome)
+            self.assertIsNone(self.current('missing'))
+        # cached values are copied
+        templates[('welcome', 'en')].subject = 'Changed'
+        self.assertEqual(EmailTemplate.objects.current_many(pairs)[('welcome', 'en')].subject, 'Hello')
+
+    def test_filtered_queryset_not_cached(self):
+        self.current()
+        with self.assertNumQueries(1):
+            EmailTemplate.objects.filter(subject='Hello').current('welcome', language='en')
+
+    def test_disabled(self):
+        with mock.patch('appmail.models.TEMPLATE_CACHE', False):
+            self.current()
+        self.assertEqual(len(self.cache), 0)
+
+    def test_save_invalidates(self):
+        self.current()
+        self.welcome.clone()
+        self.assertEqual(self.current().version, 1)
+
+    def test_rename_invalidates_old_name(self):
+        template = self.current()
+        template.name = 'hello'
+        template.save()
+        self.assertIsNone(self.current())
+
+    def test_bulk_update_invalidates(self):
+        self.current()
+        EmailTemplate.objects.filter(name='welcome').update(is_active=False)
+        self.assertIsNone(self.current())
+        self.assertEqual(
+            list(TemplateChange.objects.values_list('name', 'language'))[-1],
+            ('welcome', 'en')
+        )
+
+    def test_bulk_rename_records_both(self):
+        last = TemplateChange.objects.last().pk
+        EmailTemplate.objects.filter(name='welcome').update(name='hello')
+        self.assertEqual(
+            set(TemplateChange.objects.filter(pk__gt=last).values_list('name', flat=True)),
+            {'welcome', 'hello'}
+        )
+
+    def test_delete_invalidates(self):
+        self.current()
+        self.current('goodbye')
+        self.welcome.delete()
+        self.assertIsNone(self.current())
+        EmailTemplate.objects.filter(name='goodbye').delete()
+        self.assertIsNone(self.current('goodbye'))
+
+    def test_change_in_other_process(self):
+        self.current()
+        self.current('goodbye')
+        update_elsewhere(EmailTemplate.objects.filter(name='welcome'), subject='Hi')
+        # not checked until the interval has passed
+        self.assertEqual(self.current().subject, 'Hello')
+        with self.assertNumQueries(1):
+            self.cache.check(force=True)
+        # only the changed template is dropped
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.current().subject, 'Hi')
+
+    def test_change_committed_out_of_order(self):
+        # a change with a lower id, committed after a later change was seen
+        self.current()
+        self.current('goodbye')
+        generation = TemplateChange.objects.generation()
+        TemplateChange.objects.create(id=generation + 2, name='other', language='en')
+        self.cache.check(force=True)
+        self.assertEqual(self.cache.generation, generation + 2)
+        self.assertEqual(len(self.cache), 2)
+        QuerySet.update(EmailTemplate.objects.filter(name='welcome'), subject='Hi')
+        TemplateChange.objects.create(id=generation + 1, name='welcome', language='en')
+        with self.assertNumQueries(1):
+            self.cache.check(force=True)
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.current().subject, 'Hi')
+        # the gap is filled, and no longer fetched
+        self.assertEqual(self.cache._gaps, {})
+
+    def test_gaps_expire(self):
+        generation = TemplateChange.objects.generation()
+        self.cache.check(force=True)
+        # e.g. the id of a rolled back transaction
+        TemplateChange.objects.create(id=generation + 2, name='other', language='en')
+        self.cache.check(force=True)
+        self.assertEqual(list(self.cache._gaps), [generation + 1])
+        self.cache._gaps[generation + 1] -= 7200
+        self.cache.check(force=True)
+        self.assertEqual(self.cache._gaps, {})
+
+    def test_gaps_after_reset(self):
+        generation = TemplateChange.objects.generation()
+        TemplateChange.objects.create(id=generation + 2, name='other', language='en')
+        self.cache.check(force=True)
+        self.assertEqual(self.cache.generation, generation + 2)
+        self.assertEqual(list(self.cache._gaps), [generation + 1])
+
+    def test_max_idle(self):
+        self.current()
+        self.cache.checked -= 7200
+        update_elsewhere(EmailTemplate.objects.filter(name='goodbye'), subject='Ciao')
+        self.cache.check()
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.generation, TemplateChange.objects.generation())
+
+    def test_max_size(self):
+        for i in range(15):
+            EmailTemplate.objects.current('missing-{}'.format(i), language='en')
+        self.assertEqual(len(self.cache), 10)
+
+    def test_prune(self):
+        TemplateChange.objects.update(changed_at=timezone.now() - datetime.timedelta(days=2))
+        TemplateChange.objects.prune(datetime.timedelta(days=1))
+        # the latest change is kept, so that the generation never goes backwards
+        self.assertEqual(TemplateChange.objects.count(), 1)
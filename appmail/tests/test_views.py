@@ -4,7 +4,7 @@ from django.contrib.auth.models import AnonymousUser, User
 from django.test import TestCase, RequestFactory
 from django.urls import reverse
 
-from .. import views
+from .. import jobs, views
 from ..forms import EmailTestForm
 from ..models import EmailTemplate
 
@@ -130,7 +130,7 @@ class ViewTests(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, template.name)
 
-    @mock.patch.object(EmailTestForm, 'send_emails')
+    @mock.patch.object(EmailTestForm, 'submit_job')
     def test_send_test_emails_POST(self, mock_send):
         user = User.objects.create(username='admin', password='password', is_staff=True)
         template = self.template
@@ -148,12 +148,92 @@ class ViewTests(TestCase):
             'reply_to': ['donotreply1@example.com'],
             'templates': template.pk
         }
+        mock_send.return_value = 'a' * 32
         response = self.client.post(url, payload)
         self.assertEqual(mock_send.call_count, 1)
-        mock_send.assert_called_once_with(response.wsgi_request)
+        mock_send.assert_called_once_with()
         self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            response.url,
+            '{}?templates={}'.format(
+                reverse('appmail:send_test_email_progress', kwargs={'job_id': 'a' * 32}),
+                template.pk
+            )
+        )
 
         # check that bad response returns 422
         response = self.client.post(url, {})
         self.assertEqual(mock_send.call_count, 1)
         self.assertEqual(response.status_code, 422)
+
+    @mock.patch('appmail.jobs.JOB_EXECUTOR', 'appmail.jobs.synchronous_executor')
+    def test_send_test_email_progress(self):
+        user = User.objects.create(username='admin', password='password', is_staff=True)
+        template = self.template
+        job_id = jobs.submit_test_emails([template], {}, to=['fred@example.com'])
+        progress_url = reverse('appmail:send_test_email_progress', kwargs={'job_id': job_id})
+        status_url = reverse('appmail:send_test_email_status', kwargs={'job_id': job_id})
+        response = self.client.get(progress_url)
+        self.assertEqual(response.status_code, 302)
+        self.client.force_login(user)
+        response = self.client.get(progress_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, status_url)
+        response = self.client.get(status_url)
+        self.assertEqual(response.status_code, 200)
+        job = response.json()
+        self.assertEqual(job['status'], jobs.STATUS_COMPLETE)
+        self.assertEqual(job['results'][0]['status'], jobs.RESULT_SENT)
+        # unknown jobs
+        missing = reverse('appmail:send_test_email_progress', kwargs={'job_id': 'b' * 32})
+        self.assertEqual(self.client.get(missing).status_code, 404)
+        missing = reverse('appmail:send_test_email_status', kwargs={'job_id': 'b' * 32})
+        self.assertEqual(self.client.get(missing).status_code, 404)
+
+    def test_render_template_matrix(self):
+        user = User.objects.create(username='admin', password='password', is_staff=True)
+        template = EmailTemplate(
+            name='matrix',
+            subject='Hello {{ user.first_name }}',
+            body_text='Hello',
+            body_html='<p>Hello</p>'
+        ).save()
+        template.clone()
+        EmailTemplate(
+            name='matrix',
+            language='fr',
+            subject='Bonjour {{ user.first_name }}',
+            body_text='Bonjour',
+            body_html='<p>Bonjour</p>'
+        ).save()
+        EmailTemplate(name='matrix', language='de', is_active=False).save()
+        url = '{}?name=matrix'.format(reverse('appmail:render_template_matrix'))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 302)
+        self.client.force_login(user)
+        with self.assertNumQueries(3):
+            # session, user, templates
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        previews = response.context['previews']
+        self.assertEqual(
+            [(t.language, t.version) for t, p in previews],
+            [('en-us', 0), ('en-us', 1), ('fr', 0)]
+        )
+        self.assertEqual(previews[2][1]['subject'], 'Bonjour FIRST_NAME')
+        response = self.client.get(reverse('appmail:render_template_matrix'))
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(url.replace('matrix', 'missing'))
+        self.assertEqual(response.status_code, 404)
+
+    def test__render_preview(self):
+        template = self.template
+        with mock.patch.object(EmailTemplate, 'render_subject', wraps=template.render_subject) as m:
+            preview = views._render_preview(template)
+            self.assertEqual(views._render_preview(template), preview)
+            self.assertEqual(m.call_count, 1)
+        self.assertEqual(preview['subject'], template.render_subject(template.test_context))
+        self.assertIsNone(preview['error'])
+        # errors are not cached
+        template.body_html = '{% if %}'
+        self.assertIsNotNone(views._render_preview(template)['error'])
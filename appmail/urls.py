@@ -4,9 +4,13 @@ except ImportError:
     from django.conf.urls import url as re_path
 
 from .views import (
+    profile_template,
     render_template_body,
+    render_template_matrix,
     render_template_subject,
-    send_test_email
+    send_test_email,
+    send_test_email_progress,
+    send_test_email_status,
 )
 
 app_name = 'appmail'
@@ -29,9 +33,29 @@ urlpatterns = [
         render_template_subject,
         name="render_template_subject"
     ),
+    re_path(
+        r'^templates/(?P<template_id>\d+)/profile/$',
+        profile_template,
+        name="profile_template"
+    ),
+    re_path(
+        r'^templates/preview/$',
+        render_template_matrix,
+        name="render_template_matrix"
+    ),
     re_path(
         r'^templates/test/$',
         send_test_email,
         name="send_test_email"
     ),
+    re_path(
+        r'^templates/test/(?P<job_id>[0-9a-f]{32})/$',
+        send_test_email_progress,
+        name="send_test_email_progress"
+    ),
+    re_path(
+        r'^templates/test/(?P<job_id>[0-9a-f]{32})/status.json$',
+        send_test_email_status,
+        name="send_test_email_status"
+    ),
 ]
@@ -7,14 +7,18 @@ import logging
 
 from django.conf import settings as django_settings
 from django.contrib.auth.decorators import user_passes_test
-from django.http import HttpResponse, HttpResponseRedirect
+from django.core.cache import caches
+from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse
 from django.shortcuts import get_object_or_404, render
 from django.views.decorators.clickjacking import xframe_options_sameorigin
 from django.urls import reverse
 
+from . import jobs, profiler
 from .forms import MultiEmailTemplateField, EmailTestForm
-from .helpers import merge_dicts
+from .helpers import content_hash, merge_dicts
+from .limits import RenderLimitExceeded
 from .models import EmailTemplate
+from .settings import PREVIEW_CACHE, PREVIEW_CACHE_TIMEOUT
 
 logger = logging.getLogger(__name__)
 
@@ -24,7 +28,10 @@ logger = logging.getLogger(__name__)
 def render_template_subject(request, template_id):
     """Render the template subject."""
     template = get_object_or_404(EmailTemplate, id=template_id)
-    html = template.render_subject(template.test_context)
+    try:
+        html = template.render_subject(template.test_context)
+    except RenderLimitExceeded as ex:
+        return HttpResponse(str(ex), status=422)
     return HttpResponse(html, content_type='text/plain')
 
 
@@ -34,7 +41,10 @@ def render_template_body(request, template_id, content_type):
     """Render the template body as plain text or HTML."""
     template = get_object_or_404(EmailTemplate, id=template_id)
     if content_type in (EmailTemplate.CONTENT_TYPE_PLAIN, EmailTemplate.CONTENT_TYPE_HTML):
-        html = template.render_body(template.test_context, content_type)
+        try:
+            html = template.render_body(template.test_context, content_type)
+        except RenderLimitExceeded as ex:
+            return HttpResponse(str(ex), status=422)
         return HttpResponse(html, content_type=content_type)
     # do not return the content_type to the user, as it is
     # user-generated and _could_ be a vulnerability.
@@ -45,8 +55,9 @@ def render_template_body(request, template_id, content_type):
 def send_test_email(request):
     """Intermediate admin action page for sending a single test email."""
     # use the field.to_python here as belt-and-braces - if it works here
-    # we can be confident that it'll work on the POST.
-    templates = MultiEmailTemplateField().to_python(request.GET['templates'])
+    # we can be confident that it'll work on the POST. The queryset is
+    # evaluated once, as it's used for the context, defaults and page.
+    templates = list(MultiEmailTemplateField().to_python(request.GET['templates']))
 
     if request.method == 'GET':
         contexts = merge_dicts(*[t.test_context for t in templates])
@@ -55,11 +66,10 @@ def send_test_email(request):
             'templates': request.GET['templates'],
             'context': context
         }
-        try:
-            template = templates.get()
-            initial['from_email'] = template.from_email
-            initial['reply_to'] = template.reply_to
-        except EmailTemplate.MultipleObjectsReturned:
+        if len(templates) == 1:
+            initial['from_email'] = templates[0].from_email
+            initial['reply_to'] = templates[0].reply_to
+        else:
             initial['from_email'] = django_settings.DEFAULT_FROM_EMAIL
             initial['reply_to'] = django_settings.DEFAULT_FROM_EMAIL
         form = EmailTestForm(initial=initial)
@@ -77,10 +87,10 @@ def send_test_email(request):
     if request.method == 'POST':
         form = EmailTestForm(request.POST)
         if form.is_valid():
-            form.send_emails(request)
+            job_id = form.submit_job()
             return HttpResponseRedirect(
                 '{}?{}'.format(
-                    reverse('appmail:send_test_email'),
+                    reverse('appmail:send_test_email_progress', kwargs={'job_id': job_id}),
                     request.GET.urlencode()
                 )
             )
@@ -96,3 +106,126 @@ def send_test_email(request):
                 },
                 status=422
             )
+
+
+@user_passes_test(lambda u: u.is_staff)
+def send_test_email_progress(request, job_id):
+    """Progress page for a background test email job."""
+    job = jobs.get_job(job_id)
+    if job is None:
+        raise Http404("Test email job not found.")
+    return render(
+        request,
+        'appmail/send_test_email_progress.html',
+        {
+            'job': job,
+            'status_url': reverse('appmail:send_test_email_status', kwargs={'job_id': job_id}),
+            'back_url': '{}?{}'.format(
+                reverse('appmail:send_test_email'),
+                request.GET.urlencode()
+            ),
+            # opts are used for rendering some page furniture - breadcrumbs etc.
+            'opts': EmailTemplate._meta,
+        }
+    )
+
+
+@user_passes_test(lambda u: u.is_staff)
+def send_test_email_status(request, job_id):
+    """Return background test email job progress as JSON (for polling)."""
+    job = jobs.get_job(job_id)
+    if job is None:
+        raise Http404("Test email job not found.")
+    return JsonResponse(job)
+
+
+def _render_preview(template):
+    """
+    Render template subject, text and HTML using its test_context.
+
+    Rendered output is cached by content hash, so unchanged templates are
+    not re-rendered on repeat visits.
+
+    """
+    key = 'appmail:preview:{}'.format(
+        content_hash(
+            template.engine_name,
+            template.subject,
+            template.body_text,
+            template.body_html,
+            template.test_context
+        )
+    )
+    cache = caches[PREVIEW_CACHE]
+    preview = cache.get(key)
+    if preview is not None:
+        return preview
+    preview = {'error': None}
+    try:
+        preview['subject'] = template.render_subject(template.test_context)
+        preview['body_text'] = template.render_body(
+            template.test_context, EmailTemplate.CONTENT_TYPE_PLAIN
+        )
+        preview['body_html'] = template.render_body(
+            template.test_context, EmailTemplate.CONTENT_TYPE_HTML
+        )
+    except Exception as ex:
+        # render errors are shown inline rather than failing the page, but
+        # they are not cached as they may depend on external state.
+        logger.debug("Error rendering template preview", exc_info=True)
+        preview['error'] = str(ex)
+        return preview
+    cache.set(key, preview, PREVIEW_CACHE_TIMEOUT)
+    return preview
+
+
+@user_passes_test(lambda u: u.is_staff)
+def render_template_matrix(request):
+    """Render every active language / version of a template on one page."""
+    name = request.GET.get('name')
+    if not name:
+        return HttpResponse("Template name must be specified.", status=400)
+    templates = list(
+        EmailTemplate.objects.active().with_bodies().filter(name=name).order_by('language', 'version')
+    )
+    if not templates:
+        raise Http404("No active templates named '{}'.".format(name))
+    # rendered in this thread - rendering is CPU bound, so worker threads
+    # would not be faster, and any DB access in them would leak connections
+    previews = [_render_preview(template) for template in templates]
+    return render(
+        request,
+        'appmail/preview_matrix.html',
+        {
+            'name': name,
+            'previews': list(zip(templates, previews)),
+            # opts are used for rendering some page furniture - breadcrumbs etc.
+            'opts': EmailTemplate._meta,
+        }
+    )
+
+
+@user_passes_test(lambda u: u.is_staff)
+def profile_template(request, template_id):
+    """Profile a render of the template's test_context (see appmail.profiler)."""
+    template = get_object_or_404(EmailTemplate, id=template_id)
+    error = None
+    with profiler.profiling() as profiles:
+        try:
+            template.render_subject(template.test_context)
+            template.render_body(template.test_context, EmailTemplate.CONTENT_TYPE_PLAIN)
+            template.render_body(template.test_context, EmailTemplate.CONTENT_TYPE_HTML)
+        except Exception as ex:
+            # the profile up to the error is still shown
+            logger.debug("Error profiling template", exc_info=True)
+            error = str(ex)
+    return render(
+        request,
+        'appmail/profile_template.html',
+        {
+            'template': template,
+            'profiles': profiles,
+            'error': error,
+            'opts': EmailTemplate._meta,
+        }
+    )
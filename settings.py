@@ -6,6 +6,11 @@ import dj_database_url
 DEBUG = True
 
 DATABASES = {'default': dj_database_url.config()}
+# a second alias, used to test replica routing - its test database is
+# separate (and not replicated to), so replication lag can be tested.
+DATABASES['replica'] = dict(DATABASES['default'])
+if 'sqlite' not in DATABASES['default'].get('ENGINE', ''):
+    DATABASES['replica']['TEST'] = {'NAME': 'test_appmail_replica'}
 
 INSTALLED_APPS = (
     'django.contrib.admin',
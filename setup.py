@@ -15,6 +15,9 @@ setup(
         'Django>=1.11',
         'psycopg2-binary',
     ],
+    extras_require={
+        'jinja2': ['Jinja2>=2.11'],
+    },
     include_package_data=True,
     description='Django app for managing localised email templates.',
     long_description=README,